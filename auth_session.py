@@ -0,0 +1,116 @@
+"""
+Cached Supabase auth sessions.
+
+Instead of signing in with a password on every run, a SessionManager keeps the
+access and refresh tokens in a local cache file (SUPABASE_SESSION_PATH, readable
+only by its owner) and reuses them while they are valid. Tokens are refreshed
+SUPABASE_SESSION_REFRESH_MARGIN seconds before they expire, by a background
+timer in long-running processes, and a password sign-in only happens when there
+is no cached session or its refresh token has been revoked. Steady-state runs
+make no auth calls at all.
+"""
+
+import os
+import json
+import time
+import threading
+
+
+class SessionManager:
+    """Keeps one Supabase client signed in as one user, backed by the token cache"""
+
+    def __init__(self, client, url, email, password, path=None, refresh_margin=None):
+        self.client = client
+        self.email = email
+        self.password = password
+        self.path = path or os.getenv('SUPABASE_SESSION_PATH', os.path.join('.cache', 'supabase_session.json'))
+        if refresh_margin is None:
+            refresh_margin = float(os.getenv('SUPABASE_SESSION_REFRESH_MARGIN', '300'))
+        self.refresh_margin = refresh_margin
+        self.auth_calls = 0
+        self._cache_key = f"{url}|{email}"
+        self._session = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _load_all(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, session):
+        """Persist a session returned by the SDK and return it as a cache entry"""
+        entry = {
+            'access_token': session.access_token,
+            'refresh_token': session.refresh_token,
+            'expires_at': session.expires_at or time.time() + session.expires_in
+        }
+        sessions = self._load_all()
+        sessions[self._cache_key] = entry
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(sessions, f)
+        os.replace(tmp_path, self.path)
+        return entry
+
+    def _fresh(self, entry):
+        return bool(entry) and entry['expires_at'] - time.time() > self.refresh_margin
+
+    def _use(self, entry):
+        """Send the session's access token with every request and schedule its refresh"""
+        self._session = entry
+        self.client.options.headers['Authorization'] = f"Bearer {entry['access_token']}"
+        self.client.postgrest.auth(entry['access_token'])
+
+        if self._timer:
+            self._timer.cancel()
+        delay = max(entry['expires_at'] - self.refresh_margin - time.time(), 1)
+        self._timer = threading.Timer(delay, self.authenticate)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def authenticate(self):
+        """
+        Make sure the client has a valid session, reusing or refreshing cached tokens when possible
+        Returns:
+            bool: True if the client has an authenticated session
+        """
+        with self._lock:
+            if self._fresh(self._session):
+                return True
+
+            # Another process may already have refreshed the tokens
+            entry = self._load_all().get(self._cache_key)
+            if self._fresh(entry):
+                self._use(entry)
+                print("Using cached Supabase session")
+                return True
+
+            if entry and entry.get('refresh_token'):
+                try:
+                    self.auth_calls += 1
+                    response = self.client.auth.refresh_session(entry['refresh_token'])
+                    self._use(self._store(response.session))
+                    print("Refreshed Supabase session")
+                    return True
+                except Exception as e:
+                    print(f"Could not refresh Supabase session, signing in again: {e}")
+
+            try:
+                self.auth_calls += 1
+                response = self.client.auth.sign_in_with_password({
+                    "email": self.email,
+                    "password": self.password
+                })
+                self._use(self._store(response.session))
+                print("Successfully authenticated with Supabase")
+                return True
+            except Exception as e:
+                print(f"Authentication error: {e}")
+                return False
@@ -0,0 +1,309 @@
+"""
+Offline end-to-end benchmarks for the agents.
+
+Brave and CoinGecko are served by a local HTTP server, Gemini and Supabase are
+replaced by in-process fakes and email goes to a local SMTP server (see
+fakes.py), so the real agent code paths run with no network access. Every
+repetition starts in a fresh working directory, so the caches start cold.
+
+For each scenario the suite reports wall time, throughput, p50/p99 latency per
+stage (estimated from the metrics histograms) and API calls per repetition.
+
+    python benchmarks/agents.py                          # every scenario
+    python benchmarks/agents.py info --topics 5 20 50 --modes serial async batched
+    python benchmarks/agents.py email --prices 1000 100000 --news 50
+    python benchmarks/agents.py email --recipients 1 200 --smtp-failure 0.05
+    python benchmarks/agents.py btc --samples 20
+    python benchmarks/agents.py reports --prices 50000
+    python benchmarks/agents.py info --brave-latency 0.2 --brave-429 0.05 --gemini-failure 0.02
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import (  # noqa: E402
+    Faults, CallCounter, FakeApiServer, FakeGeminiModel, FakeEmbedder, FakeSupabase, FakeSMTPServer
+)
+
+ENV = {
+    'SUPABASE_URL': 'http://supabase.invalid',
+    'SUPABASE_KEY': 'benchmark-key',
+    'SUPABASE_EMAIL': 'benchmark@example.com',
+    'SUPABASE_PASSWORD': 'benchmark',
+    'BRAVE_API_KEY': 'benchmark',
+    'GEMINI_API_KEY': 'benchmark',
+    'GMAIL_EMAIL': 'agent@example.com',
+    'GMAIL_APP_PASSWORD': 'benchmark',
+    'RECIPIENT_EMAIL': 'reader@example.com',
+    'SMTP_STARTTLS': '0',
+}
+
+
+class Environment:
+    """Starts the fakes and points the agents at them"""
+
+    def __init__(self, args):
+        self.args = args
+        self.counter = CallCounter()
+        self.api = FakeApiServer(
+            self.counter,
+            brave_faults=Faults(args.brave_latency, args.jitter, args.brave_429, args.brave_failure, seed=1),
+            coingecko_faults=Faults(args.coingecko_latency, args.jitter, args.coingecko_429, 0.0, seed=2),
+            results_per_query=args.results
+        )
+        self.smtp = FakeSMTPServer(self.counter, Faults(args.smtp_latency, args.jitter, 0.0, args.smtp_failure, seed=3))
+        self.supabase = FakeSupabase(self.counter, Faults(args.supabase_latency, args.jitter, seed=4))
+        gemini_faults = Faults(args.gemini_latency, args.jitter, args.gemini_429, args.gemini_failure, seed=5)
+        self.flash = FakeGeminiModel("gemini-1.5-flash-8b", self.counter, gemini_faults,
+                                     chunk_delay=args.gemini_chunk_delay)
+        self.embedder = FakeEmbedder(self.counter, Faults(args.gemini_latency / 2, args.jitter, seed=6))
+        self.pro = FakeGeminiModel("gemini-1.5-pro", self.counter, gemini_faults, words=400,
+                                   chunk_delay=args.gemini_chunk_delay)
+
+    def __enter__(self):
+        base_url = self.api.start()
+        smtp_host, smtp_port = self.smtp.start()
+        self.state_dir = tempfile.mkdtemp(prefix="bench-state-")
+        os.environ.update(ENV)
+        os.environ.update({
+            'BRAVE_API_URL': f"{base_url}/res/v1/web/search",
+            'COINGECKO_API_URL': f"{base_url}/api/v3",
+            'SMTP_HOST': smtp_host,
+            'SMTP_PORT': str(smtp_port),
+            'RATE_LIMIT_STATE_DIR': self.state_dir,
+        })
+        if not self.args.real_limits:
+            for name in ('BRAVE', 'GEMINI', 'COINGECKO'):
+                os.environ[f'RATE_LIMIT_{name}'] = "1000/1000"
+
+        import supabase_client
+        supabase_client.get_client = lambda url, key: self.supabase
+        return self
+
+    def __exit__(self, *exc):
+        self.api.stop()
+        self.smtp.stop()
+
+    def news_index(self):
+        """A local news index in the repetition's working directory, using the fake embedder"""
+        from news_index import NewsIndex
+        return NewsIndex(embed=self.embedder)
+
+    @contextlib.contextmanager
+    def repetition(self):
+        """A fresh working directory, session and writer for one repetition"""
+        import btc_agent
+        import supabase_client
+        previous = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="bench-run-"))
+        supabase_client._sessions.clear()
+        btc_agent._price_writer = None
+        output = sys.stdout if self.args.verbose else open(os.devnull, 'w')
+        try:
+            with contextlib.redirect_stdout(output):
+                yield
+        finally:
+            if output is not sys.stdout:
+                output.close()
+            os.chdir(previous)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(env, name, run, items, repeat):
+    """Run a scenario repeat times and summarize it"""
+    import metrics
+    metrics.reset()
+    before = env.counter.snapshot()
+    walls = []
+    for _ in range(repeat):
+        with env.repetition():
+            started = time.perf_counter()
+            run()
+            walls.append(time.perf_counter() - started)
+    after = env.counter.snapshot()
+
+    stages = {}
+    for stage, calls, seconds, errors in metrics.stage_summary():
+        stages[stage] = {
+            'calls': calls / repeat,
+            'p50': metrics.quantile('stage_duration_seconds', 0.5, stage=stage),
+            'p99': metrics.quantile('stage_duration_seconds', 0.99, stage=stage),
+            'errors': errors / repeat
+        }
+    return {
+        'scenario': name,
+        'wall_p50': statistics.median(walls),
+        'wall_p99': percentile(walls, 0.99),
+        'throughput': items / statistics.median(walls),
+        'stages': stages,
+        'api_calls': {key: (after.get(key, 0) - before.get(key, 0)) / repeat
+                      for key in sorted(after) if after.get(key, 0) != before.get(key, 0)}
+    }
+
+
+def info_scenarios(env, args):
+    from info_agent import InfoAgent
+    for topics in args.topics:
+        queries = [f"benchmark topic {i} market news" for i in range(topics)]
+        for mode in args.modes:
+            def run():
+                agent = InfoAgent()
+                agent.model = env.flash
+                agent.news_index = env.news_index()
+                if mode == 'async':
+                    asyncio.run(agent.run_async(queries))
+                elif mode == 'batched':
+                    agent.run_batched(queries)
+                else:
+                    agent.run(queries)
+            yield measure(env, f"info {mode} topics={topics}", run, topics, args.repeat)
+
+
+def btc_scenarios(env, args):
+    import btc_agent
+    btc_agent.MIN_SAMPLE_INTERVAL = 0
+
+    def run_once():
+        btc_agent.authenticate()
+        btc_agent.run_once()
+    yield measure(env, "btc run_once", run_once, 1, args.repeat)
+
+    for samples in args.samples:
+        def run_sampler():
+            btc_agent.authenticate()
+            btc_agent.run_sampler(0, ("bitcoin", "ethereum"), ("usd", "eur"), max_samples=samples)
+        yield measure(env, f"btc sampler polls={samples}", run_sampler, samples, args.repeat)
+
+
+def write_recipients(directory, count):
+    """A RECIPIENTS_FILE that brings the recipients, with RECIPIENT_EMAIL, to count"""
+    path = os.path.join(directory, f"recipients-{count}.csv")
+    with open(path, 'w') as f:
+        f.write("email,name\n")
+        for i in range(count - 1):
+            f.write(f"subscriber{i}@example.com,Subscriber {i}\n")
+    return path
+
+
+def email_scenarios(env, args):
+    from email_agent import EmailAgent
+    for recipients in args.recipients:
+        if recipients > 1:
+            os.environ['RECIPIENTS_FILE'] = write_recipients(env.state_dir, recipients)
+        else:
+            os.environ.pop('RECIPIENTS_FILE', None)
+        for prices in args.prices:
+            def run():
+                env.supabase.seed_prices(prices)
+                env.supabase.seed_news(args.news)
+                agent = EmailAgent()
+                agent.model = env.pro
+                agent.fallback_model = env.flash
+                agent.news_index = env.news_index()
+                agent.run()
+            yield measure(env, f"email prices={prices} news={args.news} recipients={recipients}",
+                          run, recipients, args.repeat)
+
+
+def reports_scenarios(env, args):
+    from email_agent import EmailAgent
+    import reports
+    os.environ.pop('RECIPIENTS_FILE', None)
+    specs = [
+        {'name': 'daily', 'hours': 24},
+        {'name': 'daily-desk', 'hours': 24, 'recipients': 'desk@example.com'},
+        {'name': 'three-day', 'hours': 72, 'resolution': 1800},
+        {'name': 'weekly', 'hours': 168, 'resolution': 3600},
+        {'name': 'weekly-desk', 'hours': 168, 'resolution': 3600, 'recipients': 'desk@example.com'},
+    ]
+
+    def run():
+        env.supabase.seed_prices(args.prices[0], hours=168)
+        env.supabase.seed_news(args.news, hours=168)
+        agent = EmailAgent()
+        agent.model = env.pro
+        agent.fallback_model = env.flash
+        agent.news_index = env.news_index()
+        reports.run_reports(agent, [dict(spec) for spec in specs])
+    yield measure(env, f"reports x{len(specs)} prices={args.prices[0]} news={args.news}", run, len(specs), args.repeat)
+
+
+def print_result(result):
+    print(f"\n{result['scenario']}")
+    print(f"  wall p50 {result['wall_p50']:.3f}s  p99 {result['wall_p99']:.3f}s  "
+          f"throughput {result['throughput']:.2f}/s")
+    for stage, row in sorted(result['stages'].items(), key=lambda item: -(item[1]['p50'] or 0) * item[1]['calls']):
+        errors = f"  errors {row['errors']:g}" if row['errors'] else ""
+        print(f"  {stage:<20} calls {row['calls']:7.1f}  p50 {row['p50'] * 1000:8.1f}ms  "
+              f"p99 {row['p99'] * 1000:8.1f}ms{errors}")
+    calls = ", ".join(f"{key} {value:g}" for key, value in result['api_calls'].items())
+    print(f"  api calls per run: {calls or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agents against local fake services")
+    parser.add_argument('scenarios', nargs='*', help="Scenarios to run: info, btc, email, reports (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions per scenario")
+    parser.add_argument('--topics', type=int, nargs='+', default=[5, 20], help="Topic counts for info")
+    parser.add_argument('--modes', nargs='+', choices=['serial', 'async', 'batched'],
+                        default=['serial', 'async', 'batched'], help="InfoAgent run modes")
+    parser.add_argument('--results', type=int, default=10, help="Brave results per query")
+    parser.add_argument('--samples', type=int, nargs='+', default=[20], help="Sampler polls for btc")
+    parser.add_argument('--prices', type=int, nargs='+', default=[1000, 50000], help="btc_price rows for email")
+    parser.add_argument('--news', type=int, default=50, help="finance_info rows for email")
+    parser.add_argument('--recipients', type=int, nargs='+', default=[1], help="Report recipients for email")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra latency per call (s)")
+    parser.add_argument('--brave-latency', type=float, default=0.05)
+    parser.add_argument('--brave-429', type=float, default=0.0, help="Share of Brave calls answered with 429")
+    parser.add_argument('--brave-failure', type=float, default=0.0, help="Share of Brave calls answered with 503")
+    parser.add_argument('--coingecko-latency', type=float, default=0.05)
+    parser.add_argument('--coingecko-429', type=float, default=0.0)
+    parser.add_argument('--gemini-latency', type=float, default=0.2, help="Gemini time to first token (s)")
+    parser.add_argument('--gemini-chunk-delay', type=float, default=0.02, help="Delay between streamed chunks (s)")
+    parser.add_argument('--gemini-429', type=float, default=0.0)
+    parser.add_argument('--gemini-failure', type=float, default=0.0)
+    parser.add_argument('--supabase-latency', type=float, default=0.02)
+    parser.add_argument('--smtp-latency', type=float, default=0.05)
+    parser.add_argument('--smtp-failure', type=float, default=0.0, help="Share of messages answered with 451")
+    parser.add_argument('--real-limits', action='store_true',
+                        help="Keep the production rate limits instead of lifting them")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the agents' own output")
+    args = parser.parse_args()
+
+    scenarios = {'info': info_scenarios, 'btc': btc_scenarios, 'email': email_scenarios, 'reports': reports_scenarios}
+    unknown = [name for name in args.scenarios if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    results = []
+    with Environment(args) as env:
+        for name in args.scenarios or list(scenarios):
+            for result in scenarios[name](env, args):
+                print_result(result)
+                results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    import metrics
+    metrics.reset()  # Nothing left for the exit-time export
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
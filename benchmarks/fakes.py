@@ -0,0 +1,553 @@
+"""
+Local stand-ins for the services the agents call.
+
+- FakeApiServer: a real HTTP server on 127.0.0.1 serving Brave web search
+  (shaped like docs/brave_response_object.md) and CoinGecko simple/price, so
+  requests go through http_client's pooled session and the shared rate limiter
+- FakeGeminiModel: drop-in for genai.GenerativeModel, answering the function-call
+  query rewrite, JSON batch summaries and (streamed) free text
+- FakeEmbedder: drop-in for the embedding function used by news_index
+- FakeSupabase: in-memory tables with the query builder calls the agents use,
+  plus password sign-in and token refresh
+- FakeSMTPServer: a minimal SMTP server on 127.0.0.1 (no TLS)
+
+Every fake takes a Faults object that injects latency, 429s and server errors,
+and counts its calls in a shared CallCounter.
+"""
+
+import json
+import time
+import random
+import threading
+import zlib
+import socketserver
+import numpy as np
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from price_store import to_epoch
+
+WORDS = (
+    "bitcoin ether market rally selloff inflation rates federal reserve treasury yields etf inflows "
+    "outflows miners hashrate halving liquidity volatility regulators exchange stablecoin custody "
+    "institutional demand futures options funding leverage liquidations earnings guidance dollar "
+    "equities nasdaq gold oil bonds recession growth jobs payrolls cpi ppi policy approval lawsuit"
+).split()
+
+
+class Faults:
+    """Latency and error injection for one fake service"""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=0.0, failure=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.failure = failure
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    def outcome(self):
+        """'rate_limited', 'error' or 'ok' for the next call"""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_limit:
+            return 'rate_limited'
+        if roll < self.rate_limit + self.failure:
+            return 'error'
+        return 'ok'
+
+
+class CallCounter:
+    """Thread-safe call counts keyed by service name"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class FakeApiError(Exception):
+    """Error with an HTTP-like status in .code, like google.api_core and postgrest errors"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _words(seed, count):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def brave_response(query, count):
+    """A WebSearchApiResponse with count distinct web results for query"""
+    slug = "-".join(query.lower().split())[:60]
+    results = []
+    for i in range(count):
+        url = f"https://news.example.com/{slug}/{i}"
+        results.append({
+            "type": "search_result",
+            "subtype": "generic",
+            "is_live": False,
+            "title": f"{query.title()}: {_words(f'{query}-title-{i}', 8)}",
+            "url": url,
+            "description": _words(f"{query}-description-{i}", 40),
+            "language": "en",
+            "family_friendly": True,
+            "age": f"{i + 1} hours ago",
+            "meta_url": {"scheme": "https", "netloc": "news.example.com", "hostname": "news.example.com",
+                         "path": f"/{slug}/{i}"}
+        })
+    return {
+        "type": "search",
+        "query": {"original": query, "altered": query, "is_navigational": False},
+        "web": {"type": "search", "results": results, "family_friendly": True}
+    }
+
+
+class FakeApiServer:
+    """HTTP server for Brave web search and CoinGecko simple/price on a local port"""
+
+    def __init__(self, counter, brave_faults=None, coingecko_faults=None, results_per_query=10):
+        self.counter = counter
+        self.brave_faults = brave_faults or Faults()
+        self.coingecko_faults = coingecko_faults or Faults()
+        self.results_per_query = results_per_query
+        self._server = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so client connection reuse is exercised
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _faulted(self, service, faults):
+                server.counter.add(service)
+                faults.delay()
+                outcome = faults.outcome()
+                if outcome == 'rate_limited':
+                    server.counter.add(f"{service}_429")
+                    self._send(429, {"error": "rate limited"}, {"Retry-After": "1"})
+                    return True
+                if outcome == 'error':
+                    server.counter.add(f"{service}_5xx")
+                    self._send(503, {"error": "unavailable"})
+                    return True
+                return False
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == "/res/v1/web/search":
+                    if self._faulted('brave', server.brave_faults):
+                        return
+                    query = params.get("q", "")
+                    self._send(200, brave_response(query, server.results_per_query), {
+                        "ETag": f'"{abs(hash(query))}"',
+                        "X-RateLimit-Limit": "1000, 1000000",
+                        "X-RateLimit-Remaining": "999, 999999",
+                        "X-RateLimit-Reset": "1, 2592000"
+                    })
+                elif url.path == "/api/v3/simple/price":
+                    if self._faulted('coingecko', server.coingecko_faults):
+                        return
+                    now = int(time.time())
+                    payload = {
+                        asset: {
+                            **{currency: round(60000 + 500 * random.random(), 2)
+                               for currency in params.get("vs_currencies", "usd").split(",")},
+                            "last_updated_at": now
+                        }
+                        for asset in params.get("ids", "bitcoin").split(",")
+                    }
+                    self._send(200, payload)
+                else:
+                    self._send(404, {"error": "not found"})
+
+        return Handler
+
+    def start(self):
+        """Start serving in a background thread; returns the base URL"""
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class FakeGeminiModel:
+    """Stands in for genai.GenerativeModel, including streamed responses"""
+
+    def __init__(self, model_name, counter, faults=None, words=120, chunk_words=12, chunk_delay=0.0):
+        self.model_name = model_name
+        self.counter = counter
+        self.faults = faults or Faults()
+        self.words = words
+        self.chunk_words = chunk_words
+        self.chunk_delay = chunk_delay
+
+    @staticmethod
+    def _usage(prompt, text):
+        return SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+
+    def _response(self, prompt, text, parts=None):
+        parts = parts or [SimpleNamespace(text=text)]
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))],
+            usage_metadata=self._usage(prompt, text)
+        )
+
+    def _answer(self, prompt, generation_config, tools):
+        if tools:
+            topic = prompt.rsplit("Find the latest news about:", 1)[-1].strip()
+            call = SimpleNamespace(function_call=SimpleNamespace(name="search_news", args={"query": f'"{topic} news"'}))
+            return None, [call]
+        if getattr(generation_config, 'response_mime_type', None) == "application/json":
+            topic_ids = sorted({int(line.split(":", 1)[0].split()[1])
+                                for line in prompt.splitlines() if line.strip().startswith("Topic ")})
+            entries = [{"topic_id": topic_id, "summary": _words(f"{prompt[:64]}-{topic_id}", self.words // 2)}
+                       for topic_id in topic_ids]
+            return json.dumps(entries), None
+        return _words(prompt[-256:], self.words), None
+
+    def _stream(self, prompt, text):
+        words = text.split(" ")
+        for start in range(0, len(words), self.chunk_words):
+            if start and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            chunk = " ".join(words[start:start + self.chunk_words])
+            chunk = chunk + " " if start + self.chunk_words < len(words) else chunk
+            yield SimpleNamespace(text=chunk, usage_metadata=self._usage(prompt, text))
+
+    def generate_content(self, prompt, stream=False, generation_config=None, tools=None, tool_config=None, **kwargs):
+        self.counter.add(f"gemini:{self.model_name}")
+        self.faults.delay()
+        outcome = self.faults.outcome()
+        if outcome == 'rate_limited':
+            self.counter.add("gemini_429")
+            raise FakeApiError(429, "Resource has been exhausted")
+        if outcome == 'error':
+            self.counter.add("gemini_5xx")
+            raise FakeApiError(503, "The service is currently unavailable")
+
+        text, parts = self._answer(prompt, generation_config, tools)
+        if parts:
+            return self._response(prompt, "", parts)
+        if stream:
+            return self._stream(prompt, text)
+        return self._response(prompt, text)
+
+
+class FakeEmbedder:
+    """Stands in for the Gemini embedding endpoint with hashed bag-of-words vectors"""
+
+    model_name = "fake-embedding"
+
+    def __init__(self, counter, faults=None, dim=256):
+        self.counter = counter
+        self.faults = faults or Faults()
+        self.dim = dim
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode('utf-8')) % self.dim] += 1.0
+        return vector
+
+    def __call__(self, texts, task_type):
+        vectors = []
+        for start in range(0, len(texts), 100):
+            self.counter.add("gemini_embed")
+            self.faults.delay()
+            vectors.extend(self._vector(text) for text in texts[start:start + 100])
+        return np.asarray(vectors, dtype=np.float32)
+
+
+_OPS = {'gt': lambda a, b: a > b, 'gte': lambda a, b: a >= b,
+        'lt': lambda a, b: a < b, 'lte': lambda a, b: a <= b, 'eq': lambda a, b: a == b}
+
+
+def _split_conditions(text):
+    """Split a PostgREST logic tree on its top-level commas"""
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "()":
+            depth += 1 if char == "(" else -1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    return parts + [current]
+
+
+def _predicate(column, op, value):
+    # Timestamps are compared as instants, like Postgres does, not as strings
+    if column == 'timestamp':
+        value = to_epoch(value)
+        return lambda row: op(to_epoch(row[column]), value)
+    return lambda row: op(row.get(column), value)
+
+
+def _condition(text):
+    """A row predicate for a PostgREST condition such as id.gt.5 or and(a.eq.1,b.gt.2)"""
+    if text.startswith(('and(', 'or(')):
+        name, _, inner = text.partition('(')
+        parts = [_condition(part) for part in _split_conditions(inner[:-1])]
+        combine = all if name == 'and' else any
+        return lambda row: combine(part(row) for part in parts)
+    column, op, value = text.split('.', 2)
+    value = value[1:-1] if value.startswith('"') else (int(value) if value.lstrip('-').isdigit() else value)
+    return _predicate(column, _OPS[op], value)
+
+
+class _FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.filters = []
+        self.columns = None
+        self.rows = None
+        self.upsert = self._write
+        self.insert = self._write
+        self.sort = []
+        self.window = None
+
+    def select(self, columns, **kwargs):
+        self.columns = [column.strip() for column in columns.split(",")]
+        return self
+
+    def _write(self, rows, **kwargs):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def _filter(self, op):
+        def apply(column, value):
+            self.filters.append(_predicate(column, op, value))
+            return self
+        return apply
+
+    def __getattr__(self, name):
+        if name in _OPS:
+            return self._filter(_OPS[name])
+        raise AttributeError(name)
+
+    def or_(self, filters):
+        self.filters.append(_condition(f"or({filters})"))
+        return self
+
+    def order(self, column, desc=False):
+        self.sort.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end + 1)
+        return self
+
+    def limit(self, count):
+        self.window = (0, count)
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+
+class FakeSupabase:
+    """In-memory Supabase client covering table queries, inserts and auth"""
+
+    def __init__(self, counter, faults=None, token_lifetime=3600):
+        self.counter = counter
+        self.faults = faults or Faults()
+        self.tables = {}
+        self.token_lifetime = token_lifetime
+        self.options = SimpleNamespace(headers={})
+        self.postgrest = SimpleNamespace(auth=lambda token: None)
+        self.auth = SimpleNamespace(sign_in_with_password=self._sign_in, refresh_session=self._refresh)
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def _with_id(self, row):
+        """Copy of row with a generated id, like an identity primary key"""
+        with self._lock:
+            row = {'id': self._next_id, **row}
+            self._next_id += 1
+        return row
+
+    def _session(self):
+        self.faults.delay()
+        now = int(time.time())
+        return SimpleNamespace(session=SimpleNamespace(
+            access_token=f"access-{now}-{random.random()}",
+            refresh_token=f"refresh-{now}-{random.random()}",
+            expires_at=now + self.token_lifetime,
+            expires_in=self.token_lifetime
+        ))
+
+    def _sign_in(self, credentials):
+        self.counter.add("supabase_auth")
+        return self._session()
+
+    def _refresh(self, refresh_token):
+        self.counter.add("supabase_auth")
+        return self._session()
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        self.counter.add("supabase")
+        raise FakeApiError(404, f"function {name} does not exist")
+
+    def _execute(self, query):
+        self.counter.add("supabase")
+        self.faults.delay()
+        outcome = self.faults.outcome()
+        if outcome != 'ok':
+            self.counter.add("supabase_errors")
+            raise FakeApiError(503 if outcome == 'error' else 429, "Supabase unavailable")
+
+        if query.rows is not None:
+            written = [self._with_id(row) for row in query.rows]
+            with self._lock:
+                self.tables.setdefault(query.table, []).extend(written)
+            return SimpleNamespace(data=written)
+        with self._lock:
+            selected = [row for row in self.tables.get(query.table, []) if all(match(row) for match in query.filters)]
+        # Like Postgres, promise nothing about the order of rows that tie on every sort column
+        random.shuffle(selected)
+        for column, desc in reversed(query.sort):
+            key = (lambda row: to_epoch(row[column])) if column == 'timestamp' else (lambda row: row[column])
+            selected.sort(key=key, reverse=desc)
+        if query.window:
+            selected = selected[query.window[0]:query.window[1]]
+        if query.columns and query.columns != ['*']:
+            selected = [{column: row[column] for column in query.columns if column in row} for row in selected]
+        return SimpleNamespace(data=selected)
+
+    def seed_prices(self, count, hours=24, price=60000.0):
+        """Fill btc_price with count evenly spaced readings over the last hours (naive UTC ISO timestamps)"""
+        from datetime import datetime, timedelta
+        end = datetime.utcnow()
+        step = timedelta(hours=hours) / max(count, 1)
+        rng = random.Random(count)
+        rows = []
+        for i in range(count):
+            price *= 1 + rng.gauss(0, 0.001)
+            rows.append({"price": round(price, 2), "timestamp": (end - step * (count - i)).isoformat(),
+                         "asset": "bitcoin", "currency": "usd"})
+        self.tables["btc_price"] = [self._with_id(row) for row in rows]
+
+    def seed_news(self, count, hours=24):
+        """Fill finance_info with count summaries over the last hours"""
+        from datetime import datetime, timedelta
+        end = datetime.utcnow()
+        step = timedelta(hours=hours) / max(count, 1)
+        self.tables["finance_info"] = [
+            self._with_id({"info": _words(f"news-{i}", 80), "timestamp": (end - step * (count - i)).isoformat()})
+            for i in range(count)
+        ]
+
+
+class FakeSMTPServer:
+    """Minimal plaintext SMTP server accepting AUTH PLAIN and any message"""
+
+    def __init__(self, counter, faults=None):
+        self.counter = counter
+        self.faults = faults or Faults()
+        self._server = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+            def handle(self):
+                server.counter.add("smtp_connections")
+                self.reply("220 localhost fake ESMTP")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode('utf-8', 'replace').strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    if verb == "EHLO":
+                        self.reply("250-localhost")
+                        self.reply("250-AUTH PLAIN LOGIN")
+                        self.reply("250 8BITMIME")
+                    elif verb == "AUTH":
+                        server.counter.add("smtp_logins")
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif verb == "RCPT":
+                        server.counter.add("smtp_recipients")
+                        self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        size = 0
+                        while True:
+                            data = self.rfile.readline()
+                            if not data or data in (b".\r\n", b".\n"):
+                                break
+                            size += len(data)
+                        server.faults.delay()
+                        if server.faults.outcome() != 'ok':
+                            server.counter.add("smtp_errors")
+                            self.reply("451 4.3.0 Temporary failure")
+                            continue
+                        server.counter.add("smtp_messages")
+                        server.counter.add("smtp_bytes", size)
+                        self.reply("250 OK queued")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        return Handler
+
+    def start(self):
+        """Start serving in a background thread; returns (host, port)"""
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,95 @@
+"""
+Cold-start benchmark for the agent entry points.
+
+Each module is imported in a fresh interpreter several times; the median wall
+time is reported together with the heaviest imports from `python -X importtime`.
+With --baseline the results are compared against a previous run and the script
+exits non-zero if any module got slower than the allowed regression.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --baseline .cache/startup.json --update-baseline
+    python benchmarks/startup.py --baseline .cache/startup.json --max-regression 0.2
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+MODULES = ('info_agent', 'btc_agent', 'email_agent')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(args):
+    result = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    return result
+
+
+def import_time(module, runs=5):
+    """Median seconds to import module in a fresh interpreter"""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    samples = [float(_run(['-c', code]).stdout.strip().splitlines()[-1]) for _ in range(runs)]
+    return statistics.median(samples)
+
+
+def heaviest_imports(module, top=5):
+    """Top-level packages with the largest cumulative import time, in seconds"""
+    result = _run(['-X', 'importtime', '-c', f"import {module}"])
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        # The outermost import of each package carries its full cost, so keep the maximum
+        package = name.split('.')[0]
+        totals[package] = max(totals.get(package, 0), int(cumulative) / 1e6)
+    for name in (module, 'site', 'encodings'):
+        totals.pop(name, None)
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure agent import (cold start) times")
+    parser.add_argument('--runs', type=int, default=5, help="Imports per module (median is reported)")
+    parser.add_argument('--baseline', help="JSON file with previous results to compare against")
+    parser.add_argument('--update-baseline', action='store_true', help="Write this run's results to --baseline")
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help="Allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        results[module] = import_time(module, args.runs)
+        heaviest = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in heaviest_imports(module))
+        print(f"{module:<12} {results[module]:.3f}s  (heaviest: {heaviest})")
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressed = False
+    for module, seconds in results.items():
+        if module not in baseline:
+            continue
+        change = seconds / baseline[module] - 1
+        status = "REGRESSION" if change > args.max_regression else "ok"
+        regressed = regressed or status == "REGRESSION"
+        print(f"{module:<12} {baseline[module]:.3f}s -> {seconds:.3f}s ({change:+.0%}) {status}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
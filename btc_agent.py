@@ -1,8 +1,16 @@
 import requests
-from supabase import create_client
 import os
+import time
+import signal
+import argparse
+import threading
 from dotenv import load_dotenv
 from datetime import datetime
+from rate_limiter import send_with_retry, RateLimitExceeded
+import http_client
+from buffered_writer import BufferedWriter
+import supabase_client
+import metrics
 
 load_dotenv(override=True)
 
@@ -12,24 +20,53 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_EMAIL = os.getenv("SUPABASE_EMAIL")
 SUPABASE_PASSWORD = os.getenv("SUPABASE_PASSWORD")
 
-if not all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_EMAIL, SUPABASE_PASSWORD]):
-    raise ValueError("Missing Supabase credentials. Please check your .env file.")
+_price_writer = None
 
-# Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+def _require_credentials():
+    if not all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_EMAIL, SUPABASE_PASSWORD]):
+        raise ValueError("Missing Supabase credentials. Please check your .env file.")
+
+def get_supabase():
+    """Returns the shared Supabase client, creating it (and importing the SDK) on first use"""
+    _require_credentials()
+    return supabase_client.get_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Authenticate with Supabase
 def authenticate():
-    try:
-        response = supabase.auth.sign_in_with_password({
-            "email": SUPABASE_EMAIL,
-            "password": SUPABASE_PASSWORD
-        })
-        print("Successfully authenticated with Supabase")
-        return True
-    except Exception as e:
-        print(f"Authentication error: {e}")
-        return False
+    _require_credentials()
+    return supabase_client.authenticate(SUPABASE_URL, SUPABASE_KEY, SUPABASE_EMAIL, SUPABASE_PASSWORD)
+
+COINGECKO_PRICE_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3") + "/simple/price"
+
+# The public CoinGecko API allows roughly 30 calls per minute
+MIN_SAMPLE_INTERVAL = float(os.getenv("BTC_SAMPLER_MIN_INTERVAL", "2"))
+
+def get_prices(ids=("bitcoin",), vs_currencies=("usd",)):
+    """
+    Fetches current prices for several assets in one CoinGecko simple/price request.
+    
+    Args:
+        ids (iterable): CoinGecko asset ids, e.g. ("bitcoin", "ethereum")
+        vs_currencies (iterable): Quote currencies, e.g. ("usd", "eur")
+    
+    Returns:
+        dict: {asset: {currency: price, "last_updated_at": unix time}}
+    
+    Raises:
+        requests.RequestException: If the request fails after retries
+        RateLimitExceeded: If CoinGecko asked us to wait longer than RATE_LIMIT_MAX_WAIT
+    """
+    params = {
+        "ids": ",".join(ids),
+        "vs_currencies": ",".join(vs_currencies),
+        "include_last_updated_at": "true"
+    }
+    
+    # Make the API request under the shared CoinGecko rate limit
+    with metrics.timed('coingecko_prices'):
+        response = send_with_retry('coingecko', lambda: http_client.get(COINGECKO_PRICE_URL, params=params))
+    response.raise_for_status()  # Raise an exception for bad status codes
+    return response.json()
 
 def get_btc_price():
     """
@@ -40,65 +77,155 @@ def get_btc_price():
         None: If there's an error fetching the price
     """
     try:
-        # CoinGecko API endpoint for Bitcoin price
-        url = "https://api.coingecko.com/api/v3/simple/price"
-        
-        # Parameters for the API request
-        params = {
-            "ids": "bitcoin",
-            "vs_currencies": "usd"
-        }
-        
-        # Make the API request
-        response = requests.get(url, params=params)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        
         # Extract the price from the response
-        data = response.json()
+        data = get_prices()
         btc_price = data["bitcoin"]["usd"]
         
         return btc_price
     
-    except requests.RequestException as e:
+    except (requests.RequestException, RateLimitExceeded) as e:
         print(f"Error fetching Bitcoin price: {e}")
         return None
     except (KeyError, ValueError) as e:
         print(f"Error parsing Bitcoin price data: {e}")
         return None
 
+def get_price_writer():
+    """
+    Returns the buffered writer for the btc_price table, creating it on first use
+    so journaled rows are only replayed after authentication.
+    """
+    global _price_writer
+    if _price_writer is None:
+        _price_writer = BufferedWriter(get_supabase(), 'btc_price')
+    return _price_writer
+
 def store_btc_price(price):
     """
-    Stores the Bitcoin price in Supabase database.
+    Queues the Bitcoin price for a buffered write to the Supabase database.
     
     Args:
         price (float): Bitcoin price to store
     
     Returns:
-        bool: True if successful, False otherwise
+        bool: True if the price was queued, False otherwise
     """
     try:
         data = {
             "price": price,
             "timestamp": datetime.utcnow().isoformat(),
+            "asset": "bitcoin",
+            "currency": "usd",
         }
         
-        # Insert into Supabase
-        result = supabase.table('btc_price').insert(data).execute()
-        print(f"Successfully stored BTC price: ${price:,.2f}")
+        # Written in bulk by the background writer, or journaled if Supabase is down
+        get_price_writer().write(data)
+        print(f"Queued BTC price for storage: ${price:,.2f}")
         return True
         
     except Exception as e:
         print(f"Error storing price in database: {e}")
         return False
 
+def run_sampler(interval, ids=("bitcoin",), vs_currencies=("usd",), max_samples=None, stop_event=None):
+    """
+    Polls CoinGecko at a fixed interval and queues every new reading for bulk insert.
+    
+    Readings whose CoinGecko last_updated_at has not moved since the previous poll are
+    skipped, so polling faster than the API refreshes does not store duplicates. Every
+    row carries "asset" and "currency" columns (see sql/btc_price_asset_currency.sql),
+    which readers filter on so other pairs never mix into the BTC/USD series.
+    
+    Args:
+        interval (float): Seconds between polls, clamped to BTC_SAMPLER_MIN_INTERVAL
+        ids (iterable): CoinGecko asset ids
+        vs_currencies (iterable): Quote currencies
+        max_samples (int): Stop after this many polls, None to run until stopped
+        stop_event (threading.Event): Set to stop the sampler
+    
+    Returns:
+        int: Number of readings queued
+    """
+    interval = max(interval, MIN_SAMPLE_INTERVAL)
+    stop_event = stop_event or threading.Event()
+    last_updated = {}
+    writer = get_price_writer()
+    queued = 0
+    polls = 0
+    
+    print(f"Sampling {', '.join(ids)} in {', '.join(vs_currencies)} every {interval:g}s...")
+    next_poll = time.monotonic()
+    while not stop_event.is_set() and (max_samples is None or polls < max_samples):
+        polls += 1
+        try:
+            data = get_prices(ids, vs_currencies)
+            timestamp = datetime.utcnow().isoformat()
+            rows = []
+            for asset in ids:
+                quote = data.get(asset, {})
+                updated_at = quote.get("last_updated_at")
+                if updated_at is not None and last_updated.get(asset) == updated_at:
+                    continue
+                last_updated[asset] = updated_at
+                for currency in vs_currencies:
+                    if currency not in quote:
+                        continue
+                    rows.append({"price": quote[currency], "timestamp": timestamp,
+                                 "asset": asset, "currency": currency})
+            if rows:
+                writer.write_many(rows)
+                queued += len(rows)
+        except (requests.RequestException, RateLimitExceeded, ValueError) as e:
+            print(f"Error sampling prices: {e}")
+        
+        # Schedule from the previous poll so request latency does not add drift
+        next_poll += interval
+        stop_event.wait(max(0.0, next_poll - time.monotonic()))
+    
+    writer.flush()
+    print(f"Sampler stopped after {polls} polls, {queued} readings queued")
+    return queued
+
+def run_once():
+    """
+    Fetches the current Bitcoin price and writes it to Supabase.
+    
+    Returns:
+        float: The stored price
+        None: If the price could not be fetched
+    """
+    price = get_btc_price()
+    if not price:
+        print("Failed to fetch Bitcoin price")
+        return None
+    print(f"Current Bitcoin price: ${price:,.2f} USD")
+    store_btc_price(price)
+    get_price_writer().flush()
+    return price
+
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch and store crypto prices")
+    parser.add_argument("--sample", action="store_true",
+                        help="Keep polling instead of storing a single price")
+    parser.add_argument("--interval", type=float, default=float(os.getenv("BTC_SAMPLER_INTERVAL", "60")),
+                        help="Seconds between polls in sampler mode")
+    parser.add_argument("--assets", default="bitcoin",
+                        help="Comma separated CoinGecko ids to sample")
+    parser.add_argument("--vs", default="usd",
+                        help="Comma separated quote currencies to sample")
+    parser.add_argument("--count", type=int, default=None,
+                        help="Stop the sampler after this many polls")
+    args = parser.parse_args()
+
     if authenticate():
-        price = get_btc_price()
-        if price:
-            print(f"Current Bitcoin price: ${price:,.2f} USD")
-            store_btc_price(price)
+        if args.sample:
+            stop = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+            signal.signal(signal.SIGINT, lambda *_: stop.set())
+            run_sampler(args.interval, [a.strip() for a in args.assets.split(",")],
+                        [c.strip() for c in args.vs.split(",")], args.count, stop)
         else:
-            print("Failed to fetch Bitcoin price")
+            run_once()
     else:
         print("Failed to authenticate with Supabase")
@@ -0,0 +1,223 @@
+"""
+Buffered, journaled writes to Supabase.
+
+Agents hand rows to a BufferedWriter instead of inserting them one by one. A
+background thread flushes the buffer as a multi-row insert once SUPABASE_BATCH_SIZE
+rows are waiting or SUPABASE_FLUSH_INTERVAL seconds have passed. Rows that cannot
+be written are appended to a local JSON-lines journal (SUPABASE_JOURNAL_DIR) and
+replayed the next time a writer for that table starts, so nothing is dropped when
+Supabase is unreachable.
+
+Rows Supabase rejects outright (constraint violations, malformed values) would
+fail the same way on every replay, so they are not journaled. The failing chunk is
+split until the bad rows are found, and those rows are moved to
+<table>.rejected.jsonl next to the journal for inspection. Unknown columns and
+tables are journaled instead, because they clear up once a pending migration is
+applied.
+
+If SUPABASE_UPSERT_KEY names a unique column, every row gets a generated
+idempotency key in that column and is upserted, so journal replays can never
+create duplicates.
+"""
+
+import os
+import json
+import uuid
+import atexit
+import threading
+import metrics
+
+# Connection failures and auth errors can clear up on their own, so rows hitting them are journaled
+_TRANSIENT_STATUSES = (401, 403, 408, 429)
+_TRANSIENT_SQLSTATES = ('08', '40', '53', '57')  # Connection, rollback, resources, operator intervention
+_SCHEMA_SQLSTATES = ('42703', '42P01')  # Undefined column or table, until the migration adding it is applied
+
+
+def _is_rejection(error):
+    """
+    Whether a write failed because of the rows themselves rather than an outage
+    Args:
+        error (Exception): Error raised by the insert
+    Returns:
+        bool: True for PostgREST 4xx errors that a retry would hit again
+    """
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return 400 <= code < 500 and code not in _TRANSIENT_STATUSES
+    if not isinstance(code, str) or not code:
+        return False
+    if code.startswith('PGRST'):
+        # PGRST1xx are malformed requests. PGRST0xx are connection errors, PGRST2xx schema cache
+        # misses such as a column whose migration has not been applied yet, and PGRST3xx expired JWTs
+        return code[5:6] == '1'
+    if code == '42501' or code in _SCHEMA_SQLSTATES:
+        return False  # Row level security denies an anonymous role after a lost session, or a pending migration
+    return len(code) == 5 and not code.startswith(_TRANSIENT_SQLSTATES)
+
+
+class BufferedWriter:
+    """Collects rows for one table and writes them in bulk off the caller's thread"""
+
+    def __init__(self, supabase, table, max_rows=None, max_delay=None, journal_dir=None, upsert_key=None):
+        self.supabase = supabase
+        self.table = table
+        self.max_rows = max_rows or int(os.getenv('SUPABASE_BATCH_SIZE', '50'))
+        self.max_delay = max_delay or float(os.getenv('SUPABASE_FLUSH_INTERVAL', '5'))
+        self.upsert_key = upsert_key or os.getenv('SUPABASE_UPSERT_KEY')
+        journal_dir = journal_dir or os.getenv('SUPABASE_JOURNAL_DIR', os.path.join('.cache', 'journal'))
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, f"{table}.jsonl")
+        self.rejected_path = os.path.join(journal_dir, f"{table}.rejected.jsonl")
+
+        self._buffer = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+
+        self.replay()
+        self._thread = threading.Thread(target=self._run, name=f"writer-{table}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, row):
+        """Queue a row for writing; returns immediately"""
+        self.write_many([row])
+
+    def write_many(self, rows):
+        """Queue several rows for writing; returns immediately"""
+        if self.upsert_key:
+            rows = [{self.upsert_key: str(uuid.uuid4()), **row} for row in rows]
+        with self._cond:
+            self._buffer.extend(rows)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self.max_rows,
+                    timeout=self.max_delay
+                )
+                if self._closed:
+                    return
+            self.flush()
+
+    def _insert(self, chunk):
+        with metrics.timed('supabase_write', table=self.table):
+            query = self.supabase.table(self.table)
+            if self.upsert_key:
+                query = query.upsert(chunk, on_conflict=self.upsert_key, ignore_duplicates=True)
+            else:
+                query = query.insert(chunk)
+            query.execute()
+        metrics.inc('rows_total', len(chunk), table=self.table, operation='write')
+        metrics.observe_size('payload_bytes', len(json.dumps(chunk)), direction='request', host='supabase')
+
+    def _write_chunk(self, chunk):
+        """
+        Insert one chunk, halving it to isolate rows Supabase rejects
+        Returns:
+            list: Rows to journal because Supabase could not be reached
+        """
+        try:
+            self._insert(chunk)
+            return []
+        except Exception as e:
+            if not _is_rejection(e):
+                print(f"Error writing {len(chunk)} rows to {self.table}: {e}")
+                return chunk
+            if len(chunk) == 1:
+                self._reject(chunk[0], e)
+                return []
+        middle = len(chunk) // 2
+        failed = self._write_chunk(chunk[:middle])
+        if failed:
+            return failed + chunk[middle:]
+        return self._write_chunk(chunk[middle:])
+
+    def _send(self, rows):
+        """Write rows in chunks of max_rows; returns the rows that could not be written"""
+        for start in range(0, len(rows), self.max_rows):
+            failed = self._write_chunk(rows[start:start + self.max_rows])
+            if failed:
+                return failed + rows[start + self.max_rows:]
+        return []
+
+    def _reject(self, row, error):
+        """Set aside a row Supabase will never accept"""
+        with self._journal_lock:
+            with open(self.rejected_path, 'a') as f:
+                f.write(json.dumps({'row': row, 'error': str(error)}) + "\n")
+        metrics.inc('rows_total', table=self.table, operation='rejected')
+        print(f"{self.table} rejected a row ({error}); moved it to {self.rejected_path}")
+
+    def _spill(self, rows):
+        """Append unwritten rows to the local journal"""
+        with self._journal_lock:
+            with open(self.journal_path, 'a') as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+        print(f"Saved {len(rows)} rows for {self.table} to {self.journal_path} for replay")
+
+    def flush(self):
+        """
+        Write everything buffered so far
+        Returns:
+            bool: True if every row reached Supabase, False if some were journaled
+        """
+        with self._flush_lock:
+            with self._cond:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return True
+            failed = self._send(rows)
+            if failed:
+                self._spill(failed)
+                return False
+            print(f"Successfully stored {len(rows)} rows in {self.table}")
+            return True
+
+    def replay(self):
+        """Retry rows journaled by earlier runs, including a replay that was interrupted"""
+        replay_path = f"{self.journal_path}.replaying"
+        with self._journal_lock:
+            if os.path.exists(self.journal_path):
+                if os.path.exists(replay_path):
+                    # A run crashed mid-replay; keep its rows and add the newer ones
+                    with open(self.journal_path, 'rb') as src, open(replay_path, 'rb+') as dst:
+                        end = dst.seek(0, os.SEEK_END)
+                        if end:
+                            dst.seek(end - 1)
+                            if dst.read(1) != b"\n":
+                                dst.write(b"\n")  # The crash may have cut the last line short
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, replay_path)
+            elif not os.path.exists(replay_path):
+                return
+
+        rows = []
+        with open(replay_path) as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    if line.strip():
+                        print(f"Skipping a damaged line in {replay_path}")
+        print(f"Replaying {len(rows)} journaled rows for {self.table}")
+        failed = self._send(rows)
+        if failed:
+            self._spill(failed)
+        os.remove(replay_path)
+
+    def close(self):
+        """Stop the background thread and flush whatever is left"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,160 @@
+"""
+Headless chart rendering for the email report.
+
+Charts are drawn with matplotlib's object-oriented API on an Agg canvas, never
+touching pyplot's global state, so rendering is safe from worker threads and
+processes. Timestamps go on a real datetime axis, long series are decimated
+with Largest-Triangle-Three-Buckets (CHART_MAX_POINTS) before drawing, and the
+PNG is rendered into memory. Rendered images are cached by a hash of the data,
+in memory and under CHART_CACHE_DIR, so unchanged data is never redrawn.
+"""
+
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+from price_store import to_epoch
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling
+    Args:
+        x (ndarray): Ascending x values
+        y (ndarray): y values
+        threshold (int): Number of points to keep
+    Returns:
+        ndarray: Indices of the kept points, always including the first and last
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket edges for the n - 2 interior points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The next bucket's average is the third vertex; the last bucket uses the final point
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+class ChartRenderer:
+    """Renders price charts to PNG bytes with decimation and caching"""
+
+    def __init__(self, max_points=None, cache_dir=None, cache_size=8):
+        self.max_points = max_points or int(os.getenv('CHART_MAX_POINTS', '500'))
+        self.cache_dir = cache_dir or os.getenv('CHART_CACHE_DIR', os.path.join('.cache', 'charts'))
+        self.cache_size = cache_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, timestamps, prices, title, currency):
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(timestamps, dtype='<f8').tobytes())
+        digest.update(np.ascontiguousarray(prices, dtype='<f8').tobytes())
+        digest.update(f"{title}|{currency}|{self.max_points}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        path = os.path.join(self.cache_dir, f"{key}.png")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                image = f.read()
+            self._remember(key, image)
+            return image
+        return None
+
+    def _remember(self, key, image):
+        with self._lock:
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.cache_size:
+                self._memory.popitem(last=False)
+
+    def _prune_disk_cache(self, keep=32):
+        """Delete all but the most recently written cached charts"""
+        paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.png')]
+        for path in sorted(paths, key=os.path.getmtime, reverse=True)[keep:]:
+            os.remove(path)
+
+    def _draw(self, timestamps, prices, title, currency):
+        figure = Figure(figsize=(10, 5))
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        dates = (np.asarray(timestamps) * 1e6).astype('datetime64[us]')
+        axes.plot(dates, prices, marker='o' if len(prices) <= 100 else None, linewidth=1.2)
+        axes.set_title(title)
+        axes.set_xlabel('Time (UTC)')
+        axes.set_ylabel(f"Price ({currency.upper()})")
+        locator = mdates.AutoDateLocator()
+        axes.xaxis.set_major_locator(locator)
+        axes.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        axes.grid(True, alpha=0.3)
+        figure.tight_layout()
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format='png')
+        return buffer.getvalue()
+
+    def render(self, timestamps, prices, title='BTC Price Over Time', currency='usd'):
+        """
+        Render a price series to PNG
+        Args:
+            timestamps (ndarray): Ascending Unix seconds
+            prices (ndarray): Prices aligned with timestamps
+            title (str): Chart title
+            currency (str): Quote currency shown on the price axis
+        Returns:
+            bytes: PNG image
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        prices = np.asarray(prices, dtype=float)
+        key = self._cache_key(timestamps, prices, title, currency)
+        image = self._cached(key)
+        if image is not None:
+            return image
+
+        kept = lttb(timestamps, prices, self.max_points)
+        image = self._draw(timestamps[kept], prices[kept], title, currency)
+
+        self._remember(key, image)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = os.path.join(self.cache_dir, f"{key}.png.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(image)
+            os.replace(tmp_path, os.path.join(self.cache_dir, f"{key}.png"))
+            self._prune_disk_cache()
+        except OSError as e:
+            print(f"Could not cache chart: {e}")
+        return image
+
+    def render_price_data(self, price_data, title='BTC Price Over Time', currency='usd'):
+        """Render report rows as returned by EmailAgent.fetch_recent_data (newest first)"""
+        timestamps = np.array([to_epoch(row['timestamp']) for row in price_data])
+        prices = np.array([row['price'] for row in price_data], dtype=float)
+        order = np.argsort(timestamps, kind='stable')
+        return self.render(timestamps[order], prices[order], title, currency)
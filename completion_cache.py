@@ -0,0 +1,156 @@
+"""
+On-disk cache for Gemini completions.
+
+Entries are keyed by a SHA-256 hash of the model name, prompt, generation config,
+tools and tool config, so a retried or re-triggered run gets the same answer back
+from a local SQLite file instead of paying for the call again. Entries expire after
+GEMINI_CACHE_TTL seconds and the least recently used ones are evicted once there are
+more than GEMINI_CACHE_MAX_ENTRIES. Set GEMINI_CACHE_BYPASS=1 to skip cache reads;
+fresh results are still written back.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import dataclasses
+from rate_limiter import call_with_retry
+import metrics
+
+
+def _normalize(value):
+    """Turn SDK config objects into plain JSON-serialisable data for hashing"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {k: _normalize(v) for k, v in dataclasses.asdict(value).items() if v is not None}
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+def record_usage(model_name, prompt, response):
+    """Record prompt size and token usage reported on a Gemini response"""
+    metrics.observe_size('payload_bytes', len(prompt.encode('utf-8')), direction='request', host='gemini')
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        metrics.inc('tokens_total', getattr(usage, 'prompt_token_count', 0) or 0, model=model_name, kind='prompt')
+        metrics.inc('tokens_total', getattr(usage, 'candidates_token_count', 0) or 0, model=model_name, kind='output')
+
+
+class CompletionCache:
+    """
+    Content-addressed, size-bounded completion cache backed by SQLite.
+    Safe to share between the worker threads of InfoAgent.run_async.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None, bypass=None):
+        self.path = path or os.getenv('GEMINI_CACHE_PATH', os.path.join('.cache', 'gemini_completions.sqlite'))
+        self.ttl = ttl if ttl is not None else float(os.getenv('GEMINI_CACHE_TTL', str(24 * 3600)))
+        self.max_entries = max_entries or int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '1000'))
+        if bypass is None:
+            bypass = os.getenv('GEMINI_CACHE_BYPASS', '').lower() in ('1', 'true', 'yes')
+        self.bypass = bypass
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, prompt, **request_options):
+        """
+        Hash everything that influences the completion
+        Args:
+            model_name (str): Gemini model name
+            prompt (str): Prompt text
+            request_options: generation_config, tools, tool_config, ...
+        Returns:
+            str: Hex digest identifying the request
+        """
+        payload = json.dumps(
+            {'model': model_name, 'prompt': prompt, 'options': _normalize(request_options)},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached value for key or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                metrics.inc('cache_requests_total', cache='gemini_completion', result='miss')
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+                metrics.inc('cache_requests_total', cache='gemini_completion', result='expired')
+                return None
+            metrics.inc('cache_requests_total', cache='gemini_completion', result='hit')
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a JSON-serialisable value and evict least recently used entries over the limit"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._conn.execute(
+                """DELETE FROM completions WHERE key NOT IN (
+                       SELECT key FROM completions ORDER BY last_used DESC LIMIT ?
+                   )""",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def lookup(self, model, prompt, **request_options):
+        """Return a cached completion for this request without calling Gemini, or None"""
+        if self.bypass:
+            return None
+        return self.get(self.make_key(model.model_name, prompt, **request_options))
+
+    def generate(self, model, prompt, extract, **request_options):
+        """
+        Return a cached completion or call Gemini and cache the extracted result
+        Args:
+            model (GenerativeModel): Model to call on a cache miss
+            prompt (str): Prompt text
+            extract (callable): Turns the raw response into a JSON-serialisable value
+            request_options: Keyword arguments forwarded to generate_content
+        Returns:
+            The extracted value, or None if extract returned None
+        """
+        key = self.make_key(model.model_name, prompt, **request_options)
+        if not self.bypass:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+        with metrics.timed('gemini_generate', model=model.model_name):
+            response = call_with_retry('gemini', model.generate_content, prompt, **request_options)
+        record_usage(model.model_name, prompt, response)
+        value = extract(response)
+        if value is not None:
+            self.set(key, value)
+        return value
@@ -0,0 +1,156 @@
+"""
+Cross-topic, cross-run deduplication of news articles.
+
+Articles are recognised by their canonical URL (scheme, www., tracking params,
+fragments and trailing slashes ignored) and by a 64-bit SimHash of their title
+and description, so the same story syndicated under different URLs is also
+caught. The index is kept in a JSON file (DEDUP_INDEX_PATH) for
+DEDUP_RETENTION_HOURS, so articles summarized by an earlier run are skipped too.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'cmpid', 'guccounter')
+
+FINGERPRINT_BITS = 64
+BAND_BITS = 16  # 4 bands: two fingerprints within 3 bits must share at least one band exactly
+
+
+def canonicalize_url(url):
+    """Normalize a URL so trivially different links to one article compare equal"""
+    if not url:
+        return ''
+    parts = urlsplit(url.strip())
+    if not parts.netloc:
+        return ''
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('', host, path, urlencode(query), ''))
+
+
+def simhash(text, shingle_size=3):
+    """64-bit SimHash over word shingles of text"""
+    words = re.findall(r"\w+", text.lower())
+    shingles = [' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def estimate_tokens(text):
+    """Rough token count for English prompt text (about 4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class DedupIndex:
+    """Persistent index of already-seen articles, safe to share between threads"""
+
+    def __init__(self, path=None, retention_hours=None, max_distance=None):
+        self.path = path or os.getenv('DEDUP_INDEX_PATH', os.path.join('.cache', 'article_index.json'))
+        self.retention = 3600 * (retention_hours if retention_hours is not None
+                                 else float(os.getenv('DEDUP_RETENTION_HOURS', '48')))
+        self.max_distance = max_distance if max_distance is not None else int(os.getenv('DEDUP_MAX_DISTANCE', '3'))
+        self.dropped = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+        self._entries = {}  # canonical url -> {'fingerprint': int, 'seen_at': float}
+        self._bands = {}    # (band number, band value) -> set of fingerprints
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        cutoff = time.time() - self.retention
+        for url, entry in entries.items():
+            if entry['seen_at'] >= cutoff:
+                self._remember(url, entry['fingerprint'], entry['seen_at'])
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << BAND_BITS) - 1
+        return [(band, fingerprint >> (band * BAND_BITS) & mask) for band in range(FINGERPRINT_BITS // BAND_BITS)]
+
+    def _remember(self, url, fingerprint, seen_at):
+        self._entries[url] = {'fingerprint': fingerprint, 'seen_at': seen_at}
+        for key in self._band_keys(fingerprint):
+            self._bands.setdefault(key, set()).add(fingerprint)
+
+    def _near_duplicate(self, fingerprint):
+        for key in self._band_keys(fingerprint):
+            for other in self._bands.get(key, ()):
+                if bin(fingerprint ^ other).count('1') <= self.max_distance:
+                    return True
+        return False
+
+    def _key(self, article):
+        """Index key and fingerprint for an article"""
+        fingerprint = simhash(f"{article.get('title', '')} {article.get('description', '')}")
+        return canonicalize_url(article.get('url')) or f"simhash:{fingerprint}", fingerprint
+
+    def add(self, article):
+        """
+        Register an article unless it has been seen before
+        Args:
+            article (dict): Article with 'title', 'description' and 'url'
+        Returns:
+            bool: True if the article is new, False if it is a repeat
+        """
+        key, fingerprint = self._key(article)
+        with self._lock:
+            if key in self._entries or self._near_duplicate(fingerprint):
+                return False
+            self._remember(key, fingerprint, time.time())
+            return True
+
+    def discard(self, articles):
+        """Forget articles whose summary was never stored, so a later run retries them"""
+        with self._lock:
+            for article in articles:
+                self._entries.pop(self._key(article)[0], None)
+            self._bands = {}
+            entries, self._entries = self._entries, {}
+            for url, entry in entries.items():
+                self._remember(url, entry['fingerprint'], entry['seen_at'])
+
+    def record_dropped(self, prompt_text):
+        """Account for an article that was left out of a prompt"""
+        with self._lock:
+            self.dropped += 1
+            self.tokens_saved += estimate_tokens(prompt_text)
+
+    def save(self):
+        """Write the index to disk, dropping entries older than the retention window"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            entries = {url: entry for url, entry in self._entries.items() if entry['seen_at'] >= cutoff}
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving article index: {e}")
+
+    def report(self):
+        """One-line summary of what deduplication saved in this run"""
+        return f"Skipped {self.dropped} repeated articles, saving ~{self.tokens_saved} prompt tokens"
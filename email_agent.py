@@ -1,15 +1,36 @@
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-from supabase import create_client
 from datetime import datetime, timedelta
-import smtplib
 from email.mime.base import MIMEBase
 from email import encoders
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import matplotlib.pyplot as plt
 import traceback
+import threading
+import numpy as np
+from completion_cache import CompletionCache
+from price_store import PriceStore, ohlc, to_epoch, to_iso
+from market_stats import stats_from_price_data, format_market_stats, price_move_queries
+from news_index import open_index, top_k
+from dedup_index import estimate_tokens
+from prompt_budget import fit_news
+from mail_delivery import Mailer, load_recipients
+import supabase_client
+import gemini_stream
+import metrics
+
+# Names used in prompts, subjects and charts, keyed by CoinGecko asset id
+ASSET_LABELS = {
+    'bitcoin': ('Bitcoin', 'BTC'),
+    'ethereum': ('Ethereum', 'ETH'),
+    'solana': ('Solana', 'SOL'),
+}
+
+
+def asset_labels(asset):
+    """(name, ticker) for an asset id"""
+    return ASSET_LABELS.get(asset, (asset.title(), asset.upper()))
+
 
 class EmailAgent:
     """
@@ -29,60 +50,243 @@ class EmailAgent:
             'SUPABASE_PASSWORD': os.getenv('SUPABASE_PASSWORD'),
             'GEMINI_API_KEY': os.getenv('GEMINI_API_KEY'),
             'GMAIL_EMAIL': os.getenv('GMAIL_EMAIL'),
-            'GMAIL_APP_PASSWORD': os.getenv('GMAIL_APP_PASSWORD'),
-            'RECIPIENT_EMAIL': os.getenv('RECIPIENT_EMAIL')
+            'GMAIL_APP_PASSWORD': os.getenv('GMAIL_APP_PASSWORD')
         }
+        # RECIPIENT_EMAIL may list several addresses; RECIPIENTS_FILE adds subscribers from a CSV
+        self.recipients = load_recipients(os.getenv('RECIPIENT_EMAIL'), os.getenv('RECIPIENTS_FILE'))
         
-        if not all(self.required_vars.values()):
+        if not all(self.required_vars.values()) or not self.recipients:
             raise ValueError("Missing required environment variables")
 
-        # Initialize clients
-        self.supabase = create_client(
-            self.required_vars['SUPABASE_URL'], 
-            self.required_vars['SUPABASE_KEY']
-        )
-        genai.configure(api_key=self.required_vars['GEMINI_API_KEY'])
-        self.model = genai.GenerativeModel("gemini-1.5-pro")
+        # Clients are created on first use so the SDKs only load on paths that need them
+        self._supabase = None
+        self._model = None
+        self._fallback_model = None
+        self._chart_renderer = None
+        self._news_index = None
+        self._index_lock = threading.Lock()
+        self.completion_cache = CompletionCache()
+        use_price_store = os.getenv('PRICE_STORE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+        self.price_stores = {} if use_price_store else None  # (asset, currency) -> PriceStore
+
+    @property
+    def supabase(self):
+        """Shared Supabase client, created on first use"""
+        if self._supabase is None:
+            self._supabase = supabase_client.get_client(
+                self.required_vars['SUPABASE_URL'], self.required_vars['SUPABASE_KEY']
+            )
+        return self._supabase
+
+    @supabase.setter
+    def supabase(self, client):
+        self._supabase = client
+
+    @property
+    def model(self):
+        """Gemini model, created (and the SDK imported) on first use"""
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.required_vars['GEMINI_API_KEY'])
+            self._model = genai.GenerativeModel("gemini-1.5-pro")
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    @property
+    def fallback_model(self):
+        """Cheaper model used when the main one runs over its latency budget"""
+        if self._fallback_model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.required_vars['GEMINI_API_KEY'])
+            self._fallback_model = genai.GenerativeModel(gemini_stream.FALLBACK_MODEL)
+        return self._fallback_model
+
+    @fallback_model.setter
+    def fallback_model(self, model):
+        self._fallback_model = model
+
+    @property
+    def news_index(self):
+        """Embedding index of stored summaries (see news_index.py), or None when NEWS_INDEX_BACKEND=off"""
+        # Report windows select news on worker threads; they must share one index over the cache files
+        with self._index_lock:
+            if self._news_index is None:
+                index = open_index(self.supabase)
+                self._news_index = False if index is None else index  # False: checked, backend is off
+            return None if self._news_index is False else self._news_index
+
+    @news_index.setter
+    def news_index(self, index):
+        self._news_index = index
+
+    @property
+    def chart_renderer(self):
+        """Chart renderer, created (and matplotlib imported) when the first chart is drawn"""
+        if self._chart_renderer is None:
+            from chart_renderer import ChartRenderer
+            self._chart_renderer = ChartRenderer()
+        return self._chart_renderer
     
     def authenticate(self):
         """Authenticate with Supabase"""
+        return supabase_client.authenticate(
+            self.required_vars['SUPABASE_URL'],
+            self.required_vars['SUPABASE_KEY'],
+            self.required_vars['SUPABASE_EMAIL'],
+            self.required_vars['SUPABASE_PASSWORD']
+        )
+
+    def _fetch_keyset(self, table, columns, since, page_size=None, until=None, filters=None):
+        """
+        Fetch rows newer than since in (timestamp, id) order, one keyset page at a time
+        Args:
+            table (str): Table name
+            columns (str): Comma separated columns to select; id is always added
+            since (str): ISO timestamp lower bound (exclusive)
+            page_size (int): Rows per request, defaults to SUPABASE_PAGE_SIZE
+            until (str): Optional ISO timestamp upper bound (inclusive)
+            filters (dict): Optional column -> value equality filters
+        Returns:
+            list: Rows in ascending timestamp order
+        """
+        page_size = page_size or int(os.getenv('SUPABASE_PAGE_SIZE', '1000'))
+        if 'id' not in [column.strip() for column in columns.split(',')]:
+            columns = f"{columns},id"
+        rows = []
+        last = None
+        while True:
+            query = self.supabase.table(table).select(columns).gt('timestamp', since)
+            if last is not None:
+                # Rows can share a timestamp (one per pair per poll), so id breaks ties
+                timestamp = f'"{last["timestamp"]}"'
+                query = query.or_(f"timestamp.gt.{timestamp},and(timestamp.eq.{timestamp},id.gt.{last['id']})")
+            if until:
+                query = query.lte('timestamp', until)
+            for column, value in (filters or {}).items():
+                query = query.eq(column, value)
+            page = query.order('timestamp').order('id').limit(page_size).execute().data or []
+            metrics.inc('rows_total', len(page), table=table, operation='read')
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            last = page[-1]
+
+    @staticmethod
+    def _candle_rows(candles):
+        """Turn ohlc() arrays into report rows, newest first"""
+        return [
+            {
+                'timestamp': to_iso(candles['bucket'][i]),
+                'price': float(candles['close'][i]),
+                'open': float(candles['open'][i]),
+                'high': float(candles['high'][i]),
+                'low': float(candles['low'][i]),
+                'close': float(candles['close'][i]),
+                'samples': int(candles['samples'][i])
+            }
+            for i in range(len(candles['bucket']) - 1, -1, -1)
+        ]
+
+    def price_store(self, asset='bitcoin', currency='usd'):
+        """Local price store for one pair, or None when PRICE_STORE_ENABLED is off"""
+        if self.price_stores is None:
+            return None
+        if (asset, currency) not in self.price_stores:
+            self.price_stores[(asset, currency)] = PriceStore(asset=asset, currency=currency)
+        return self.price_stores[(asset, currency)]
+
+    def fetch_price_buckets(self, since, resolution, asset='bitcoin', currency='usd'):
+        """
+        Fetch prices for one pair as OHLC buckets, newest first
+        Args:
+            since (str): ISO timestamp lower bound
+            resolution (int): Bucket width in seconds
+            asset (str): CoinGecko asset id in btc_price's asset column
+            currency (str): Quote currency in btc_price's currency column
+        Returns:
+            list: Dicts with timestamp, price (the close) and open/high/low/close/samples
+        """
+        pair = {'asset': asset, 'currency': currency}
+        store = self.price_store(asset, currency)
+        if store is not None:
+            try:
+                # Only rows newer than the local high-water mark leave the database
+                added = store.sync(
+                    lambda start, until=None: self._fetch_keyset(
+                        'btc_price', 'timestamp,price', start, until=until, filters=pair
+                    ),
+                    to_epoch(since)
+                )
+                print(f"Synced {added} new {asset}/{currency} prices into the local store")
+                return self._candle_rows(store.resample(to_epoch(since), resolution))
+            except Exception as e:
+                print(f"Local price store unavailable ({e}), querying Supabase")
+
         try:
-            self.supabase.auth.sign_in_with_password({
-                "email": self.required_vars['SUPABASE_EMAIL'],
-                "password": self.required_vars['SUPABASE_PASSWORD']
-            })
-            print("Successfully authenticated with Supabase")
-            return True
+            candles = self.supabase.rpc(
+                'btc_price_ohlc',
+                {'since': since, 'bucket_seconds': resolution, 'price_asset': asset, 'price_currency': currency}
+            ).execute().data
+            metrics.inc('rows_total', len(candles or []), table='btc_price_ohlc', operation='read')
+            return [
+                {'timestamp': candle['bucket'], 'price': candle['close'], **candle}
+                for candle in candles or []
+            ]
         except Exception as e:
-            print(f"Authentication error: {e}")
-            return False
+            print(f"btc_price_ohlc unavailable ({e}), aggregating locally")
+            rows = self._fetch_keyset('btc_price', 'timestamp,price', since, filters=pair)
+            timestamps = np.array([to_epoch(row['timestamp']) for row in rows])
+            prices = np.array([row['price'] for row in rows], dtype=float)
+            return self._candle_rows(ohlc(timestamps, prices, resolution))
 
-    def fetch_recent_data(self, hours=24):
-        """Fetch recent data from both tables"""
+    def fetch_news(self, since, recent=None):
+        """
+        Fetch news rows newer than since
+        Args:
+            since (str): ISO timestamp lower bound
+            recent (list): Rows stored earlier in this process (newest first). They may still sit in the
+                write buffer or journal, so they are taken from memory and only older rows are read
+        Returns:
+            list: News rows, newest first
+        """
+        recent = [row for row in recent or [] if to_epoch(row['timestamp']) > to_epoch(since)]
+        until = min((row['timestamp'] for row in recent), key=to_epoch) if recent else None
+        # Only the columns the report uses
+        stored = self._fetch_keyset('finance_info', 'info,timestamp', since, until=until)[::-1]
+        known = {row['info'] for row in recent}
+        news_data = recent + [row for row in stored if row['info'] not in known]
+        print(f"News data received: {len(news_data)} records ({len(recent)} from this run)")
+        return news_data
+
+    def fetch_recent_data(self, hours=24, resolution=None, news_data=None):
+        """
+        Fetch recent data from both tables
+        Args:
+            hours (int): Size of the window in hours
+            resolution (int): Price bucket width in seconds, defaults to REPORT_RESOLUTION_SECONDS
+            news_data (list): News rows stored earlier in this process (newest first); see fetch_news
+        Returns:
+            tuple: (price buckets, news rows), both newest first, or (None, None) on error
+        """
         try:
+            resolution = resolution or int(os.getenv('REPORT_RESOLUTION_SECONDS', '900'))
+
             # Calculate time threshold
             time_threshold = (datetime.utcnow() - timedelta(hours=hours)).isoformat()+"Z"
             print(f"\nFetching data since: {time_threshold}")
             
-            # Fetch recent BTC prices
-            price_response = self.supabase.table('btc_price') \
-                .select('*') \
-                .gt('timestamp', time_threshold) \
-                .order('timestamp', desc=True) \
-                .execute()
-            
-            print(f"Price data received: {len(price_response.data) if price_response.data else 0} records")
+            with metrics.timed('fetch_recent_data'):
+                # Fetch recent BTC prices, aggregated so the transfer does not grow with sampling rate
+                price_data = self.fetch_price_buckets(time_threshold, resolution)
+                
+                print(f"Price data received: {len(price_data)} buckets of {resolution}s")
+                
+                news_data = self.fetch_news(time_threshold, news_data)
             
-            # Fetch recent news
-            news_response = self.supabase.table('finance_info') \
-                .select('*') \
-                .gt('timestamp', time_threshold) \
-                .order('timestamp', desc=True) \
-                .execute()
-            
-            print(f"News data received: {len(news_response.data) if news_response.data else 0} records")
-            
-            return price_response.data, news_response.data
+            return price_data, news_data
 
         except Exception as e:
             print(f"\nError fetching data: {e}")
@@ -90,33 +294,101 @@ class EmailAgent:
             traceback.print_exc()
             return None, None
 
-    def generate_analysis(self, price_data, news_data):
-        """Generate analysis using Gemini API"""
+    def select_relevant_news(self, price_data, news_data, market_stats=None, asset='bitcoin'):
+        """
+        Keep the news most relevant to the window's price moves
+        Args:
+            price_data (list): Price buckets, newest first
+            news_data (list): News rows, newest first
+            market_stats (dict): Statistics already computed for price_data
+            asset (str): Asset the prices are for
+        Returns:
+            list: At most REPORT_NEWS_TOP_K rows, still newest first; all rows if the index is off
+        """
+        k = int(os.getenv('REPORT_NEWS_TOP_K', '40'))
+        if k <= 0 or len(news_data) <= k or self.news_index is None:
+            return news_data
         try:
-            # Format price data
-            price_text = "\nBTC Price Data:\n"
-            for price in price_data[:10]:  # Last 10 price points
-                price_text += f"Price: ${price['price']:.2f} at {price['timestamp']}\n"
+            if market_stats is None:
+                market_stats = stats_from_price_data(price_data)
+            queries = price_move_queries(market_stats, asset_labels(asset)[0])
+            vectors = self.news_index.vectors_for(
+                [news['info'] for news in news_data], [news.get('timestamp') for news in news_data]
+            )
+            rows, scores = top_k(vectors, self.news_index.embed_queries(queries), k)
+            print(f"Selected {len(rows)} of {len(news_data)} news records by relevance to "
+                  f"{len(queries)} price moves (similarity {scores.min():.2f}-{scores.max():.2f})")
+            return [news_data[i] for i in sorted(rows)]
+        except Exception as e:
+            print(f"Error selecting relevant news, using all of it: {e}")
+            return news_data
+
+    def _condense_news(self, text, max_tokens):
+        """Condense news summaries with the cheap model; used for news that does not fit the prompt"""
+        import google.generativeai as genai
+        prompt = f"""Condense the following financial news summaries into terse bullet points of at most
+        {max(1, max_tokens * 3 // 4)} words in total. Merge overlapping stories and keep figures, names and dates.
+
+        {text}"""
+        return gemini_stream.generate_text(
+            self.fallback_model,
+            prompt,
+            cache=self.completion_cache,
+            generation_config=genai.types.GenerationConfig(temperature=0.2, max_output_tokens=max_tokens)
+        )
 
-            # Format news data
-            news_text = "\nRecent Financial News:\n"
-            for news in news_data:
-                news_text += f"- {news['info']}\n"
+    def generate_analysis(self, price_data, news_data, market_stats=None, asset='bitcoin', currency='usd'):
+        """
+        Generate analysis using Gemini API
+        Args:
+            price_data (list): Price buckets, newest first
+            news_data (list): News rows, newest first
+            market_stats (dict): Statistics already computed for price_data
+            asset (str): Asset the prices are for
+            currency (str): Quote currency of the prices
+        Returns:
+            str: The analysis, or None on error
+        """
+        try:
+            # Summarize the whole price window numerically instead of pasting raw rows
+            if market_stats is None:
+                market_stats = stats_from_price_data(price_data)
+            name, ticker = asset_labels(asset)
+            quoted = "" if currency == 'usd' else f" (prices in {currency.upper()})"
+            price_text = f"\n{ticker} Market Statistics{quoted}:\n" + format_market_stats(market_stats) + "\n"
 
             # Create analysis prompt
-            analysis_prompt = f"""As a professional financial analyst, analyze the following Bitcoin price data 
+            prompt_template = f"""As a professional financial analyst, analyze the following {name} price statistics 
             and related financial news. Focus on identifying correlations between news events and price movements, 
-            and provide a concise, professional analysis. Include potential implications for Bitcoin's near-term outlook.
+            and provide a concise, professional analysis. Include potential implications for {name}'s near-term outlook.
 
-            {price_text}
+            {{price_text}}
 
-            {news_text}
+            {{news_text}}
 
             Provide a professional analysis in a clear, concise format suitable for an email report."""
 
+            # Fit the news into whatever the budget leaves after the fixed parts
+            budget = int(os.getenv('PROMPT_TOKEN_BUDGET', '8000'))
+            fixed_tokens = estimate_tokens(prompt_template.format(price_text=price_text, news_text=""))
+            news_text, news_stats = fit_news(
+                [news['info'] for news in news_data], budget - fixed_tokens, condense=self._condense_news
+            )
+            analysis_prompt = prompt_template.format(price_text=price_text, news_text=news_text)
+
+            prompt_tokens = estimate_tokens(analysis_prompt)
+            metrics.observe('prompt_tokens', prompt_tokens, buckets=metrics.SIZE_BUCKETS, prompt='analysis')
+            print(f"Analysis prompt: ~{prompt_tokens} tokens (budget {budget}); news: {news_stats['included']} "
+                  f"of {news_stats['total']} included, {news_stats['condensed']} condensed, "
+                  f"{news_stats['duplicates']} duplicates and {news_stats['dropped']} dropped")
+
             # Generate analysis
-            response = self.model.generate_content(
+            import google.generativeai as genai
+            return gemini_stream.generate_text(
+                self.model,
                 analysis_prompt,
+                cache=self.completion_cache,
+                fallback_model=self.fallback_model,
                 generation_config=genai.types.GenerationConfig(
                     temperature=0.7,
                     candidate_count=1,
@@ -125,97 +397,124 @@ class EmailAgent:
                     max_output_tokens=800
                 )
             )
-            
-            return response.text
         except Exception as e:
             print(f"Error generating analysis: {e}")
             return None
 
-    def send_email(self, recipient_email, analysis, price_data):
-        """Send email with analysis nd attachment of BTC price plot"""
+    def _prerender_chart(self, price_data):
         try:
-             # Create plot
-            
-            # Prepare data for plotting
-            timestamps = [price['timestamp'] for price in price_data]
-            prices = [price['price'] for price in price_data]
-
-            plt.figure(figsize=(10, 5))
-            plt.plot(timestamps, prices, marker='o')
-            plt.title('BTC Price Over Time')
-            plt.xlabel('Time')
-            plt.ylabel('Price (USD)')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-
-            # Save plot as an image
-            plot_filename = 'btc_price_plot.png'
-            plt.savefig(plot_filename)
-            plt.close()
-
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.required_vars['GMAIL_EMAIL']
-            msg['To'] = recipient_email
-            msg['Subject'] = f"Bitcoin Market Analysis Report - {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}"
+            self.chart_renderer.render_price_data(price_data)
+        except Exception as e:
+            print(f"Error rendering chart: {e}")
 
-            # Add analysis to email body
-            body = f"""
-            Bitcoin Market Analysis Report
-            Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}
+    def build_messages(self, recipients, analysis, image, title='Bitcoin Market Analysis Report',
+                       plot_filename='btc_price_plot.png'):
+        """
+        Build one report message per recipient; the chart attachment and body are shared
+        Args:
+            recipients (list): {'email', 'name'} dicts; names personalize the greeting
+            analysis (str): Report text
+            image (bytes): PNG chart
+            title (str): Report title, also used in the subject
+            plot_filename (str): Attachment name for the chart
+        Returns:
+            list: (address, message) pairs for Mailer.send_all
+        """
+        # The chart attachment, subject and report body are built once and shared by every message
+        part = MIMEBase('image', 'png')
+        part.set_payload(image)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename={plot_filename}')
+        generated = datetime.now().strftime('%Y-%m-%d %H:%M UTC')
+        subject = f"{title} - {generated}"
+        body = f"""
+            {title}
+            Generated on: {generated}
 
             {analysis}
 
             This is an automated report generated by EmailAgent.
             """
-            msg.attach(MIMEText(body, 'plain'))
-
-            # Attach the plot image
-            with open(plot_filename, 'rb') as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename={plot_filename}')
-                msg.attach(part)
-
-            # Send email
-            with smtplib.SMTP('smtp.gmail.com', 587) as server:
-                server.starttls()
-                server.login(
-                    self.required_vars['GMAIL_EMAIL'],
-                    self.required_vars['GMAIL_APP_PASSWORD']
-                )
-                server.send_message(msg)
 
-            print(f"Successfully sent analysis email to {recipient_email}")
-            return True
+        messages = []
+        for recipient in recipients:
+            msg = MIMEMultipart()
+            msg['From'] = self.required_vars['GMAIL_EMAIL']
+            msg['To'] = recipient['email']
+            msg['Subject'] = subject
+            greeting = f"Hi {recipient['name']},\n" if recipient.get('name') else ""
+            msg.attach(MIMEText(greeting + body, 'plain'))
+            msg.attach(part)
+            messages.append((recipient['email'], msg))
+        return messages
+
+    def deliver(self, messages):
+        """
+        Send messages over one pooled set of SMTP connections
+        Args:
+            messages (list): (address, message) pairs
+        Returns:
+            bool: True if every message was sent
+        """
+        mailer = Mailer(self.required_vars['GMAIL_EMAIL'], self.required_vars['GMAIL_APP_PASSWORD'])
+        sent, undelivered = mailer.send_all(messages)
+        print(f"Sent {sent} analysis emails for {len(messages)} recipients")
+        return sent >= len(messages) and not undelivered
+
+    def send_email(self, recipients, analysis, price_data):
+        """
+        Send the analysis with the BTC price chart attached to every recipient
+        Args:
+            recipients (list): {'email', 'name'} dicts; names personalize the greeting
+            analysis (str): Report text
+            price_data (list): Price rows for the chart
+        Returns:
+            bool: True if every message was sent
+        """
+        try:
+            # Render the chart in memory (cached while the data is unchanged)
+            image = self.chart_renderer.render_price_data(price_data)
+            return self.deliver(self.build_messages(recipients, analysis, image))
         except Exception as e:
             print(f"Error sending email: {e}")
             return False
 
-    def run(self, hours=24):
-        """Main execution function"""
-        recipient_email = self.required_vars['RECIPIENT_EMAIL']
-
+    def run(self, hours=24, news_data=None):
+        """
+        Main execution function
+        Args:
+            hours (int): Size of the report window in hours
+            news_data (list): News rows produced earlier in the same process (newest first),
+                used in place of reading them back from Supabase
+        Returns:
+            bool: True if the report was sent
+        """
         print(f"Starting analysis for the last {hours} hours...")
 
         if not self.authenticate():
-            return
+            return False
         
         # Fetch data
-        price_data, news_data = self.fetch_recent_data(hours)
+        price_data, news_data = self.fetch_recent_data(hours, news_data=news_data)
         if not price_data or not news_data:
             print("Failed to fetch required data")
             return False
 
+        # Draw the chart while the analysis streams; send_email picks it up from the renderer's cache
+        chart_thread = threading.Thread(target=self._prerender_chart, args=(price_data,), daemon=True)
+        chart_thread.start()
+
+        news_data = self.select_relevant_news(price_data, news_data)
+
         # Generate analysis
         analysis = self.generate_analysis(price_data, news_data)
+        chart_thread.join()
         if not analysis:
             print("Failed to generate analysis")
             return False
 
         # Send email
-        if self.send_email(recipient_email, analysis, price_data):
+        if self.send_email(self.recipients, analysis, price_data):
             print("Analysis completed and email sent successfully")
             return True
         return False
@@ -0,0 +1,243 @@
+"""
+Streaming Gemini text generation with token and latency budgets.
+
+generate_text consumes generate_content(..., stream=True) chunk by chunk on a
+worker thread, so budgets are enforced while the completion is still arriving:
+
+- GEMINI_FIRST_TOKEN_TIMEOUT (default 20s): give up if no text has arrived yet
+- GEMINI_TOTAL_TIMEOUT (default 90s): give up if the whole completion takes longer
+- GEMINI_TOKEN_BUDGET (default unlimited): stop reading once this many output
+  tokens have arrived and keep what was generated so far
+
+A generation that runs out of time is abandoned and retried once on the cheaper
+fallback model. The text is handed to on_complete as soon as the stream ends,
+before any bookkeeping, and the time to first token and total latency of every
+call are recorded (see call_stats). Set GEMINI_STREAMING=0 to fall back to
+blocking generate_content calls.
+"""
+
+import os
+import time
+import queue
+import threading
+from rate_limiter import call_with_retry
+from dedup_index import estimate_tokens
+from completion_cache import record_usage
+import metrics
+
+FALLBACK_MODEL = "gemini-1.5-flash-8b"
+
+_stats = []
+_stats_lock = threading.Lock()
+
+
+class GenerationTimeout(Exception):
+    """Raised when a streamed generation exceeds its latency budget"""
+
+    def __init__(self, message, elapsed):
+        super().__init__(message)
+        self.elapsed = elapsed
+
+
+def streaming_enabled():
+    return os.getenv('GEMINI_STREAMING', '1').lower() in ('1', 'true', 'yes')
+
+
+def _budget(name, default=None):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _chunk_text(chunk):
+    """
+    Text of a response or streamed chunk
+    Args:
+        chunk (GenerateContentResponse): Response or chunk
+    Returns:
+        str: The first candidate's text, empty for chunks without parts (e.g. a final chunk
+        carrying only a finish reason, or a safety stop), where .text would raise
+    """
+    candidates = getattr(chunk, 'candidates', None)
+    if candidates is None:
+        try:
+            return chunk.text or ""
+        except ValueError:
+            return ""
+    if not candidates:
+        return ""
+    parts = getattr(getattr(candidates[0], 'content', None), 'parts', None) or []
+    return "".join(getattr(part, 'text', "") or "" for part in parts)
+
+
+def call_stats():
+    """Per-call records (model, fallback, timed_out, first_token, total, tokens, truncated) in call order"""
+    with _stats_lock:
+        return list(_stats)
+
+
+def stream_text(model, prompt, first_token_timeout=None, total_timeout=None, token_budget=None, **request_options):
+    """
+    Stream one completion, enforcing budgets as chunks arrive
+    Args:
+        model (GenerativeModel): Model to call
+        prompt (str): Prompt text
+        first_token_timeout (float): Seconds allowed before the first text arrives, counted from when the request is sent
+        total_timeout (float): Seconds allowed for the whole completion, counted from when the request is sent
+        token_budget (int): Stop reading after this many output tokens
+        request_options: Keyword arguments forwarded to generate_content
+    Returns:
+        tuple: (text, stats dict with first_token, total, tokens, prompt_tokens and truncated)
+    Raises:
+        GenerationTimeout: If a latency budget is exceeded
+    """
+    chunks = queue.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            # Budgets start once the request holds a token, so time queued in the limiter is not
+            # counted as model latency. Once the caller gives up, nothing more is sent behind its back
+            response = call_with_retry(
+                'gemini', model.generate_content, prompt, stream=True, cancelled=cancelled,
+                on_acquire=lambda: chunks.put(('sent', time.monotonic())), **request_options
+            )
+            for chunk in response:
+                if cancelled.is_set():
+                    return
+                chunks.put(('chunk', chunk))
+            chunks.put(('done', None))
+        except Exception as e:
+            chunks.put(('error', e))
+
+    threading.Thread(target=produce, name="gemini-stream", daemon=True).start()
+
+    started = None
+    first_token = None
+    parts = []
+    tokens = 0
+    prompt_tokens = None
+    truncated = False
+    while True:
+        deadline = started + total_timeout if started is not None and total_timeout else None
+        if started is not None and first_token is None and first_token_timeout:
+            deadline = min(deadline or float('inf'), started + first_token_timeout)
+        try:
+            kind, item = chunks.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            # The SDK has no cancel call; the worker drops the rest of the stream
+            cancelled.set()
+            waited = "first token" if first_token is None else "completion"
+            elapsed = time.monotonic() - started
+            raise GenerationTimeout(f"{waited} not received within budget after {elapsed:.1f}s", elapsed)
+        if kind == 'sent':
+            # A retry keeps the clock of the first attempt
+            started = item if started is None else started
+            continue
+        if kind == 'done':
+            break
+        if kind == 'error':
+            raise item
+
+        text = _chunk_text(item)
+        if first_token is None and text:
+            first_token = time.monotonic() - started
+        parts.append(text)
+        usage = getattr(item, 'usage_metadata', None)
+        reported = getattr(usage, 'candidates_token_count', None) if usage else None
+        tokens = reported if reported else tokens + estimate_tokens(text)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) if usage else prompt_tokens
+        if token_budget and tokens >= token_budget:
+            cancelled.set()
+            truncated = True
+            break
+
+    stats = {
+        'first_token': first_token,
+        'total': time.monotonic() - started,
+        'tokens': tokens,
+        'prompt_tokens': prompt_tokens,
+        'truncated': truncated
+    }
+    return "".join(parts), stats
+
+
+def _record(model, stats, fallback, timed_out=False):
+    record = {'model': model.model_name, 'fallback': fallback, 'timed_out': timed_out, **stats}
+    with _stats_lock:
+        _stats.append(record)
+    metrics.observe('stage_duration_seconds', stats['total'], stage='gemini_generate', model=model.model_name)
+    if timed_out:
+        metrics.inc('stage_errors_total', stage='gemini_generate', model=model.model_name)
+        return
+    if stats['first_token'] is not None:
+        metrics.observe('gemini_first_token_seconds', stats['first_token'], model=model.model_name)
+    metrics.inc('tokens_total', stats['tokens'], model=model.model_name, kind='output')
+    if stats.get('prompt_tokens'):
+        metrics.inc('tokens_total', stats['prompt_tokens'], model=model.model_name, kind='prompt')
+    first_token = f"{stats['first_token']:.2f}s" if stats['first_token'] is not None else "n/a"
+    print(f"Gemini {model.model_name}: first token {first_token}, total {stats['total']:.2f}s, "
+          f"~{stats['tokens']} tokens{' (token budget reached)' if stats['truncated'] else ''}")
+
+
+def generate_text(model, prompt, cache=None, fallback_model=None, on_complete=None, **request_options):
+    """
+    Generate text with streaming, budgets and model fallback
+    Args:
+        model (GenerativeModel): Preferred model
+        prompt (str): Prompt text
+        cache (CompletionCache): Optional cache checked first and filled with complete primary-model answers
+        fallback_model (GenerativeModel): Cheaper model used when the preferred one runs out of time
+        on_complete (callable): Called with the text as soon as the stream ends
+        request_options: Keyword arguments forwarded to generate_content
+    Returns:
+        str: Generated text, or None if every model failed or returned nothing
+    """
+    key = cache.make_key(model.model_name, prompt, **request_options) if cache else None
+    if cache and not cache.bypass:
+        cached = cache.get(key)
+        if cached is not None:
+            if on_complete:
+                on_complete(cached)
+            return cached
+
+    if not streaming_enabled():
+        with metrics.timed('gemini_generate', model=model.model_name):
+            response = call_with_retry('gemini', model.generate_content, prompt, **request_options)
+        record_usage(model.model_name, prompt, response)
+        text = _chunk_text(response) if response else None
+        if text and on_complete:
+            on_complete(text)
+        if text and cache:
+            cache.set(key, text)
+        return text
+
+    candidates = [model]
+    if fallback_model is not None and fallback_model.model_name != model.model_name:
+        candidates.append(fallback_model)
+
+    budget = _budget('GEMINI_TOKEN_BUDGET')
+    metrics.observe_size('payload_bytes', len(prompt.encode('utf-8')), direction='request', host='gemini')
+    for candidate in candidates:
+        is_fallback = candidate is not model
+        try:
+            text, stats = stream_text(
+                candidate,
+                prompt,
+                first_token_timeout=_budget('GEMINI_FIRST_TOKEN_TIMEOUT', 20),
+                total_timeout=_budget('GEMINI_TOTAL_TIMEOUT', 90),
+                token_budget=int(budget) if budget else None,
+                **request_options
+            )
+        except GenerationTimeout as e:
+            print(f"Gemini {candidate.model_name}: {e}")
+            _record(candidate, {'first_token': None, 'total': e.elapsed, 'tokens': 0, 'prompt_tokens': None, 'truncated': False},
+                    is_fallback, timed_out=True)
+            continue
+
+        if text and on_complete:
+            on_complete(text)
+        _record(candidate, stats, is_fallback)
+        if text and cache and not is_fallback and not stats['truncated']:
+            cache.set(key, text)
+        return text or None
+    return None
@@ -0,0 +1,106 @@
+"""
+Shared, pooled HTTP client for the agents.
+
+All outbound HTTP calls (Brave, CoinGecko) go through one requests.Session per
+process, so TCP and TLS handshakes are paid once per host and connections are
+kept alive between calls. Every request gets explicit connect/read timeouts
+(HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT) unless the caller passes its own,
+and connection_stats() reports how many requests reused a pooled connection.
+"""
+
+import os
+import threading
+import requests
+import metrics
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '4'))  # Distinct hosts kept in the pool
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '16'))  # Idle connections kept per host
+
+_stats = {'requests': 0, 'new_connections': 0}
+_stats_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count('new_connections')
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count('new_connections')
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with tuned pool sizes, default timeouts and connection counters"""
+
+    def __init__(self):
+        # Retries are scheduled by rate_limiter so they respect the shared token buckets
+        super().__init__(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        _count('requests')
+        return super().send(request, **kwargs)
+
+
+def get_session():
+    """Return the process-wide keep-alive session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = PooledAdapter()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def get(url, **kwargs):
+    """Send a GET request through the shared session"""
+    response = get_session().get(url, **kwargs)
+    metrics.observe_size('payload_bytes', len(response.content), direction='response', host=urlsplit(url).netloc)
+    return response
+
+
+def connection_stats():
+    """
+    Report connection reuse for the shared session
+    Returns:
+        dict: Requests sent, new connections opened and requests served on a reused connection
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['reused_connections'] = max(0, stats['requests'] - stats['new_connections'])
+    return stats
+
+
+def close():
+    """Close pooled connections, e.g. at the end of a long-running process"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -1,11 +1,24 @@
 import os
-import google.generativeai as genai
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from supabase import create_client
 from datetime import datetime
 from dotenv import load_dotenv
 import json
 import time
+import threading
+from rate_limiter import send_with_retry, RateLimitExceeded
+from completion_cache import CompletionCache
+from search_cache import SearchCache
+from dedup_index import DedupIndex
+from news_index import open_index
+from buffered_writer import BufferedWriter
+import http_client
+import supabase_client
+import gemini_stream
+import metrics
+
 
 class InfoAgent:
     """
@@ -13,6 +26,34 @@ class InfoAgent:
     Stores processed information in Supabase database.
     """
 
+    DEFAULT_QUERIES = [
+        "latest bitcoin cryptocurrency news today",
+        "major macroeconomic news finance today",
+        "bitcoin market analysis latest",
+        "global financial markets news today"
+    ]
+
+    # Ready-made Brave queries for the default topics, used by batched mode to skip the rewrite call
+    QUERY_TEMPLATES = {
+        "latest bitcoin cryptocurrency news today": "bitcoin crypto news",
+        "major macroeconomic news finance today": "macroeconomic news inflation interest rates",
+        "bitcoin market analysis latest": "bitcoin price market analysis",
+        "global financial markets news today": "global stock markets news"
+    }
+
+    # Structured output for batched summaries: one entry per numbered topic
+    BATCH_SUMMARY_SCHEMA = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "topic_id": {"type": "integer"},
+                "summary": {"type": "string"}
+            },
+            "required": ["topic_id", "summary"]
+        }
+    }
+
     def __init__(self):
         """Initialize the InfoAgent with necessary API clients and configurations"""
         load_dotenv(override=True)
@@ -30,10 +71,16 @@ class InfoAgent:
         if not all(self.required_vars.values()):
             raise ValueError("Missing required environment variables")
 
-        # Initialize API clients
-        self.supabase = create_client(self.required_vars['SUPABASE_URL'], self.required_vars['SUPABASE_KEY'])
-        genai.configure(api_key=self.required_vars['GEMINI_API_KEY'])
-        self.model = genai.GenerativeModel("gemini-1.5-flash-8b")
+        # API clients are created on first use so the SDKs only load on paths that need them
+        self._supabase = None
+        self._model = None
+        self._news_index = None
+        self.completion_cache = CompletionCache()
+        self.search_cache = SearchCache()
+        self.stored_news = []  # Rows queued this run, for callers that use them directly
+        self.dedup_index = DedupIndex()
+        self._news_writer = None
+        self._writer_lock = threading.Lock()
 
         # Define Gemini function for Brave Search
         self.tools = [{
@@ -53,18 +100,52 @@ class InfoAgent:
             }]
         }]
 
+    @property
+    def supabase(self):
+        """Shared Supabase client, created on first use"""
+        if self._supabase is None:
+            self._supabase = supabase_client.get_client(
+                self.required_vars['SUPABASE_URL'], self.required_vars['SUPABASE_KEY']
+            )
+        return self._supabase
+
+    @supabase.setter
+    def supabase(self, client):
+        self._supabase = client
+
+    @property
+    def model(self):
+        """Gemini model, created (and the SDK imported) on first use"""
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.required_vars['GEMINI_API_KEY'])
+            self._model = genai.GenerativeModel("gemini-1.5-flash-8b")
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    @property
+    def news_index(self):
+        """Embedding index of stored summaries (see news_index.py), or None when NEWS_INDEX_BACKEND=off"""
+        if self._news_index is None:
+            index = open_index(self.supabase)
+            self._news_index = False if index is None else index  # False: checked, backend is off
+        return None if self._news_index is False else self._news_index
+
+    @news_index.setter
+    def news_index(self, index):
+        self._news_index = index
+
     def authenticate(self):
         """Authenticate with Supabase"""
-        try:
-            self.supabase.auth.sign_in_with_password({
-                "email": self.required_vars['SUPABASE_EMAIL'],
-                "password": self.required_vars['SUPABASE_PASSWORD']
-            })
-            print("Successfully authenticated with Supabase")
-            return True
-        except Exception as e:
-            print(f"Authentication error: {e}")
-            return False
+        return supabase_client.authenticate(
+            self.required_vars['SUPABASE_URL'],
+            self.required_vars['SUPABASE_KEY'],
+            self.required_vars['SUPABASE_EMAIL'],
+            self.required_vars['SUPABASE_PASSWORD']
+        )
 
     def search_news(self, query, max_retries=3, base_delay=5):
         """
@@ -76,43 +157,40 @@ class InfoAgent:
         Returns:
             dict: Search results or None if error
         """
-        for attempt in range(max_retries):
-            try:
-                url = "https://api.search.brave.com/res/v1/web/search"
-                headers = {
-                    "Accept": "application/json",
-                    "Accept-Encoding": "gzip",
-                    "X-Subscription-Token": self.required_vars['BRAVE_API_KEY']
-                }
-                params = {
-                    "q": query,
-                    "search_lang": "en",
-                    "country": "us",
-                    "freshness": "pd"  # Past day
-                }
-                
-                response = requests.get(url, headers=headers, params=params)
-                
-                # Handle rate limiting
-                if response.status_code == 429:
-                    delay = base_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"Rate limited. Waiting {delay} seconds before retry...")
-                    time.sleep(delay)
-                    continue
-                    
-                response.raise_for_status()
-                results = response.json()
-                print(f"Successfully retrieved {len(results.get('web', {}).get('results', []))} news articles")
-                return results
-                
-            except requests.exceptions.RequestException as e:
-                if attempt == max_retries - 1:  # Last attempt
-                    print(f"Search error after {max_retries} attempts: {e}")
-                    return None
-                delay = base_delay * (2 ** attempt)
-                print(f"Request failed. Retrying in {delay} seconds...")
-                time.sleep(delay)
-                continue
+        url = os.getenv('BRAVE_API_URL', "https://api.search.brave.com/res/v1/web/search")
+        headers = {
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip",
+            "X-Subscription-Token": self.required_vars['BRAVE_API_KEY']
+        }
+        params = {
+            "q": query,
+            "search_lang": "en",
+            "country": "us",
+            "freshness": "pd"  # Past day
+        }
+
+        def fetch(conditional_headers):
+            # Retries, Retry-After and Brave's quota headers are handled by the shared limiter
+            return send_with_retry(
+                'brave',
+                lambda: http_client.get(url, headers={**headers, **conditional_headers}, params=params),
+                max_retries=max_retries,
+                base_delay=base_delay
+            )
+
+        try:
+            with metrics.timed('brave_search'):
+                results = self.search_cache.get_or_fetch(params, fetch)
+            print(f"Successfully retrieved {len(results.get('web', {}).get('results', []))} news articles")
+            return results
+
+        except requests.exceptions.RequestException as e:
+            print(f"Search error after {max_retries} attempts: {e}")
+            return None
+        except RateLimitExceeded as e:
+            print(f"Search skipped: {e}")
+            return None
 
     def extract_function_args(self, completion):
         """Extract search query from Gemini function call response"""
@@ -128,22 +206,84 @@ class InfoAgent:
             print(f"Error extracting function args: {e}")
             return None
 
+    @property
+    def news_writer(self):
+        """Buffered writer for finance_info, created on first use (after authentication)"""
+        with self._writer_lock:
+            if self._news_writer is None:
+                self._news_writer = BufferedWriter(self.supabase, 'finance_info')
+            return self._news_writer
+
     def store_news(self, info):
-        """Store processed news in Supabase"""
+        """Queue processed news for a buffered write to Supabase"""
         try:
             data = {
                 "info": info,
                 "timestamp": datetime.utcnow().isoformat()
             }
-            self.supabase.table('finance_info').insert(data).execute()
-            print("Successfully stored news summary in database")
+            self.news_writer.write(data)
+            self.stored_news.append(data)
+            print("Queued news summary for storage")
+            return True
+        except Exception as e:
+            print(f"Error storing news: {e}")
+            return False
+
+    def store_news_bulk(self, infos):
+        """Queue several news summaries; they are written with a single multi-row insert"""
+        try:
+            timestamp = datetime.utcnow().isoformat()
+            rows = [{"info": info, "timestamp": timestamp} for info in infos]
+            self.news_writer.write_many(rows)
+            self.stored_news.extend(rows)
+            self.news_writer.flush()
             return True
         except Exception as e:
             print(f"Error storing news: {e}")
             return False
 
-    def process_articles(self, search_results):
-        """Process and format search results into articles"""
+    def index_stored_news(self):
+        """Embed this run's summaries into the news index, in one batch"""
+        if not self.stored_news or self.news_index is None:
+            return
+        try:
+            added = self.news_index.add(
+                [row['info'] for row in self.stored_news], [row['timestamp'] for row in self.stored_news]
+            )
+            print(f"Indexed {added} news summaries for retrieval")
+        except Exception as e:
+            print(f"Error indexing news summaries: {e}")
+
+    def skip_covered_topics(self, queries):
+        """
+        Drop topics that recent summaries already cover well
+        Args:
+            queries (list): Topics to process
+        Returns:
+            list: The topics still worth processing
+        """
+        hours = float(os.getenv('NEWS_SKIP_COVERED_HOURS', '0'))
+        if hours <= 0 or self.news_index is None:
+            return queries
+        threshold = float(os.getenv('NEWS_COVERAGE_SIMILARITY', '0.75'))
+        min_matches = int(os.getenv('NEWS_COVERAGE_MIN_MATCHES', '2'))
+        try:
+            since = time.time() - hours * 3600
+            vectors = self.news_index.embed_queries(queries)
+            remaining = []
+            for query, vector in zip(queries, vectors):
+                matches = self.news_index.search_vectors([vector], k=min_matches, since=since)
+                if sum(1 for match in matches if match['similarity'] >= threshold) >= min_matches:
+                    print(f"Skipping topic covered in the last {hours:g} hours: {query}")
+                else:
+                    remaining.append(query)
+            return remaining
+        except Exception as e:
+            print(f"Error checking topic coverage: {e}")
+            return queries
+
+    def process_articles(self, search_results, max_articles=5):
+        """Process and format search results into articles, skipping ones already seen"""
         if not search_results or "web" not in search_results:
             return None
 
@@ -151,8 +291,8 @@ class InfoAgent:
         web_results = web.get("results", [])
         
         articles = []
-        for i, result in enumerate(web_results):
-            if i >= 5:  # Limit to top 5 articles
+        for result in web_results:
+            if len(articles) >= max_articles:  # Limit to top 5 new articles
                 break
                 
             title = result.get('title', '')
@@ -160,101 +300,349 @@ class InfoAgent:
             url = result.get('url', '')
             
             if title or description:
-                articles.append({
+                article = {
                     'title': title or 'No title',
                     'description': description or 'No description',
                     'url': url or 'No URL'
-                })
+                }
+                # Repeats from other topics or earlier runs never reach the prompt
+                if not self.dedup_index.add(article):
+                    self.dedup_index.record_dropped(self.format_articles([article]))
+                    continue
+                articles.append(article)
         
         return articles
 
-    def run(self):
-        """Main execution function"""
+    def _search_query_request(self, topic):
+        """Prompt and request options for the query rewrite call"""
+        import google.generativeai as genai
+
+        search_prompt = f"""You are a financial news researcher. Your task is to help find and analyze 
+        the latest important financial news. Be concise and specific in your search query.
+        Find the latest news about: {topic}"""
+
+        options = {
+            'generation_config': genai.types.GenerationConfig(
+                temperature=0.5,
+                candidate_count=1,
+                top_k=10,
+                top_p=0.8,
+            ),
+            'tools': self.tools,
+            'tool_config': {"function_calling_config": {"mode": "ANY"}}
+        }
+        return search_prompt, options
+
+    def generate_search_query(self, topic):
+        """
+        Ask Gemini to turn a topic into a focused Brave search query
+        Args:
+            topic (str): News topic to research
+        Returns:
+            dict: Search arguments with a 'query' key or None if error
+        """
+        search_prompt, options = self._search_query_request(topic)
+
+        # Cached by prompt and config, so retried runs skip the round trip
+        return self.completion_cache.generate(self.model, search_prompt, self.extract_function_args, **options)
+
+    def resolve_search_query(self, topic):
+        """
+        Search arguments for a topic, calling Gemini only when neither a cached
+        rewrite nor a static query template is available
+        Args:
+            topic (str): News topic to research
+        Returns:
+            dict: Search arguments with a 'query' key or None if error
+        """
+        search_prompt, options = self._search_query_request(topic)
+        cached = self.completion_cache.lookup(self.model, search_prompt, **options)
+        if cached:
+            return cached
+        if topic in self.QUERY_TEMPLATES:
+            return {"query": self.QUERY_TEMPLATES[topic]}
+        return self.generate_search_query(topic)
+
+    def format_articles(self, articles):
+        """Format articles into the text block used in analysis prompts"""
+        return "\n\n".join([
+            f"Title: {article['title']}\nURL: {article['url']}\nDescription: {article['description']}" 
+            for article in articles
+        ])
+
+    def summarize_articles(self, articles, on_complete=None):
+        """
+        Summarize a list of articles into a single paragraph with Gemini
+        Args:
+            articles (list): Articles as returned by process_articles
+            on_complete (callable): Called with the summary as soon as it has been generated
+        Returns:
+            str: Summary text or None if Gemini returned nothing
+        """
+        analysis_prompt = """Analyze these financial news articles and provide a concise, 
+        fact-focused summary in a single paragraph. Focus on key market movements, important 
+        announcements, and potential impact on Bitcoin and crypto markets.
+
+        Articles:\n""" + self.format_articles(articles)
+
+        import google.generativeai as genai
+        return gemini_stream.generate_text(
+            self.model,
+            analysis_prompt,
+            cache=self.completion_cache,
+            on_complete=on_complete,
+            generation_config=genai.types.GenerationConfig(
+                temperature=0.5,
+                candidate_count=1,
+                top_k=10,
+                top_p=0.8,
+                max_output_tokens=200
+            )
+        )
+
+    def summarize_topics(self, batch):
+        """
+        Summarize several topics in one structured-output Gemini call
+        Args:
+            batch (list): (topic, articles) pairs
+        Returns:
+            dict: Summary text keyed by position in batch
+        """
+        sections = "\n\n".join([
+            f"Topic {topic_id}: {topic}\nArticles:\n{self.format_articles(articles)}"
+            for topic_id, (topic, articles) in enumerate(batch)
+        ])
+        batch_prompt = """Analyze the financial news articles grouped under each numbered topic below. For every 
+        topic provide a concise, fact-focused summary in a single paragraph. Focus on key market movements, 
+        important announcements, and potential impact on Bitcoin and crypto markets. Return one entry per 
+        topic with its topic_id.
+
+        """ + sections
+
+        import google.generativeai as genai
+        entries = self.completion_cache.generate(
+            self.model,
+            batch_prompt,
+            lambda response: json.loads(response.text),
+            generation_config=genai.types.GenerationConfig(
+                temperature=0.5,
+                candidate_count=1,
+                top_k=10,
+                top_p=0.8,
+                max_output_tokens=250 * len(batch),
+                response_mime_type="application/json",
+                response_schema=self.BATCH_SUMMARY_SCHEMA
+            )
+        )
+        return {
+            entry['topic_id']: entry['summary'].strip()
+            for entry in entries or []
+            if 0 <= entry.get('topic_id', -1) < len(batch) and entry.get('summary', '').strip()
+        }
+
+    def summarize_and_store(self, articles):
+        """
+        Summarize articles and store the summary, releasing them from the
+        dedup index if nothing was stored so a later run can retry them
+        Args:
+            articles (list): Articles as returned by process_articles
+        Returns:
+            bool: True if a summary was stored, False otherwise
+        """
+        stored = False
+
+        def store(summary):
+            # Queued as soon as the stream completes, before the call's bookkeeping
+            nonlocal stored
+            stored = self.store_news(summary)
+
+        try:
+            self.summarize_articles(articles, on_complete=store)
+            return stored
+        finally:
+            if not stored:
+                self.dedup_index.discard(articles)
+
+    def process_topic(self, query):
+        """
+        Run one topic through query generation, search, summarization and storage
+        Args:
+            query (str): News topic to process
+        Returns:
+            bool: True if a summary was stored, False otherwise
+        """
+        print(f"\nProcessing topic: {query}")
+        search_args = self.generate_search_query(query)
+        if not search_args:
+            return False
+
+        search_results = self.search_news(search_args["query"])
+        articles = self.process_articles(search_results)
+        if not articles:
+            return False
+
+        return self.summarize_and_store(articles)
+
+    def run(self, queries=None):
+        """
+        Main execution function
+        Args:
+            queries (list): Topics to process, defaults to DEFAULT_QUERIES
+        Returns:
+            int: Number of topics successfully stored
+        """
         if not self.authenticate():
-            return
+            return 0
 
-        queries = [
-            "latest bitcoin cryptocurrency news today",
-            "major macroeconomic news finance today",
-            "bitcoin market analysis latest",
-            "global financial markets news today"
-        ]
+        queries = self.skip_covered_topics(queries or self.DEFAULT_QUERIES)
 
         print(f"\nStarting news processing for {len(queries)} topics...")
         successful_queries = 0
 
         for query in queries:
+            try:
+                if self.process_topic(query):
+                    successful_queries += 1
+
+            except Exception as e:
+                print(f"Error processing query '{query}': {e}")
+                continue
+
+        print(f"\nCompleted processing with {successful_queries} out of {len(queries)} topics successfully analyzed")
+        print(f"HTTP connections: {http_client.connection_stats()}")
+        self.news_writer.flush()
+        self.index_stored_news()
+        self.dedup_index.save()
+        print(self.dedup_index.report())
+        return successful_queries
+
+    async def _process_topic_async(self, query, semaphore):
+        """Async counterpart of process_topic; blocking calls run in worker threads"""
+        async with semaphore:
             try:
                 print(f"\nProcessing topic: {query}")
-                # Get optimized search query from Gemini
-                search_prompt = f"""You are a financial news researcher. Your task is to help find and analyze 
-                the latest important financial news. Be concise and specific in your search query.
-                Find the latest news about: {query}"""
-                
-                completion = self.model.generate_content(
-                    search_prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=0.5,
-                        candidate_count=1,
-                        top_k=10,
-                        top_p=0.8,
-                    ),
-                    tools=self.tools,
-                    tool_config={"function_calling_config": {"mode": "ANY"}}
-                )
-
-                search_args = self.extract_function_args(completion)
+                search_args = await asyncio.to_thread(self.generate_search_query, query)
                 if not search_args:
-                    continue
+                    return False
 
-                # Search for news articles
-                search_results = self.search_news(search_args["query"])
+                search_results = await asyncio.to_thread(self.search_news, search_args["query"])
                 articles = self.process_articles(search_results)
-                
                 if not articles:
-                    continue
+                    return False
 
-                # Format articles for analysis
-                articles_text = "\n\n".join([
-                    f"Title: {article['title']}\nURL: {article['url']}\nDescription: {article['description']}" 
-                    for article in articles
-                ])
-
-                # Get analysis from Gemini
-                analysis_prompt = """Analyze these financial news articles and provide a concise, 
-                fact-focused summary in a single paragraph. Focus on key market movements, important 
-                announcements, and potential impact on Bitcoin and crypto markets.
-
-                Articles:\n""" + articles_text
-
-                analysis = self.model.generate_content(
-                    analysis_prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=0.5,
-                        candidate_count=1,
-                        top_k=10,
-                        top_p=0.8,
-                        max_output_tokens=200
-                    )
-                )
-
-                if analysis:
-                    if self.store_news(analysis.text):
-                        successful_queries += 1
-                
-                # Increase delay between queries to avoid rate limiting
-                time.sleep(5)  # Wait 5 seconds between queries
+                return await asyncio.to_thread(self.summarize_and_store, articles)
 
             except Exception as e:
                 print(f"Error processing query '{query}': {e}")
-                time.sleep(5)  # Wait even after errors
-                continue
+                return False
+
+    async def run_async(self, queries=None, concurrency=None):
+        """
+        Process all topics concurrently instead of one after another
+        Args:
+            queries (list): Topics to process, defaults to DEFAULT_QUERIES
+            concurrency (int): Maximum topics in flight, defaults to INFO_AGENT_CONCURRENCY
+        Returns:
+            int: Number of topics successfully stored
+        """
+        concurrency = concurrency or int(os.getenv('INFO_AGENT_CONCURRENCY', '5'))
+
+        # Blocking SDK calls share one pool sized to the concurrency limit. It has to be
+        # installed before the first to_thread, which would otherwise create the default pool.
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+        if not await asyncio.to_thread(self.authenticate):
+            return 0
+
+        queries = await asyncio.to_thread(self.skip_covered_topics, queries or self.DEFAULT_QUERIES)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        print(f"\nStarting async news processing for {len(queries)} topics (concurrency={concurrency})...")
+        started = time.monotonic()
+        results = await asyncio.gather(*[
+            self._process_topic_async(query, semaphore) for query in queries
+        ])
+        successful_queries = sum(1 for result in results if result)
+
+        print(f"\nCompleted processing with {successful_queries} out of {len(queries)} topics "
+              f"successfully analyzed in {time.monotonic() - started:.1f}s")
+        print(f"HTTP connections: {http_client.connection_stats()}")
+        self.news_writer.flush()
+        self.index_stored_news()
+        self.dedup_index.save()
+        print(self.dedup_index.report())
+        return successful_queries
+
+    def run_batched(self, queries=None):
+        """
+        Process all topics with at most one query-rewrite call per uncached topic
+        and a single summarization call for the whole run
+        Args:
+            queries (list): Topics to process, defaults to DEFAULT_QUERIES
+        Returns:
+            int: Number of topics successfully stored
+        """
+        if not self.authenticate():
+            return 0
+
+        queries = self.skip_covered_topics(queries or self.DEFAULT_QUERIES)
+        print(f"\nStarting batched news processing for {len(queries)} topics...")
+
+        batch = []
+        for query in queries:
+            try:
+                print(f"\nCollecting articles for topic: {query}")
+                search_args = self.resolve_search_query(query)
+                if not search_args:
+                    continue
+                articles = self.process_articles(self.search_news(search_args["query"]))
+                if articles:
+                    batch.append((query, articles))
+            except Exception as e:
+                print(f"Error collecting articles for '{query}': {e}")
+
+        successful_queries = 0
+        if batch:
+            summaries = {}
+            try:
+                summaries = self.summarize_topics(batch)
+            except Exception as e:
+                print(f"Error summarizing topics: {e}")
+
+            if summaries and self.store_news_bulk([summaries[topic_id] for topic_id in sorted(summaries)]):
+                successful_queries = len(summaries)
+            else:
+                summaries = {}
+            for topic_id, (query, articles) in enumerate(batch):
+                if topic_id not in summaries:
+                    self.dedup_index.discard(articles)
 
         print(f"\nCompleted processing with {successful_queries} out of {len(queries)} topics successfully analyzed")
+        print(f"HTTP connections: {http_client.connection_stats()}")
+        self.news_writer.flush()
+        self.index_stored_news()
+        self.dedup_index.save()
+        print(self.dedup_index.report())
+        return successful_queries
 
 
 if __name__ == "__main__":
     """Initialize and run the InfoAgent"""
+    parser = argparse.ArgumentParser(description="Collect and summarize financial news")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--async', dest='use_async', action='store_true',
+                      help="Process topics concurrently")
+    mode.add_argument('--batched', action='store_true',
+                      help="Summarize all topics in a single Gemini call")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="Maximum topics in flight in async mode")
+    args = parser.parse_args()
+
     print("Starting InfoAgent...")
     agent = InfoAgent()
-    agent.run()
\ No newline at end of file
+    if args.use_async:
+        asyncio.run(agent.run_async(concurrency=args.concurrency))
+    elif args.batched:
+        agent.run_batched()
+    else:
+        agent.run()
@@ -0,0 +1,246 @@
+"""
+Pooled SMTP delivery for the email report.
+
+A Mailer sends many messages over a small pool of worker threads
+(SMTP_WORKERS, default 4). Each worker logs in once and reuses its connection
+for up to SMTP_MAX_MESSAGES_PER_CONNECTION messages, so a report to hundreds of
+subscribers costs a handful of TLS handshakes and logins instead of one per
+recipient. Transient failures (4xx replies, dropped connections, timeouts) are
+retried on a fresh connection with backoff; 5xx rejections are not retried. A
+failed login, or a server that cannot be reached within the retries, stops the
+whole pool instead of being retried for every message. Messages that still cannot be sent
+go to a local outbox (SMTP_OUTBOX_DIR) and are retried on the next run, unless
+they are older than SMTP_OUTBOX_MAX_AGE_HOURS (default 12, so a failed report is
+resent by a same-day rerun but not next to the following day's report) or the
+run is sending that recipient a new report, which replaces the stale one.
+
+Recipients come from RECIPIENT_EMAIL, a comma-separated list that may use the
+"Name <address>" form, and from RECIPIENTS_FILE, a CSV with email and name
+columns. Names are used to personalize the greeting.
+"""
+
+import os
+import csv
+import json
+import time
+import queue
+import base64
+import smtplib
+import threading
+from email.utils import getaddresses
+from rate_limiter import backoff_delay
+import metrics
+
+
+def load_recipients(addresses=None, path=None):
+    """
+    Collect report recipients
+    Args:
+        addresses (str): Comma-separated addresses, optionally as "Name <address>"
+        path (str): CSV file with an email column and an optional name column
+    Returns:
+        list: {'email', 'name'} dicts, without duplicate addresses
+    """
+    recipients = [{'email': email, 'name': name} for name, email in getaddresses([addresses or ""]) if email]
+    if path:
+        try:
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    if (row.get('email') or '').strip():
+                        recipients.append({'email': row['email'].strip(), 'name': (row.get('name') or '').strip()})
+        except OSError as e:
+            print(f"Could not read recipients from {path}: {e}")
+
+    seen = set()
+    unique = []
+    for recipient in recipients:
+        if recipient['email'].lower() not in seen:
+            seen.add(recipient['email'].lower())
+            unique.append(recipient)
+    return unique
+
+
+def _is_permanent(error):
+    """Rejections of a message with 5xx codes will not succeed on retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return error.smtp_code >= 500
+    return False
+
+
+class Mailer:
+    """Sends messages over pooled, authenticated SMTP connections"""
+
+    def __init__(self, username, password, host=None, port=None, starttls=None, workers=None,
+                 max_messages_per_connection=None, max_retries=None, outbox_dir=None):
+        self.username = username
+        self.password = password
+        self.host = host or os.getenv('SMTP_HOST', 'smtp.gmail.com')
+        self.port = port or int(os.getenv('SMTP_PORT', '587'))
+        if starttls is None:
+            starttls = os.getenv('SMTP_STARTTLS', '1').lower() in ('1', 'true', 'yes')
+        self.starttls = starttls
+        self.timeout = float(os.getenv('SMTP_TIMEOUT', '30'))
+        self.workers = workers or int(os.getenv('SMTP_WORKERS', '4'))
+        self.max_messages_per_connection = (
+            max_messages_per_connection or int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('SMTP_MAX_RETRIES', '3'))
+        self.max_outbox_age = float(os.getenv('SMTP_OUTBOX_MAX_AGE_HOURS', '12')) * 3600
+        outbox_dir = outbox_dir or os.getenv('SMTP_OUTBOX_DIR', os.path.join('.cache', 'outbox'))
+        os.makedirs(outbox_dir, exist_ok=True)
+        self.outbox_path = os.path.join(outbox_dir, "pending.jsonl")
+        self._outbox_lock = threading.Lock()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        metrics.inc('smtp_connections_total')
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _work(self, jobs, sent, undelivered, stop):
+        """Drain the job queue over one connection, reconnecting when needed, until done or stopped"""
+        server, sent_on_connection = None, 0
+        try:
+            while not stop.is_set():
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                for attempt in range(self.max_retries + 1):
+                    connecting = server is None
+                    try:
+                        if server is None:
+                            server, sent_on_connection = self._connect(), 0
+                        with metrics.timed('send_email'):
+                            server.sendmail(self.username, [job['to']], job['message'])
+                        metrics.observe_size('payload_bytes', len(job['message']), direction='request', host='smtp')
+                        sent.append(job['to'])
+                        sent_on_connection += 1
+                        if sent_on_connection >= self.max_messages_per_connection:
+                            self._close(server)
+                            server = None
+                        break
+                    except Exception as e:
+                        if server is not None:
+                            self._close(server)
+                            server = None
+                        if isinstance(e, smtplib.SMTPAuthenticationError):
+                            # Retrying a bad password per message only risks locking the account
+                            print(f"SMTP login failed, stopping delivery: {e}")
+                            stop.set()
+                            undelivered.append(job)
+                            return
+                        if _is_permanent(e):
+                            print(f"{job['to']} rejected the report: {e}")
+                            break
+                        if attempt == self.max_retries:
+                            print(f"Could not send to {job['to']}: {e}")
+                            undelivered.append(job)
+                            if connecting:
+                                print(f"Could not connect to {self.host}:{self.port}, stopping delivery")
+                                stop.set()
+                            break
+                        delay = backoff_delay(attempt)
+                        metrics.inc('retries_total', endpoint='smtp')
+                        print(f"Sending to {job['to']} failed ({e}). Retrying in {delay:.1f} seconds...")
+                        if stop.wait(delay):
+                            undelivered.append(job)
+                            return
+        finally:
+            if server is not None:
+                self._close(server)
+
+    def _spill(self, jobs):
+        """Append undelivered messages to the outbox"""
+        with self._outbox_lock:
+            with open(self.outbox_path, 'a') as f:
+                for job in jobs:
+                    f.write(json.dumps({
+                        'to': job['to'],
+                        'queued_at': job['queued_at'],
+                        'message': base64.b64encode(job['message']).decode('ascii')
+                    }) + "\n")
+        print(f"Saved {len(jobs)} undelivered messages to {self.outbox_path} for retry")
+
+    def _take_outbox(self, replaced=()):
+        """
+        Messages left over from earlier runs that are still worth sending
+        Args:
+            replaced (set): Lower-cased addresses getting a new report in this run, whose old ones are dropped
+        Returns:
+            list: Outbox jobs to send
+        """
+        with self._outbox_lock:
+            if not os.path.exists(self.outbox_path):
+                return []
+            with open(self.outbox_path) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            os.remove(self.outbox_path)
+
+        cutoff = time.time() - self.max_outbox_age
+        jobs = [
+            {'to': entry['to'], 'queued_at': entry['queued_at'], 'message': base64.b64decode(entry['message'])}
+            for entry in entries if entry['queued_at'] >= cutoff
+        ]
+        if len(jobs) < len(entries):
+            print(f"Dropped {len(entries) - len(jobs)} outbox messages older than the outbox age limit")
+        current = [job for job in jobs if job['to'].lower() not in replaced]
+        if len(current) < len(jobs):
+            print(f"Dropped {len(jobs) - len(current)} outbox messages replaced by this run's report")
+        jobs = current
+        if jobs:
+            print(f"Retrying {len(jobs)} messages from the outbox")
+        return jobs
+
+    def send_all(self, messages):
+        """
+        Deliver messages over the connection pool, retrying leftovers from the outbox too
+        Args:
+            messages (list): (recipient address, email.message.Message) pairs
+        Returns:
+            tuple: (number sent, number saved to the outbox)
+        """
+        queued_at = time.time()
+        jobs = queue.Queue()
+        for job in self._take_outbox({address.lower() for address, _ in messages}):
+            jobs.put(job)
+        for address, message in messages:
+            jobs.put({'to': address, 'queued_at': queued_at, 'message': message.as_bytes()})
+        total = jobs.qsize()
+        if not total:
+            return 0, 0
+
+        sent, undelivered = [], []
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self._work, args=(jobs, sent, undelivered, stop), name=f"smtp-{i}", daemon=True)
+            for i in range(min(self.workers, total))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # After a fatal error the rest of the queue was never tried
+        while not jobs.empty():
+            undelivered.append(jobs.get_nowait())
+
+        if undelivered:
+            self._spill(undelivered)
+        # Permanently rejected recipients count as neither
+        return len(sent), len(undelivered)
@@ -0,0 +1,208 @@
+"""
+Vectorized market statistics for the email report.
+
+compute_market_stats turns a price series into a handful of numbers (returns,
+realized volatility, drawdown, averages, moving averages and change points),
+each computed in a single NumPy pass, and format_market_stats renders them as
+a compact block for the analysis prompt.
+"""
+
+from datetime import datetime, timezone
+import numpy as np
+from price_store import rolling_mean, to_epoch
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+
+def _best_split(values):
+    """
+    Index that best splits values into two segments with different means, and the
+    reduction in squared error it achieves (computed for every split at once)
+    """
+    n = len(values)
+    sums = np.cumsum(values)
+    left_counts = np.arange(1, n)
+    left_means = sums[:-1] / left_counts
+    right_means = (sums[-1] - sums[:-1]) / (n - left_counts)
+    gains = left_counts * (n - left_counts) / n * (left_means - right_means) ** 2
+    best = int(np.argmax(gains))
+    return best + 1, float(gains[best])
+
+
+def detect_change_points(log_prices, max_points=3, min_segment=4, min_explained=0.6):
+    """
+    Binary segmentation on log prices
+    Args:
+        log_prices (ndarray): Log price series
+        max_points (int): Maximum number of change points
+        min_segment (int): Minimum points on each side of a change
+        min_explained (float): Share of a segment's variance a split must explain to be kept
+    Returns:
+        list: Sorted indices where a new regime starts
+    """
+    segments = [(0, len(log_prices))]
+    points = []
+    while len(points) < max_points:
+        best = None
+        for start, end in segments:
+            if end - start < 2 * min_segment:
+                continue
+            values = log_prices[start:end]
+            total = float(np.sum((values - values.mean()) ** 2))
+            if total <= 0:
+                continue
+            split, gain = _best_split(values)
+            if split < min_segment or len(values) - split < min_segment:
+                continue
+            if gain / total >= min_explained and (best is None or gain > best[2]):
+                best = (start, end, gain, start + split)
+        if best is None:
+            break
+        start, end, _, split = best
+        segments.remove((start, end))
+        segments.extend([(start, split), (split, end)])
+        points.append(split)
+    return sorted(points)
+
+
+def compute_market_stats(timestamps, prices, weights=None, short_window=4, long_window=16):
+    """
+    Compute summary statistics for a price series
+    Args:
+        timestamps (ndarray): Ascending Unix seconds
+        prices (ndarray): Prices aligned with timestamps
+        weights (ndarray): Optional per-point weights (e.g. samples per bucket) for the weighted average
+        short_window (int): Points in the short moving average
+        long_window (int): Points in the long moving average
+    Returns:
+        dict: Statistics, or None if there are no prices
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    if len(prices) == 0:
+        return None
+
+    stats = {
+        'points': int(len(prices)),
+        'start': float(timestamps[0]),
+        'end': float(timestamps[-1]),
+        'first': float(prices[0]),
+        'last': float(prices[-1]),
+        'high': float(prices.max()),
+        'low': float(prices.min()),
+        'change_pct': float((prices[-1] / prices[0] - 1) * 100),
+        'mean': float(prices.mean()),
+    }
+    if weights is not None and np.sum(weights) > 0:
+        stats['weighted_mean'] = float(np.average(prices, weights=weights))
+    if len(prices) < 2:
+        return stats
+
+    # Time-weighted average price, so irregular sampling does not skew it
+    dt = np.diff(timestamps)
+    if dt.sum() > 0:
+        stats['twap'] = float(np.sum((prices[1:] + prices[:-1]) / 2 * dt) / dt.sum())
+
+    log_prices = np.log(prices)
+    returns = np.diff(log_prices)
+    step = float(np.median(dt)) if len(dt) else 0.0
+    stats['realized_vol_pct'] = float(np.sqrt(np.sum(returns ** 2)) * 100)
+    if step > 0 and len(returns) > 1:
+        stats['annualized_vol_pct'] = float(returns.std(ddof=1) * np.sqrt(SECONDS_PER_YEAR / step) * 100)
+    stats['largest_move_pct'] = float(returns[np.argmax(np.abs(returns))] * 100)
+
+    running_max = np.maximum.accumulate(prices)
+    drawdowns = prices / running_max - 1
+    trough = int(np.argmin(drawdowns))
+    stats['max_drawdown_pct'] = float(drawdowns[trough] * 100)
+    stats['max_drawdown_at'] = float(timestamps[trough])
+
+    if len(prices) >= long_window:
+        short_ma = rolling_mean(prices, short_window)
+        long_ma = rolling_mean(prices, long_window)
+        stats['sma_short'] = float(short_ma[-1])
+        stats['sma_long'] = float(long_ma[-1])
+        above = short_ma[long_window - 1:] > long_ma[long_window - 1:]
+        crosses = np.flatnonzero(np.diff(above.astype(np.int8)))
+        if len(crosses):
+            index = crosses[-1] + long_window
+            stats['last_crossover'] = ('bullish' if above[crosses[-1] + 1] else 'bearish', float(timestamps[index]))
+
+    # Level shift at each change point, between the regimes on either side of it
+    points = detect_change_points(log_prices)
+    bounds = [0] + points + [len(prices)]
+    stats['change_points'] = [
+        (float(timestamps[bounds[k]]),
+         float((np.exp(log_prices[bounds[k]:bounds[k + 1]].mean() - log_prices[bounds[k - 1]:bounds[k]].mean()) - 1) * 100))
+        for k in range(1, len(bounds) - 1)
+    ]
+    return stats
+
+
+def stats_from_price_data(price_data):
+    """Compute statistics for report rows as returned by EmailAgent.fetch_recent_data (newest first)"""
+    rows = list(reversed(price_data))
+    timestamps = np.array([to_epoch(row['timestamp']) for row in rows])
+    prices = np.array([row['price'] for row in rows], dtype=float)
+    weights = np.array([row.get('samples', 1) for row in rows], dtype=float)
+    return compute_market_stats(timestamps, prices, weights)
+
+
+def _time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+
+
+def format_market_stats(stats):
+    """Render statistics as a compact text block for the analysis prompt"""
+    if not stats:
+        return "No price data available."
+
+    lines = [
+        f"Window: {_time(stats['start'])} to {_time(stats['end'])} ({stats['points']} points)",
+        f"Price: ${stats['first']:,.2f} -> ${stats['last']:,.2f} ({stats['change_pct']:+.2f}%), "
+        f"range ${stats['low']:,.2f}-${stats['high']:,.2f}",
+    ]
+    averages = [f"mean ${stats['mean']:,.2f}"]
+    if 'twap' in stats:
+        averages.append(f"time-weighted ${stats['twap']:,.2f}")
+    if 'weighted_mean' in stats:
+        averages.append(f"sample-weighted ${stats['weighted_mean']:,.2f}")
+    lines.append("Averages: " + ", ".join(averages))
+    if 'realized_vol_pct' in stats:
+        volatility = f"Volatility: realized {stats['realized_vol_pct']:.2f}% over the window"
+        if 'annualized_vol_pct' in stats:
+            volatility += f", annualized {stats['annualized_vol_pct']:.1f}%"
+        lines.append(volatility + f", largest single move {stats['largest_move_pct']:+.2f}%")
+        lines.append(f"Max drawdown: {stats['max_drawdown_pct']:.2f}% (trough at {_time(stats['max_drawdown_at'])})")
+    if 'sma_short' in stats:
+        trend = f"Moving averages: short ${stats['sma_short']:,.2f}, long ${stats['sma_long']:,.2f}"
+        if 'last_crossover' in stats:
+            direction, at = stats['last_crossover']
+            trend += f", last {direction} crossover at {_time(at)}"
+        lines.append(trend)
+    for at, shift in stats.get('change_points', []):
+        lines.append(f"Regime change at {_time(at)}: average level shifted {shift:+.2f}%")
+    return "\n".join(lines)
+
+
+def price_move_queries(stats, name='Bitcoin'):
+    """
+    Short descriptions of the notable price moves, used to retrieve the news that explains them
+    Args:
+        stats (dict): As returned by compute_market_stats
+        name (str): Asset name used in the queries
+    Returns:
+        list: Query sentences, the overall move first
+    """
+    if not stats:
+        return [f"{name} price news"]
+    direction = "rose" if stats['change_pct'] >= 0 else "fell"
+    queries = [f"{name} price {direction} {abs(stats['change_pct']):.1f}% to ${stats['last']:,.0f}"]
+    if stats.get('largest_move_pct'):
+        move = stats['largest_move_pct']
+        queries.append(f"{name} {'jumps' if move > 0 else 'drops'} {abs(move):.1f}% in a sudden {'rally' if move > 0 else 'sell-off'}")
+    if stats.get('max_drawdown_pct', 0) < -2:
+        queries.append(f"{name} sell-off, price down {abs(stats['max_drawdown_pct']):.1f}% from its high")
+    for at, shift in stats.get('change_points', []):
+        queries.append(f"{name} price {'surges' if shift > 0 else 'slides'} {abs(shift):.1f}% on {_time(at)}")
+    return queries
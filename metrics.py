@@ -0,0 +1,226 @@
+"""
+Process-wide metrics for the agents.
+
+Stages (Brave search, Gemini calls, Supabase reads and writes, SMTP) are timed
+with `timed`, and counters, histograms and payload sizes are recorded with
+`inc` and `observe`. At exit the registry is written in Prometheus text
+exposition format (the node_exporter textfile collector format) to
+METRICS_DIR/<job>.prom, where job is the entry script's name, and a per-stage
+summary is printed so the slowest stage of every run is obvious. Set
+METRICS_ENABLED=0 to turn recording off.
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HELP = {
+    'stage_duration_seconds': 'Time spent in each pipeline stage',
+    'stage_errors_total': 'Stage calls that raised',
+    'retries_total': 'Retried API calls per endpoint',
+    'cache_requests_total': 'Cache lookups by cache and result',
+    'tokens_total': 'Gemini tokens by model and kind',
+    'payload_bytes': 'Request and response payload sizes',
+    'rows_total': 'Rows read from or written to Supabase',
+    'gemini_first_token_seconds': 'Time to first streamed token',
+    'smtp_connections_total': 'Authenticated SMTP connections opened',
+    'prompt_tokens': 'Estimated prompt size in tokens',
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def enabled():
+    return os.getenv('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    if not enabled():
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record one observation in a histogram"""
+    if not enabled():
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(histogram['buckets']):
+            if value <= bound:
+                histogram['counts'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def observe_size(name, size, **labels):
+    """Record a payload size in bytes"""
+    observe(name, size, buckets=SIZE_BUCKETS, **labels)
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Time a block as stage_duration_seconds{stage=...}, counting it as an error if it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc('stage_errors_total', stage=stage, **labels)
+        raise
+    finally:
+        observe('stage_duration_seconds', time.perf_counter() - started, stage=stage, **labels)
+
+
+def reset():
+    """Forget everything recorded so far"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def quantile(name, q, **labels):
+    """
+    Estimate a quantile from histogram buckets, interpolating like Prometheus' histogram_quantile
+    Args:
+        name (str): Histogram name
+        q (float): Quantile between 0 and 1
+        labels: Only histograms carrying these labels are merged in
+    Returns:
+        float: The estimate, or None if nothing was observed
+    """
+    wanted = {k: str(v) for k, v in labels.items()}
+    with _lock:
+        matching = [
+            histogram for (metric, metric_labels), histogram in _histograms.items()
+            if metric == name and wanted.items() <= dict(metric_labels).items()
+        ]
+        if not matching:
+            return None
+        buckets = matching[0]['buckets']
+        counts = [sum(h['counts'][i] for h in matching if h['buckets'] == buckets) for i in range(len(buckets))]
+        total = sum(h['count'] for h in matching if h['buckets'] == buckets)
+    if total == 0:
+        return None
+
+    rank = q * total
+    lower, below = 0.0, 0
+    for bound, cumulative in zip(buckets, counts):
+        if cumulative >= rank:
+            in_bucket = cumulative - below
+            return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 1.0)
+        lower, below = bound, cumulative
+    return float(buckets[-1])
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def render():
+    """The registry in Prometheus text exposition format"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: dict(value, counts=list(value['counts'])) for key, value in _histograms.items()}
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                le = str(int(bound)) if float(bound).is_integer() else repr(float(bound))
+                lines.append(f"{name}_bucket{_labels(labels, [('le', le)])} {count}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']:g}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def stage_summary():
+    """(stage, calls, total seconds, errors) per stage, slowest first"""
+    with _lock:
+        totals = {}
+        for (name, labels), histogram in _histograms.items():
+            if name == 'stage_duration_seconds':
+                stage = dict(labels)['stage']
+                calls, seconds = totals.get(stage, (0, 0.0))
+                totals[stage] = (calls + histogram['count'], seconds + histogram['sum'])
+        errors = {}
+        for (name, labels), value in _counters.items():
+            if name == 'stage_errors_total':
+                stage = dict(labels)['stage']
+                errors[stage] = errors.get(stage, 0) + value
+    return sorted(
+        ((stage, calls, seconds, errors.get(stage, 0)) for stage, (calls, seconds) in totals.items()),
+        key=lambda row: row[2], reverse=True
+    )
+
+
+def export(path=None):
+    """
+    Write the registry to disk and print the per-stage summary
+    Args:
+        path (str): Output file, defaults to METRICS_DIR/<job>.prom
+    Returns:
+        str: The path written, or None if nothing was recorded
+    """
+    with _lock:
+        empty = not _counters and not _histograms
+    if empty or not enabled():
+        return None
+
+    if path is None:
+        job = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0] or 'python'
+        path = os.path.join(os.getenv('METRICS_DIR', os.path.join('.cache', 'metrics')), f"{job}.prom")
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+        return None
+
+    summary = stage_summary()
+    if summary:
+        print("\nTime by stage:")
+        for stage, calls, seconds, errors in summary:
+            print(f"  {stage:<20} {calls:5d} calls {seconds:8.2f}s{f' ({errors} errors)' if errors else ''}")
+    print(f"Metrics written to {path}")
+    return path
+
+
+atexit.register(export)
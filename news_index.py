@@ -0,0 +1,337 @@
+"""
+Embedding index over stored news summaries.
+
+Every summary written to finance_info is embedded once with the Gemini
+embedding model (GEMINI_EMBEDDING_MODEL) and kept in a local index: unit-length
+float32 vectors in a memory-mapped file plus a JSON-lines file of hashes,
+timestamps and texts under NEWS_INDEX_DIR. Cosine similarity is then a single
+matrix product, so top-k search over months of summaries takes milliseconds and
+texts already indexed are never embedded again. Entries older than
+NEWS_INDEX_RETENTION_DAYS are dropped when the index is opened.
+
+Set NEWS_INDEX_BACKEND=pgvector to keep the vectors in Supabase instead (install
+sql/finance_info_embeddings.sql first), or NEWS_INDEX_BACKEND=off to disable
+the index.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from rate_limiter import call_with_retry
+from price_store import to_epoch
+
+EMBEDDING_BATCH_SIZE = 100  # Most texts the embedding endpoint accepts per call
+
+
+def content_hash(text):
+    """Stable key for a summary"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _epoch(timestamp):
+    if timestamp is None:
+        return time.time()
+    return float(timestamp) if isinstance(timestamp, (int, float)) else to_epoch(timestamp)
+
+
+def gemini_embedder(api_key=None, model_name=None):
+    """
+    Embedding function backed by the Gemini API
+    Args:
+        api_key (str): Gemini API key, defaults to GEMINI_API_KEY
+        model_name (str): Embedding model, defaults to GEMINI_EMBEDDING_MODEL
+    Returns:
+        callable: embed(texts, task_type) -> float32 array with one row per text
+    """
+    model_name = model_name or os.getenv('GEMINI_EMBEDDING_MODEL', 'models/text-embedding-004')
+
+    def embed(texts, task_type):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key or os.getenv('GEMINI_API_KEY'))
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            result = call_with_retry(
+                'gemini', genai.embed_content,
+                model=model_name, content=texts[start:start + EMBEDDING_BATCH_SIZE], task_type=task_type
+            )
+            vectors.extend(result['embedding'])
+        return np.asarray(vectors, dtype=np.float32)
+
+    embed.model_name = model_name
+    return embed
+
+
+def top_k(vectors, queries, k):
+    """
+    Rows most similar to any of the queries
+    Args:
+        vectors (ndarray): Unit-length rows to search
+        queries (ndarray): Unit-length query rows
+        k (int): Number of rows to return
+    Returns:
+        tuple: (row indices, cosine similarities), most similar first
+    """
+    if len(vectors) == 0 or len(queries) == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    scores = (np.asarray(vectors) @ np.asarray(queries).T).max(axis=1)
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return best, scores[best]
+
+
+class NewsIndex:
+    """Local, memory-mapped embedding index; safe to share between threads"""
+
+    def __init__(self, directory=None, embed=None, retention_days=None):
+        self.directory = directory or os.getenv('NEWS_INDEX_DIR', os.path.join('.cache', 'news_index'))
+        self.retention = 86400 * (retention_days if retention_days is not None
+                                  else float(os.getenv('NEWS_INDEX_RETENTION_DAYS', '30')))
+        self._embed = embed
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.entries_path = os.path.join(self.directory, 'entries.jsonl')
+        self.info_path = os.path.join(self.directory, 'index.json')
+
+        self._lock = threading.Lock()
+        self._entries = []
+        self._rows = {}
+        self._dim = None
+        self._vectors = None
+        self._load()
+
+    @property
+    def embed(self):
+        """Embedding function, the Gemini embedder unless one was passed in"""
+        if self._embed is None:
+            self._embed = gemini_embedder()
+        return self._embed
+
+    def _model_name(self):
+        return getattr(self.embed, 'model_name', 'custom')
+
+    def _load(self):
+        try:
+            with open(self.info_path) as f:
+                info = json.load(f)
+            with open(self.entries_path) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            return
+        if info.get('model') != self._model_name():
+            # Vectors from another model are not comparable; start over
+            self._reset()
+            return
+
+        self._dim = info['dim']
+        # A crash between the two appends can leave one file longer; trust the shorter
+        rows = os.path.getsize(self.vectors_path) // (4 * self._dim) if os.path.exists(self.vectors_path) else 0
+        self._entries = entries[:rows]
+        cutoff = time.time() - self.retention
+        if any(entry['timestamp'] < cutoff for entry in self._entries) or len(entries) != rows:
+            self._rewrite([i for i, entry in enumerate(self._entries) if entry['timestamp'] >= cutoff])
+        self._rows = {entry['hash']: i for i, entry in enumerate(self._entries)}
+
+    def _reset(self):
+        for path in (self.vectors_path, self.entries_path, self.info_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._entries, self._rows, self._dim, self._vectors = [], {}, None, None
+
+    def _rewrite(self, keep):
+        """Rewrite both files with only the given rows"""
+        vectors = np.array(self.vectors()[keep]) if len(keep) else np.empty((0, self._dim), dtype=np.float32)
+        self._entries = [self._entries[i] for i in keep]
+        self._vectors = None
+        with open(f"{self.vectors_path}.tmp", 'wb') as f:
+            f.write(vectors.astype(np.float32).tobytes())
+        with open(f"{self.entries_path}.tmp", 'w') as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in self._entries)
+        os.replace(f"{self.vectors_path}.tmp", self.vectors_path)
+        os.replace(f"{self.entries_path}.tmp", self.entries_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def vectors(self):
+        """All vectors as a read-only memory map, one row per entry"""
+        if self._vectors is None or len(self._vectors) != len(self._entries):
+            if not self._entries:
+                return np.empty((0, self._dim or 0), dtype=np.float32)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self._entries), self._dim))
+        return self._vectors
+
+    def add(self, texts, timestamps=None):
+        """
+        Embed and index texts that are not indexed yet
+        Args:
+            texts (list): Summaries
+            timestamps (list): ISO strings or Unix seconds per text, defaults to now
+        Returns:
+            int: Number of texts added
+        """
+        timestamps = timestamps or [None] * len(texts)
+        with self._lock:
+            new = {}
+            for text, timestamp in zip(texts, timestamps):
+                key = content_hash(text)
+                if key not in self._rows and key not in new:
+                    new[key] = (text, _epoch(timestamp))
+            if not new:
+                return 0
+
+            vectors = _normalize(self.embed([text for text, _ in new.values()], 'retrieval_document'))
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                with open(self.info_path, 'w') as f:
+                    json.dump({'model': self._model_name(), 'dim': self._dim}, f)
+            entries = [{'hash': key, 'timestamp': epoch, 'info': text} for key, (text, epoch) in new.items()]
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.entries_path, 'a') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            for entry in entries:
+                self._rows[entry['hash']] = len(self._entries)
+                self._entries.append(entry)
+            return len(entries)
+
+    def vectors_for(self, texts, timestamps=None):
+        """Vectors for texts, in order, embedding the ones not indexed yet"""
+        self.add(texts, timestamps)
+        return np.asarray(self.vectors()[[self._rows[content_hash(text)] for text in texts]])
+
+    def embed_queries(self, queries):
+        """Unit-length vectors for search queries"""
+        return _normalize(self.embed(list(queries), 'retrieval_query'))
+
+    def search(self, queries, k=10, since=None):
+        """
+        Find the summaries most similar to any of the queries
+        Args:
+            queries (list): Query texts
+            k (int): Number of results
+            since (str|float): Only consider summaries stored after this time
+        Returns:
+            list: {'info', 'timestamp', 'similarity'} dicts, most similar first
+        """
+        return self.search_vectors(self.embed_queries(queries), k, since)
+
+    def search_vectors(self, query_vectors, k=10, since=None):
+        """search with queries that are already embedded"""
+        if not self._entries:
+            return []
+        rows = np.arange(len(self._entries))
+        if since is not None:
+            cutoff = _epoch(since)
+            rows = rows[[entry['timestamp'] > cutoff for entry in self._entries]]
+        indices, scores = top_k(self.vectors()[rows], query_vectors, k)
+        return [
+            {
+                'info': self._entries[rows[i]]['info'],
+                'timestamp': datetime.fromtimestamp(self._entries[rows[i]]['timestamp'], timezone.utc).isoformat(),
+                'similarity': float(score)
+            }
+            for i, score in zip(indices, scores)
+        ]
+
+
+class PgVectorIndex:
+    """The same interface backed by the finance_info_embeddings table (pgvector) in Supabase"""
+
+    def __init__(self, supabase, embed=None):
+        self.supabase = supabase
+        self._embed = embed
+
+    @property
+    def embed(self):
+        if self._embed is None:
+            self._embed = gemini_embedder()
+        return self._embed
+
+    def add(self, texts, timestamps=None):
+        timestamps = timestamps or [None] * len(texts)
+        known = self._fetch(texts)
+        new = {}
+        for text, timestamp in zip(texts, timestamps):
+            key = content_hash(text)
+            if key not in known and key not in new:
+                new[key] = (text, _epoch(timestamp))
+        if not new:
+            return 0
+        vectors = _normalize(self.embed([text for text, _ in new.values()], 'retrieval_document'))
+        rows = [
+            {
+                'content_hash': key,
+                'info': text,
+                'timestamp': datetime.fromtimestamp(epoch, timezone.utc).isoformat(),
+                'embedding': vector.tolist()
+            }
+            for (key, (text, epoch)), vector in zip(new.items(), vectors)
+        ]
+        self.supabase.table('finance_info_embeddings').upsert(
+            rows, on_conflict='content_hash', ignore_duplicates=True
+        ).execute()
+        return len(rows)
+
+    def _fetch(self, texts):
+        """Stored vectors for texts, keyed by content hash"""
+        keys = list({content_hash(text) for text in texts})
+        vectors = {}
+        for start in range(0, len(keys), EMBEDDING_BATCH_SIZE):
+            response = self.supabase.table('finance_info_embeddings').select('content_hash,embedding') \
+                .in_('content_hash', keys[start:start + EMBEDDING_BATCH_SIZE]).execute()
+            for row in response.data:
+                embedding = row['embedding']
+                # PostgREST returns vector columns as text
+                vectors[row['content_hash']] = json.loads(embedding) if isinstance(embedding, str) else embedding
+        return vectors
+
+    def vectors_for(self, texts, timestamps=None):
+        self.add(texts, timestamps)
+        vectors = self._fetch(texts)
+        return _normalize([vectors[content_hash(text)] for text in texts])
+
+    def embed_queries(self, queries):
+        return _normalize(self.embed(list(queries), 'retrieval_query'))
+
+    def search(self, queries, k=10, since=None):
+        return self.search_vectors(self.embed_queries(queries), k, since)
+
+    def search_vectors(self, query_vectors, k=10, since=None):
+        since = datetime.fromtimestamp(_epoch(since) if since is not None else 0, timezone.utc).isoformat()
+        matches = {}
+        for vector in query_vectors:
+            response = self.supabase.rpc('match_finance_info', {
+                'query_embedding': vector.tolist(), 'match_count': k, 'since': since
+            }).execute()
+            for row in response.data:
+                if row['info'] not in matches or matches[row['info']]['similarity'] < row['similarity']:
+                    matches[row['info']] = row
+        return sorted(matches.values(), key=lambda row: -row['similarity'])[:k]
+
+
+def open_index(supabase=None, embed=None):
+    """
+    The index selected by NEWS_INDEX_BACKEND (local, pgvector or off)
+    Args:
+        supabase (Client): Supabase client, needed for pgvector
+        embed (callable): Embedding function, defaults to the Gemini embedder
+    Returns:
+        NewsIndex or PgVectorIndex, or None if the index is off
+    """
+    backend = os.getenv('NEWS_INDEX_BACKEND', 'local').lower()
+    if backend in ('off', '0', 'false', 'no'):
+        return None
+    if backend == 'pgvector':
+        return PgVectorIndex(supabase, embed)
+    return NewsIndex(embed=embed)
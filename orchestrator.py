@@ -0,0 +1,117 @@
+"""
+Runs all three agents in one process as a small dependency graph.
+
+BTC price collection and news collection have no dependencies and run in
+parallel; the email report starts once both are done. Every stage shares the
+process-wide Supabase client and auth session. The news summaries stored by
+the info stage are handed to the email stage in memory, which then only reads
+older news in the report window from Supabase. With REPORTS_CONFIG set, the email stage sends every
+report listed there (see reports.py) instead of the single daily one.
+Per-stage timings are printed at the end.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+
+def run_graph(stages, max_workers=None):
+    """
+    Run stages as soon as their dependencies have finished
+    Args:
+        stages (dict): name -> (dependency names, func); func receives a dict of
+            dependency results and returns the stage result
+        max_workers (int): Stages allowed to run at once, defaults to the number of stages
+    Returns:
+        tuple: (results, timings) dicts keyed by stage name; a stage that raised has result None
+    """
+    for name, (dependencies, _) in stages.items():
+        unknown = [dependency for dependency in dependencies if dependency not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {', '.join(unknown)}")
+
+    def timed(name, func, inputs):
+        started = time.perf_counter()
+        try:
+            return func(inputs), time.perf_counter() - started
+        except Exception as e:
+            print(f"Stage '{name}' failed: {e}")
+            return None, time.perf_counter() - started
+
+    results, timings, running = {}, {}, {}
+    pending = dict(stages)
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as pool:
+        while pending or running:
+            for name, (dependencies, func) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    inputs = {dependency: results[dependency] for dependency in dependencies}
+                    running[pool.submit(timed, name, func, inputs)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Stages have circular dependencies: {', '.join(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+    return results, timings
+
+
+def build_stages(news_mode='async', hours=24):
+    """The daily job: BTC price and news in parallel, then the email report"""
+    def btc_stage(inputs):
+        import btc_agent
+        if not btc_agent.authenticate():
+            return None
+        return btc_agent.run_once()
+
+    def news_stage(inputs):
+        from info_agent import InfoAgent
+        agent = InfoAgent()
+        if news_mode == 'async':
+            asyncio.run(agent.run_async())
+        elif news_mode == 'batched':
+            agent.run_batched()
+        else:
+            agent.run()
+        return agent.stored_news[::-1]
+
+    def email_stage(inputs):
+        from email_agent import EmailAgent
+        # This run's summaries; older news in the window is still read from Supabase
+        news_data = inputs['news'] or None
+        if os.getenv('REPORTS_CONFIG'):
+            import reports
+            return reports.run_reports(EmailAgent(), reports.load_specs(), news_data=news_data)
+        return EmailAgent().run(hours=hours, news_data=news_data)
+
+    return {
+        'btc': ([], btc_stage),
+        'news': ([], news_stage),
+        'email': (['btc', 'news'], email_stage),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the BTC, news and email agents in one process")
+    parser.add_argument('--news-mode', choices=['serial', 'async', 'batched'], default='async',
+                        help="How the info agent processes topics")
+    parser.add_argument('--hours', type=int, default=24, help="Report window in hours")
+    args = parser.parse_args()
+
+    load_dotenv(override=True)
+    started = time.perf_counter()
+    results, timings = run_graph(build_stages(args.news_mode, args.hours))
+    total = time.perf_counter() - started
+
+    print("\nStage timings:")
+    for name, seconds in timings.items():
+        print(f"  {name:<6} {seconds:7.2f}s")
+    print(f"  {'total':<6} {total:7.2f}s (serial would take {sum(timings.values()):.2f}s)")
+    return 0 if results.get('email') else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,230 @@
+"""
+Incremental local time-series store for BTC prices.
+
+Timestamps (float64 Unix seconds) and prices (float64) are kept in two raw,
+append-only column files per asset/currency pair under PRICE_STORE_DIR (e.g.
+.cache/btc_price/bitcoin-usd) and read back as memory-mapped
+NumPy arrays. Each sync only asks Supabase for rows newer than the local
+high-water mark, so report windows of any length are served locally; window
+queries, resampling and rolling statistics are vectorized NumPy operations.
+
+Rows can reach Supabase after newer ones (journal replays, a sampler and a
+single-shot run buffering in different processes), so every sync re-reads the
+last PRICE_STORE_SYNC_OVERLAP seconds (default 3600) before the high-water mark
+and merges in the rows it does not have yet.
+"""
+
+import os
+import json
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+DTYPE = np.dtype('<f8')
+
+
+def to_epoch(value):
+    """Convert an ISO timestamp string (naive means UTC) or datetime to Unix seconds"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def to_iso(epoch):
+    """Convert Unix seconds to an ISO timestamp string in UTC"""
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def ohlc(timestamps, prices, resolution):
+    """
+    Bucket an ascending price series into OHLC candles
+    Args:
+        timestamps (ndarray): Ascending Unix seconds
+        prices (ndarray): Prices aligned with timestamps
+        resolution (float): Bucket width in seconds
+    Returns:
+        dict: Arrays 'bucket', 'open', 'high', 'low', 'close' and 'samples', oldest first
+    """
+    if len(timestamps) == 0:
+        empty = np.empty(0)
+        return {'bucket': empty, 'open': empty, 'high': empty, 'low': empty, 'close': empty,
+                'samples': np.empty(0, dtype=np.int64)}
+
+    bucket_ids = np.floor(np.asarray(timestamps) / resolution).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_ids)) + 1))
+    ends = np.concatenate((starts[1:], [len(bucket_ids)]))
+    prices = np.asarray(prices)
+    return {
+        'bucket': bucket_ids[starts] * float(resolution),
+        'open': prices[starts],
+        'high': np.maximum.reduceat(prices, starts),
+        'low': np.minimum.reduceat(prices, starts),
+        'close': prices[ends - 1],
+        'samples': ends - starts
+    }
+
+
+def rolling_mean(values, window):
+    """Trailing mean over window points, NaN until the window is full"""
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if window <= 0 or len(values) < window:
+        return result
+    sums = np.cumsum(np.concatenate(([0.0], values)))
+    result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+def rolling_std(values, window):
+    """Trailing population standard deviation over window points, NaN until the window is full"""
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if window <= 1 or len(values) < window:
+        return result
+    mean = rolling_mean(values, window)[window - 1:]
+    mean_of_squares = rolling_mean(values ** 2, window)[window - 1:]
+    result[window - 1:] = np.sqrt(np.maximum(mean_of_squares - mean ** 2, 0.0))
+    return result
+
+
+class PriceStore:
+    """Append-only, memory-mapped column store of (timestamp, price) pairs for one asset/currency pair"""
+
+    def __init__(self, path=None, asset='bitcoin', currency='usd'):
+        base = path or os.getenv('PRICE_STORE_DIR', os.path.join('.cache', 'btc_price'))
+        self.asset = asset
+        self.currency = currency
+        self.path = os.path.join(base, f"{asset}-{currency}")
+        os.makedirs(self.path, exist_ok=True)
+        self._timestamps_path = os.path.join(self.path, 'timestamps.f8')
+        self._prices_path = os.path.join(self.path, 'prices.f8')
+        self._meta_path = os.path.join(self.path, 'meta.json')
+        self.overlap = float(os.getenv('PRICE_STORE_SYNC_OVERLAP', '3600'))
+        self._lock = threading.Lock()
+
+    def _column(self, path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=DTYPE)
+        return np.memmap(path, dtype=DTYPE, mode='r')
+
+    def columns(self):
+        """Memory-mapped (timestamps, prices) arrays, oldest first"""
+        with self._lock:
+            timestamps = self._column(self._timestamps_path)
+            prices = self._column(self._prices_path)
+        size = min(len(timestamps), len(prices))  # Guard against a half-written append
+        return timestamps[:size], prices[:size]
+
+    def _meta(self):
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, meta):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    @property
+    def high_water_mark(self):
+        """Timestamp of the newest stored price, or None if the store is empty"""
+        timestamps, _ = self.columns()
+        return float(timestamps[-1]) if len(timestamps) else None
+
+    def _append(self, timestamps, prices):
+        with self._lock:
+            with open(self._timestamps_path, 'ab') as f:
+                f.write(np.asarray(timestamps, dtype=DTYPE).tobytes())
+            with open(self._prices_path, 'ab') as f:
+                f.write(np.asarray(prices, dtype=DTYPE).tobytes())
+
+    def _merge(self, timestamps, prices):
+        """Rewrite the columns with rows that belong before the newest one; only needed for late or backfilled rows"""
+        existing_timestamps, existing_prices = self.columns()
+        merged_timestamps = np.concatenate((existing_timestamps, np.asarray(timestamps, dtype=DTYPE)))
+        merged_prices = np.concatenate((existing_prices, np.asarray(prices, dtype=DTYPE)))
+        order = np.argsort(merged_timestamps, kind='stable')
+        merged_timestamps, merged_prices = merged_timestamps[order], merged_prices[order]
+        with self._lock:
+            for path, column in ((self._timestamps_path, merged_timestamps), (self._prices_path, merged_prices)):
+                tmp_path = f"{path}.tmp"
+                column.tofile(tmp_path)
+                os.replace(tmp_path, path)
+
+    @staticmethod
+    def _rows_to_arrays(rows):
+        timestamps = np.array([to_epoch(row['timestamp']) for row in rows], dtype=DTYPE)
+        prices = np.array([row['price'] for row in rows], dtype=DTYPE)
+        order = np.argsort(timestamps, kind='stable')
+        return timestamps[order], prices[order]
+
+    def _unseen(self, timestamps, prices, start, end=None):
+        """Mask of fetched rows in (start, end] that the store does not hold yet"""
+        stored = set(zip(*(column.tolist() for column in self.window(start, end))))
+        return np.array([(t, p) not in stored for t, p in zip(timestamps.tolist(), prices.tolist())], dtype=bool)
+
+    def _add(self, timestamps, prices):
+        high_water_mark = self.high_water_mark
+        if high_water_mark is None or timestamps[0] > high_water_mark:
+            self._append(timestamps, prices)
+        else:
+            self._merge(timestamps, prices)
+
+    def sync(self, fetch_rows, since):
+        """
+        Bring the store up to date for a window starting at since
+        Args:
+            fetch_rows (callable): fetch_rows(since_iso, until_iso=None) returning rows with
+                'timestamp' and 'price', ascending, newer than since_iso and not newer than until_iso
+            since (float): Window start in Unix seconds
+        Returns:
+            int: Number of rows added
+        """
+        meta = self._meta()
+        synced_from = meta.get('synced_from')
+        added = 0
+
+        # Backfill once if this window starts before anything we have synced
+        if synced_from is not None and since < synced_from:
+            rows = fetch_rows(to_iso(since), to_iso(synced_from))
+            if rows:
+                timestamps, prices = self._rows_to_arrays(rows)
+                keep = self._unseen(timestamps, prices, since, synced_from)
+                if keep.any():
+                    self._merge(timestamps[keep], prices[keep])
+                added += int(keep.sum())
+
+        # Re-read an overlap before the high-water mark to pick up rows that arrived late,
+        # but nothing before the range the store covers
+        covered_from = since if synced_from is None else min(since, synced_from)
+        high_water_mark = self.high_water_mark
+        start = max(high_water_mark - self.overlap, covered_from) if high_water_mark is not None else since
+        rows = fetch_rows(to_iso(start))
+        if rows:
+            timestamps, prices = self._rows_to_arrays(rows)
+            keep = (timestamps > start) & self._unseen(timestamps, prices, start)
+            if keep.any():
+                self._add(timestamps[keep], prices[keep])
+            added += int(keep.sum())
+
+        if synced_from is None or since < synced_from:
+            meta['synced_from'] = since
+            self._save_meta(meta)
+        return added
+
+    def window(self, start, end=None):
+        """(timestamps, prices) with start < timestamp <= end, as zero-copy views"""
+        timestamps, prices = self.columns()
+        lo = np.searchsorted(timestamps, start, side='right')
+        hi = len(timestamps) if end is None else np.searchsorted(timestamps, end, side='right')
+        return timestamps[lo:hi], prices[lo:hi]
+
+    def resample(self, start, resolution, end=None):
+        """OHLC candles for a window, oldest first (see ohlc)"""
+        timestamps, prices = self.window(start, end)
+        return ohlc(timestamps, prices, resolution)
@@ -0,0 +1,175 @@
+"""
+Token-budgeted news section for the analysis prompt.
+
+The report prompt used to include every finance_info row in the window, so it
+grew with the number of topics and the window length. fit_news keeps it under a
+budget, counting tokens locally with estimate_tokens:
+
+1. Near-duplicate summaries (SimHash within DEDUP_MAX_DISTANCE bits) are
+   dropped, keeping the newest.
+2. The rest are ranked by recency, discounted by similarity to summaries
+   already picked (maximal marginal relevance, PROMPT_DIVERSITY), so a dozen
+   takes on one story do not crowd out the others.
+3. Summaries are taken in rank order until the budget is used up.
+4. Whatever does not fit is condensed with a cheap model into a digest that
+   takes at most PROMPT_DIGEST_SHARE of the budget. Overflow is condensed in
+   chunks of PROMPT_CONDENSE_CHUNK_TOKENS and the digests are condensed again
+   until they fit.
+5. As a last resort the section is truncated, so it never exceeds the budget.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dedup_index import simhash, estimate_tokens, FINGERPRINT_BITS
+
+MAX_CONDENSE_LEVELS = 3
+
+# Set bits in every byte value, for vectorized Hamming distances
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _distances(fingerprints, fingerprint):
+    """Hamming distances from one 64-bit fingerprint to an array of them"""
+    xor = np.bitwise_xor(fingerprints, fingerprint)
+    return _POPCOUNT[xor.view(np.uint8)].reshape(len(fingerprints), 8).sum(axis=1)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text at a line or word boundary so estimate_tokens(text) <= max_tokens"""
+    limit = max(0, max_tokens) * 4
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind("\n"), cut.rfind(" "))
+    return cut[:boundary] if boundary > limit // 2 else cut
+
+
+def rank_news(texts, diversity=None, max_distance=None):
+    """
+    Drop near-duplicates and order texts by recency and novelty
+    Args:
+        texts (list): News summaries, newest first
+        diversity (float): 0 ranks purely by recency, 1 mostly by novelty
+        max_distance (int): SimHash distance at which two summaries count as duplicates
+    Returns:
+        tuple: (ranked texts, number of duplicates dropped)
+    """
+    diversity = diversity if diversity is not None else float(os.getenv('PROMPT_DIVERSITY', '0.5'))
+    max_distance = max_distance if max_distance is not None else int(os.getenv('DEDUP_MAX_DISTANCE', '3'))
+
+    unique, fingerprints = [], np.empty(len(texts), dtype=np.uint64)
+    for text in texts:
+        fingerprint = np.uint64(simhash(text))
+        if len(unique) and _distances(fingerprints[:len(unique)], fingerprint).min() <= max_distance:
+            continue
+        fingerprints[len(unique)] = fingerprint
+        unique.append(text)
+    duplicates = len(texts) - len(unique)
+    fingerprints = fingerprints[:len(unique)]
+
+    # Unrelated texts sit about half the bits apart, so that counts as no similarity
+    count = len(unique)
+    score = (1 - diversity) * (1.0 - np.arange(count) / max(count, 1))
+    redundancy = np.zeros(count)
+    remaining = np.ones(count, dtype=bool)
+    ranked = []
+    for _ in range(count):
+        best = int(np.argmax(np.where(remaining, score - diversity * redundancy, -np.inf)))
+        remaining[best] = False
+        ranked.append(unique[best])
+        similarity = np.clip(1.0 - _distances(fingerprints, fingerprints[best]) / (FINGERPRINT_BITS / 2), 0.0, 1.0)
+        np.maximum(redundancy, similarity, out=redundancy)
+    return ranked, duplicates
+
+
+def _chunks(texts, chunk_tokens):
+    chunks, current, size = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and size + tokens > chunk_tokens:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(text)
+        size += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def condense_texts(texts, max_tokens, condense, chunk_tokens=None):
+    """
+    Condense texts hierarchically until they fit max_tokens
+    Args:
+        texts (list): Texts to condense
+        max_tokens (int): Token budget for the result
+        condense (callable): condense(text, max_tokens) -> shorter text or None
+        chunk_tokens (int): Input tokens per condense call
+    Returns:
+        str: The digest, or None if a condense call failed
+    """
+    chunk_tokens = chunk_tokens or int(os.getenv('PROMPT_CONDENSE_CHUNK_TOKENS', '4000'))
+    level = list(texts)
+    for _ in range(MAX_CONDENSE_LEVELS):
+        chunks = ["\n".join(f"- {text}" for text in chunk) for chunk in _chunks(level, chunk_tokens)]
+        per_chunk = max(64, max_tokens // len(chunks))
+        with ThreadPoolExecutor(max_workers=min(4, len(chunks))) as pool:
+            digests = list(pool.map(lambda chunk: condense(chunk, per_chunk), chunks))
+        if not all(digests):
+            return None
+        level = [digest.strip() for digest in digests]
+        digest = "\n".join(level)
+        if estimate_tokens(digest) <= max_tokens or len(chunks) == 1:
+            # A single chunk will not shrink much further by condensing its digest again
+            return truncate_to_tokens(digest, max_tokens)
+    return truncate_to_tokens("\n".join(level), max_tokens)
+
+
+def fit_news(texts, max_tokens, condense=None, digest_share=None):
+    """
+    Build the news section of the analysis prompt within a token budget
+    Args:
+        texts (list): News summaries, newest first
+        max_tokens (int): Token budget for the whole section
+        condense (callable): condense(text, max_tokens) used for overflow; overflow is dropped without it
+        digest_share (float): Share of the budget reserved for the overflow digest
+    Returns:
+        tuple: (section text, stats dict with total, duplicates, included, condensed, dropped and tokens)
+    """
+    digest_share = digest_share if digest_share is not None else float(os.getenv('PROMPT_DIGEST_SHARE', '0.25'))
+    header = "\nRecent Financial News:\n"
+    budget = max(0, max_tokens - estimate_tokens(header))
+    ranked, duplicates = rank_news(texts)
+    stats = {'total': len(texts), 'duplicates': duplicates, 'included': 0, 'condensed': 0, 'dropped': 0}
+
+    lines = [f"- {text}\n" for text in ranked]
+    if sum(estimate_tokens(line) for line in lines) > budget and condense:
+        # Leave room for a digest of what does not fit
+        item_budget = int(budget * (1 - digest_share))
+    else:
+        item_budget = budget
+
+    kept, used = [], 0
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if used + tokens > item_budget:
+            break
+        kept.append(line)
+        used += tokens
+    stats['included'] = len(kept)
+    overflow = ranked[len(kept):]
+
+    section = header + "".join(kept)
+    digest_header = "\nOther news, condensed:\n"
+    digest_budget = budget - used - estimate_tokens(digest_header)
+    if overflow and condense and digest_budget >= 64:
+        digest = condense_texts(overflow, digest_budget, condense)
+        if digest:
+            section += digest_header + digest + "\n"
+            stats['condensed'] = len(overflow)
+            overflow = []
+    stats['dropped'] = len(overflow)
+
+    section = truncate_to_tokens(section, max_tokens)
+    stats['tokens'] = estimate_tokens(section)
+    return section, stats
@@ -0,0 +1,280 @@
+"""
+Shared rate limiting and retry scheduling for the agents' external APIs.
+
+Every endpoint (brave, gemini, coingecko) gets one token bucket per process,
+configured from the environment as RATE_LIMIT_<NAME>="<requests per second>/<burst>",
+e.g. RATE_LIMIT_BRAVE="1/1". When an API tells us to back off (429, Retry-After or
+an exhausted Brave quota window) the bucket is paused and the pause is written to
+a small state file, so overlapping runs in other processes wait it out too.
+Waits longer than RATE_LIMIT_MAX_WAIT seconds (default 300), such as an exhausted
+monthly Brave quota, are not slept through: the call fails instead, and so do
+later calls until the pause is over.
+"""
+
+import os
+import time
+import json
+import random
+import asyncio
+import tempfile
+import threading
+from email.utils import parsedate_to_datetime
+import metrics
+
+# (requests per second, burst size) used when no RATE_LIMIT_<NAME> is set
+DEFAULT_LIMITS = {
+    'brave': (1.0, 1),       # Brave free plan allows 1 request per second
+    'gemini': (1.0, 4),
+    'coingecko': (0.5, 5),   # Public API allows roughly 30 calls per minute
+}
+
+STATE_DIR = os.getenv('RATE_LIMIT_STATE_DIR', os.path.join(tempfile.gettempdir(), 'financenewsagent-ratelimits'))
+
+# Longest server-requested pause worth waiting out instead of failing the call
+MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '300'))
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimitExceeded(Exception):
+    """An endpoint is paused for longer than RATE_LIMIT_MAX_WAIT"""
+
+
+class CallCancelled(Exception):
+    """The caller gave up on a call before it was sent"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Callers reserve tokens up front and the bucket is
+    allowed to go into debt, so queued callers are released in order at the
+    configured rate rather than all retrying at once.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0  # Wall clock, so it can be shared between processes
+        self._lock = threading.Lock()
+        self._state_file = os.path.join(STATE_DIR, f"{name}.json")
+
+    def _shared_pause(self):
+        """Read a pause written by another process, if any"""
+        try:
+            with open(self._state_file) as f:
+                return float(json.load(f).get('paused_until', 0))
+        except (OSError, ValueError):
+            return 0.0
+
+    def _reserve(self, tokens):
+        """Take tokens and return how many seconds the caller must wait before using them;
+        raises RateLimitExceeded instead if the endpoint is paused for longer than MAX_WAIT"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            paused_for = max(self._paused_until, self._shared_pause()) - time.time()
+            if paused_for > MAX_WAIT:
+                raise RateLimitExceeded(
+                    f"{self.name} is paused for another {paused_for:.0f}s, longer than RATE_LIMIT_MAX_WAIT ({MAX_WAIT:g}s)"
+                )
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.rate)
+            return max(wait, paused_for)
+
+    def acquire(self, tokens=1):
+        """Block until the requested tokens are available"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=1):
+        """Wait for the requested tokens without blocking the event loop"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given number of seconds, in every process"""
+        paused_until = time.time() + seconds
+        with self._lock:
+            if paused_until <= self._paused_until:
+                return
+            self._paused_until = paused_until
+            self._tokens = min(self._tokens, 0.0)
+        try:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            tmp_file = f"{self._state_file}.{os.getpid()}"
+            with open(tmp_file, 'w') as f:
+                json.dump({'paused_until': paused_until}, f)
+            os.replace(tmp_file, self._state_file)
+        except OSError as e:
+            print(f"Could not share rate limit pause for {self.name}: {e}")
+
+    def update_from_headers(self, headers):
+        """Pause early when Brave reports an exhausted quota window"""
+        remaining = _header_values(headers.get('X-RateLimit-Remaining'))
+        reset = _header_values(headers.get('X-RateLimit-Reset'))
+        for left, seconds in zip(remaining, reset):
+            if left <= 0:
+                self.pause(seconds)
+
+
+def _header_values(value):
+    """Parse Brave's comma separated per-window rate limit headers, e.g. '1, 15000'"""
+    if not value:
+        return []
+    try:
+        return [float(item) for item in value.split(',')]
+    except ValueError:
+        return []
+
+
+def get_limiter(name):
+    """Return the shared token bucket for an endpoint, creating it from the env on first use"""
+    with _limiters_lock:
+        if name not in _limiters:
+            rate, capacity = DEFAULT_LIMITS.get(name, (1.0, 1))
+            configured = os.getenv(f"RATE_LIMIT_{name.upper()}")
+            if configured:
+                rate_text, _, capacity_text = configured.partition('/')
+                rate = float(rate_text)
+                capacity = int(capacity_text) if capacity_text else max(1, int(rate))
+            _limiters[name] = TokenBucket(name, rate, capacity)
+        return _limiters[name]
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """Exponential backoff with random jitter so concurrent callers spread out"""
+    return random.uniform(base_delay / 2, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_after(headers):
+    """
+    Work out how long the server asked us to wait
+    Args:
+        headers (Mapping): Response headers
+    Returns:
+        float: Seconds to wait or None if the server did not say
+    """
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    remaining = _header_values(headers.get('X-RateLimit-Remaining'))
+    reset = _header_values(headers.get('X-RateLimit-Reset'))
+    waits = [seconds for left, seconds in zip(remaining, reset) if left <= 0]
+    return max(waits) if waits else None
+
+
+def _status_code(error):
+    """Best-effort HTTP status for requests and google.api_core errors"""
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return response.status_code
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def _is_retryable(status, error=None):
+    """429s, server errors and network errors (no status) are worth retrying"""
+    if status is None:
+        return error is None or isinstance(error, OSError)
+    return status == 429 or status >= 500
+
+
+def call_with_retry(name, func, *args, max_retries=3, base_delay=1.0, cancelled=None, on_acquire=None, **kwargs):
+    """
+    Call func under the endpoint's rate limit, retrying transient failures
+    Args:
+        name (str): Endpoint name used to pick the token bucket
+        func (callable): Function making the API call
+        max_retries (int): Maximum number of attempts
+        base_delay (float): Base delay for jittered exponential backoff in seconds
+        cancelled (threading.Event): Once set, no further attempts are made and the last error is re-raised
+        on_acquire (callable): Called with no arguments each time a token is granted, just before func is called
+    Returns:
+        The return value of func. The last error is re-raised if every attempt fails.
+    Raises:
+        CallCancelled: If cancelled is set while waiting for a token
+    """
+    limiter = get_limiter(name)
+    for attempt in range(max_retries):
+        limiter.acquire()
+        if cancelled is not None and cancelled.is_set():
+            raise CallCancelled(f"{name} call cancelled before it was sent")
+        if on_acquire is not None:
+            on_acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            status = _status_code(e)
+            if attempt == max_retries - 1 or not _is_retryable(status, e) or (cancelled and cancelled.is_set()):
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            if status == 429:
+                limiter.pause(delay)
+            metrics.inc('retries_total', endpoint=name)
+            print(f"{name} call failed ({e}). Retrying in {delay:.1f} seconds...")
+            if cancelled is None:
+                time.sleep(delay)
+            elif cancelled.wait(delay):
+                raise
+
+
+def send_with_retry(name, send, max_retries=3, base_delay=1.0):
+    """
+    Send an HTTP request under the endpoint's rate limit, honouring Retry-After
+    Args:
+        name (str): Endpoint name used to pick the token bucket
+        send (callable): Zero-argument function returning a requests.Response
+        max_retries (int): Maximum number of attempts
+        base_delay (float): Base delay for jittered exponential backoff in seconds
+    Returns:
+        requests.Response: The last response, which may still be an error status.
+        Network errors are re-raised once every attempt has failed.
+    Raises:
+        RateLimitExceeded: If the endpoint is paused for longer than RATE_LIMIT_MAX_WAIT
+    """
+    limiter = get_limiter(name)
+    for attempt in range(max_retries):
+        last_attempt = attempt == max_retries - 1
+        limiter.acquire()
+        try:
+            response = send()
+        except Exception as e:
+            if last_attempt or not _is_retryable(_status_code(e), e):
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            metrics.inc('retries_total', endpoint=name)
+            print(f"{name} request failed ({e}). Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            continue
+
+        limiter.update_from_headers(response.headers)
+        if last_attempt or not _is_retryable(response.status_code):
+            return response
+
+        delay = retry_after(response.headers) or backoff_delay(attempt, base_delay)
+        if response.status_code == 429:
+            limiter.pause(delay)
+        if delay > MAX_WAIT:
+            # e.g. an exhausted monthly quota: fail now rather than hang the job for days
+            print(f"{name} asked us to wait {delay:.0f}s, longer than RATE_LIMIT_MAX_WAIT ({MAX_WAIT:g}s). Giving up")
+            return response
+        metrics.inc('retries_total', endpoint=name)
+        if response.status_code == 429:
+            print(f"{name} rate limited. Waiting {delay:.1f} seconds before retry...")
+        else:
+            print(f"{name} returned {response.status_code}. Retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
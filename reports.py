@@ -0,0 +1,273 @@
+"""
+Several email reports from one fetch.
+
+A report is a window (hours, bucket resolution), an asset/currency pair and a
+subscriber group. run_reports reads the longest window once per pair and the news once,
+derives every report's data from that, and shares intermediate results between
+reports that have them in common:
+
+- price buckets, statistics and the chart once per (asset, currency, hours, resolution)
+- relevant news and the Gemini analysis once per window as well, so several
+  subscriber groups on the same window cost one LLM call
+- one pooled SMTP delivery for all messages
+
+Statistics and charts are computed on a process pool (REPORT_WORKERS) and the
+analyses are generated concurrently (REPORT_LLM_CONCURRENCY), each starting as
+soon as its window's statistics are ready.
+
+Reports are listed in the JSON file named by REPORTS_CONFIG, for example:
+
+    [
+        {"name": "daily", "hours": 24},
+        {"name": "weekly", "hours": 168, "resolution": 3600, "recipients": "Desk <desk@example.com>"},
+        {"name": "eth-daily", "hours": 24, "asset": "ethereum", "recipients_file": "eth_subscribers.csv"}
+    ]
+
+asset defaults to bitcoin and currency to usd; prices are read from the btc_price
+rows with that asset and currency, which the BTC agent's sampler writes for
+every pair it samples. recipients and recipients_file work like RECIPIENT_EMAIL
+and RECIPIENTS_FILE and default to them.
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
+from dotenv import load_dotenv
+from price_store import to_epoch, to_iso
+from market_stats import stats_from_price_data
+from mail_delivery import load_recipients
+import metrics
+
+_renderer = None
+
+
+def load_specs(path=None):
+    """
+    Read report definitions
+    Args:
+        path (str): JSON file, defaults to REPORTS_CONFIG
+    Returns:
+        list: Report dicts with name, hours and, if given, resolution, asset, currency, recipients,
+            recipients_file and title
+    """
+    path = path or os.getenv('REPORTS_CONFIG')
+    if not path:
+        return [{'name': 'daily', 'hours': 24}]
+    with open(path) as f:
+        specs = json.load(f)
+    for i, spec in enumerate(specs):
+        if 'hours' not in spec:
+            raise ValueError(f"Report {spec.get('name', i)} has no 'hours'")
+        spec.setdefault('name', f"report-{i + 1}")
+    return specs
+
+
+def rebucket(price_data, since, resolution):
+    """
+    Merge OHLC buckets into coarser ones
+    Args:
+        price_data (list): Bucket rows, newest first, as returned by EmailAgent.fetch_price_buckets
+        since (float): Unix seconds; older buckets are left out
+        resolution (int): New bucket width in seconds, ideally a multiple of the current one
+    Returns:
+        list: Bucket rows, newest first
+    """
+    rows = [row for row in reversed(price_data) if to_epoch(row['timestamp']) > since]
+    if not rows:
+        return []
+    timestamps = np.array([to_epoch(row['timestamp']) for row in rows])
+    bucket_ids = np.floor(timestamps / resolution).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_ids)) + 1))
+    ends = np.concatenate((starts[1:], [len(rows)]))
+    high = np.array([row.get('high', row['price']) for row in rows], dtype=float)
+    low = np.array([row.get('low', row['price']) for row in rows], dtype=float)
+    samples = np.array([row.get('samples', 1) for row in rows], dtype=np.int64)
+    merged = []
+    for start, end in zip(starts[::-1], ends[::-1]):
+        close = float(rows[end - 1].get('close', rows[end - 1]['price']))
+        merged.append({
+            'timestamp': to_iso(bucket_ids[start] * float(resolution)),
+            'price': close,
+            'open': float(rows[start].get('open', rows[start]['price'])),
+            'high': float(high[start:end].max()),
+            'low': float(low[start:end].min()),
+            'close': close,
+            'samples': int(samples[start:end].sum())
+        })
+    return merged
+
+
+def window_stats(price_data):
+    """Market statistics for one window; runs in a worker process"""
+    return stats_from_price_data(price_data)
+
+
+def window_chart(price_data, title, currency='usd'):
+    """PNG chart for one window; runs in a worker process, which keeps its renderer between calls"""
+    global _renderer
+    if _renderer is None:
+        from chart_renderer import ChartRenderer
+        _renderer = ChartRenderer()
+    return _renderer.render_price_data(price_data, title, currency)
+
+
+class _InlineExecutor:
+    """Runs submitted work immediately, for when a process pool would cost more than it saves"""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _pair_label(asset, currency):
+    """Ticker, with the quote currency unless it is USD"""
+    from email_agent import asset_labels
+    ticker = asset_labels(asset)[1]
+    return ticker if currency == 'usd' else f"{ticker}/{currency.upper()}"
+
+
+def run_reports(agent, specs, news_data=None, workers=None, concurrency=None):
+    """
+    Build and send several reports from one fetch
+    Args:
+        agent (EmailAgent): Agent used for data access, analysis and delivery
+        specs (list): Report definitions, see load_specs
+        news_data (list): News rows stored earlier in this process (newest first); older news in the
+            longest window is still read from finance_info
+        workers (int): Processes for statistics and charts, defaults to REPORT_WORKERS
+        concurrency (int): Analyses generated at once, defaults to REPORT_LLM_CONCURRENCY
+    Returns:
+        bool: True if every report was sent
+    """
+    from email_agent import asset_labels
+    default_resolution = int(os.getenv('REPORT_RESOLUTION_SECONDS', '900'))
+    for spec in specs:
+        spec.setdefault('asset', 'bitcoin')
+        spec.setdefault('currency', 'usd')
+        spec.setdefault('resolution', default_resolution)
+
+    if not agent.authenticate():
+        return False
+
+    # Every window ends now, so each one is a suffix of the longest
+    now = time.time()
+    windows = {}
+    for spec in specs:
+        key = (spec['asset'], spec['currency'], spec['hours'], spec['resolution'])
+        windows.setdefault(key, []).append(spec)
+    print(f"Building {len(specs)} reports over {len(windows)} distinct windows")
+
+    with metrics.timed('fetch_recent_data'):
+        price_data = {}
+        for asset, currency in {key[:2] for key in windows}:
+            keys = [key for key in windows if key[:2] == (asset, currency)]
+            longest = max(key[2] for key in keys)
+            finest = min(key[3] for key in keys)
+            fetched = agent.fetch_price_buckets(to_iso(now - longest * 3600), finest, asset, currency)
+            print(f"{asset}/{currency}: {len(fetched)} buckets of {finest}s for the last {longest} hours")
+            for key in keys:
+                price_data[key] = rebucket(fetched, now - key[2] * 3600, key[3])
+
+        # This run's summaries come from memory; the rest of the longest window from Supabase
+        longest = max(key[2] for key in windows)
+        news_data = agent.fetch_news(to_iso(now - longest * 3600), news_data)
+    news_epochs = [to_epoch(news['timestamp']) for news in news_data]
+
+    keys = [key for key in windows if price_data[key]]
+    for key in windows:
+        if key not in keys:
+            print(f"No {key[0]}/{key[1]} prices in the last {key[2]} hours, skipping {len(windows[key])} reports")
+
+    workers = workers or int(os.getenv('REPORT_WORKERS', str(min(os.cpu_count() or 1, 4))))
+    if workers > 1 and len(keys) > 1:
+        # spawn: the parent has live threads (session refresh, writers) that fork would copy mid-flight
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(keys)), mp_context=multiprocessing.get_context('spawn'))
+    else:
+        pool = _InlineExecutor()
+    try:
+        stats_futures = {key: pool.submit(window_stats, price_data[key]) for key in keys}
+        chart_futures = {
+            key: pool.submit(window_chart, price_data[key], f"{_pair_label(key[0], key[1])} Price Over Time", key[1])
+            for key in keys
+        }
+
+        async def analyze_all():
+            semaphore = asyncio.Semaphore(concurrency or int(os.getenv('REPORT_LLM_CONCURRENCY', '4')))
+
+            async def analyze(key):
+                market_stats = await asyncio.wrap_future(stats_futures[key])
+                window_news = [news for news, at in zip(news_data, news_epochs) if at > now - key[2] * 3600]
+                if not window_news:
+                    print(f"No news in the last {key[2]} hours for the {key[0]}/{key[1]} reports")
+                    return key, None
+                async with semaphore:
+                    relevant = await asyncio.to_thread(
+                        agent.select_relevant_news, price_data[key], window_news, market_stats, key[0]
+                    )
+                    analysis = await asyncio.to_thread(
+                        agent.generate_analysis, price_data[key], relevant, market_stats, key[0], key[1]
+                    )
+                return key, analysis
+
+            return dict(await asyncio.gather(*[analyze(key) for key in keys]))
+
+        analyses = asyncio.run(analyze_all())
+        charts = {}
+        for key in keys:
+            try:
+                charts[key] = chart_futures[key].result()
+            except Exception as e:
+                print(f"Error rendering chart for {key[0]}/{key[1]} over {key[2]} hours: {e}")
+    finally:
+        pool.shutdown(wait=True)
+
+    messages = []
+    complete = len(keys) == len(windows)
+    for key in keys:
+        if not analyses.get(key) or key not in charts:
+            complete = False
+            continue
+        name, ticker = asset_labels(key[0])
+        for spec in windows[key]:
+            if 'recipients' in spec or 'recipients_file' in spec:
+                recipients = load_recipients(spec.get('recipients'), spec.get('recipients_file'))
+            else:
+                recipients = agent.recipients
+            title = spec.get('title') or f"{name} Market Analysis Report ({spec['name']})"
+            messages.extend(agent.build_messages(
+                recipients, analyses[key], charts[key], title, f"{ticker.lower()}_price_plot.png"
+            ))
+
+    if not messages:
+        print("No reports to send")
+        return False
+    return agent.deliver(messages) and complete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and send every report listed in REPORTS_CONFIG")
+    parser.add_argument('--config', help="Report definitions (JSON), defaults to REPORTS_CONFIG")
+    args = parser.parse_args()
+
+    load_dotenv(override=True)
+    from email_agent import EmailAgent
+    started = time.perf_counter()
+    ok = run_reports(EmailAgent(), load_specs(args.config))
+    print(f"Reports finished in {time.perf_counter() - started:.2f}s")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
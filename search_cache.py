@@ -0,0 +1,182 @@
+"""
+Local cache for Brave Search results.
+
+Results are keyed on the normalized query (case, punctuation, word order and
+filler words ignored) plus the remaining request params. How long an entry
+stays fresh follows the Brave freshness window it was requested with: a
+BRAVE_CACHE_TTL_FRACTION of the window (default 1/24, i.e. one hour for "pd").
+Expired entries are refreshed with a conditional request (If-None-Match /
+If-Modified-Since) when Brave sent validators. With stale-while-revalidate on
+(BRAVE_CACHE_STALE_WHILE_REVALIDATE, default on), an entry up to one TTL past
+expiry is returned immediately and refreshed in a background thread.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import metrics
+
+# Length in seconds of Brave's freshness filters
+FRESHNESS_WINDOWS = {
+    'pd': 24 * 3600,
+    'pw': 7 * 24 * 3600,
+    'pm': 31 * 24 * 3600,
+    'py': 365 * 24 * 3600,
+}
+
+STOP_WORDS = {'a', 'an', 'the', 'of', 'for', 'on', 'in', 'and', 'to', 'about', 'news'}
+
+
+def normalize_query(query):
+    """Reduce a query to its sorted set of meaningful words"""
+    words = (word.strip('.') for word in re.findall(r"[a-z0-9$%.]+", query.lower()))
+    return ' '.join(sorted({word for word in words if word and word not in STOP_WORDS}))
+
+
+class SearchCache:
+    """Freshness-aware Brave result cache backed by SQLite"""
+
+    def __init__(self, path=None, ttl_fraction=None, stale_while_revalidate=None, bypass=None):
+        self.path = path or os.getenv('BRAVE_CACHE_PATH', os.path.join('.cache', 'brave_search.sqlite'))
+        self.ttl_fraction = ttl_fraction if ttl_fraction is not None else \
+            float(os.getenv('BRAVE_CACHE_TTL_FRACTION', str(1 / 24)))
+        if stale_while_revalidate is None:
+            stale_while_revalidate = os.getenv('BRAVE_CACHE_STALE_WHILE_REVALIDATE', '1').lower() in ('1', 'true', 'yes')
+        self.stale_while_revalidate = stale_while_revalidate
+        if bypass is None:
+            bypass = os.getenv('BRAVE_CACHE_BYPASS', '').lower() in ('1', 'true', 'yes')
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_results (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(params):
+        """Hash the normalized query together with the other request params"""
+        normalized = dict(params)
+        normalized['q'] = normalize_query(normalized.get('q', ''))
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def ttl_for(self, params):
+        """Seconds a result stays fresh, derived from the requested freshness window"""
+        window = FRESHNESS_WINDOWS.get(params.get('freshness'), FRESHNESS_WINDOWS['pd'])
+        return window * self.ttl_fraction
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, etag, last_modified, fetched_at, expires_at FROM search_results WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'results': json.loads(row[0]),
+            'etag': row[1],
+            'last_modified': row[2],
+            'fetched_at': row[3],
+            'expires_at': row[4]
+        }
+
+    def _store(self, key, results, headers, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO search_results
+                   (key, results, etag, last_modified, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)""",
+                (key, json.dumps(results), headers.get('ETag'), headers.get('Last-Modified'), now, now + ttl)
+            )
+            # Anything past its stale window can never be served again
+            self._conn.execute("DELETE FROM search_results WHERE expires_at + (expires_at - fetched_at) < ?", (now,))
+            self._conn.commit()
+
+    def _touch(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE search_results SET fetched_at = ?, expires_at = ? WHERE key = ?", (now, now + ttl, key)
+            )
+            self._conn.commit()
+
+    def _refresh(self, key, params, fetch, entry):
+        """Fetch fresh results, revalidating the cached entry when possible"""
+        conditional_headers = {}
+        if entry and entry['etag']:
+            conditional_headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            conditional_headers['If-Modified-Since'] = entry['last_modified']
+
+        ttl = self.ttl_for(params)
+        response = fetch(conditional_headers)
+        if response.status_code == 304 and entry:
+            metrics.inc('cache_requests_total', cache='brave_search', result='revalidated')
+            self._touch(key, ttl)
+            return entry['results']
+
+        response.raise_for_status()
+        results = response.json()
+        self._store(key, results, response.headers, ttl)
+        return results
+
+    def _refresh_in_background(self, key, params, fetch, entry):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def worker():
+            try:
+                self._refresh(key, params, fetch, entry)
+            except Exception as e:
+                print(f"Background refresh failed for '{params.get('q')}': {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=worker, name=f"brave-refresh-{key[:8]}").start()
+
+    def get_or_fetch(self, params, fetch):
+        """
+        Return search results for params from the cache or from Brave
+        Args:
+            params (dict): Brave request params, including 'q' and 'freshness'
+            fetch (callable): Takes extra conditional headers and returns a requests.Response
+        Returns:
+            dict: Brave search results
+        """
+        key = self.make_key(params)
+        entry = None if self.bypass else self._lookup(key)
+        if entry:
+            now = time.time()
+            if now < entry['expires_at']:
+                metrics.inc('cache_requests_total', cache='brave_search', result='hit')
+                print(f"Using cached search results for '{params.get('q')}'")
+                return entry['results']
+            stale_until = entry['expires_at'] + (entry['expires_at'] - entry['fetched_at'])
+            if self.stale_while_revalidate and now < stale_until:
+                metrics.inc('cache_requests_total', cache='brave_search', result='stale')
+                print(f"Using stale search results for '{params.get('q')}' while refreshing")
+                self._refresh_in_background(key, params, fetch, entry)
+                return entry['results']
+
+        metrics.inc('cache_requests_total', cache='brave_search', result='miss')
+        return self._refresh(key, params, fetch, entry)
@@ -0,0 +1,10 @@
+-- Asset and quote currency of every btc_price row. The BTC agent writes both
+-- columns, and every reader filters on them so that a multi-asset sampler run
+-- (--assets bitcoin,ethereum --vs usd,eur) does not mix other pairs into the
+-- BTC/USD series. Rows written before this migration were all bitcoin/usd.
+-- Install once in the Supabase SQL editor, before sql/btc_price_ohlc.sql.
+alter table btc_price add column if not exists asset text not null default 'bitcoin';
+alter table btc_price add column if not exists currency text not null default 'usd';
+
+-- Readers page through one pair at a time in timestamp order
+create index if not exists btc_price_pair_timestamp_idx on btc_price (asset, currency, "timestamp");
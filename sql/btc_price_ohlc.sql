@@ -0,0 +1,43 @@
+-- OHLC buckets over btc_price for one asset/currency pair, used by
+-- EmailAgent.fetch_price_buckets. Install once in the Supabase SQL editor,
+-- after sql/btc_price_asset_currency.sql; the agent falls back to bucketing
+-- rows locally when the function is missing.
+
+-- The two-argument version read every pair; drop it so calls are not ambiguous
+drop function if exists btc_price_ohlc(timestamptz, integer);
+
+create or replace function btc_price_ohlc(
+    since timestamptz,
+    bucket_seconds integer,
+    price_asset text default 'bitcoin',
+    price_currency text default 'usd'
+)
+returns table (
+    bucket timestamptz,
+    open double precision,
+    high double precision,
+    low double precision,
+    close double precision,
+    samples bigint
+)
+language sql
+stable
+as $$
+    select
+        to_timestamp(floor(extract(epoch from "timestamp"::timestamptz) / bucket_seconds) * bucket_seconds) as bucket,
+        (array_agg(price order by "timestamp"))[1] as open,
+        max(price) as high,
+        min(price) as low,
+        (array_agg(price order by "timestamp" desc))[1] as close,
+        count(*) as samples
+    from btc_price
+    where "timestamp"::timestamptz > since
+      and asset = price_asset
+      and currency = price_currency
+    group by 1
+    order by 1 desc;
+$$;
+
+-- Keyset pagination and the aggregate both scan by time
+create index if not exists btc_price_timestamp_idx on btc_price ("timestamp");
+create index if not exists finance_info_timestamp_idx on finance_info ("timestamp");
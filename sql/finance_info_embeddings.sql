@@ -0,0 +1,33 @@
+-- pgvector storage for news summary embeddings, used when NEWS_INDEX_BACKEND=pgvector.
+-- Install once in the Supabase SQL editor. The dimension must match
+-- GEMINI_EMBEDDING_MODEL (768 for models/text-embedding-004).
+create extension if not exists vector;
+
+create table if not exists finance_info_embeddings (
+    content_hash text primary key,
+    info text not null,
+    "timestamp" timestamptz not null,
+    embedding vector(768) not null
+);
+
+create index if not exists finance_info_embeddings_embedding_idx
+    on finance_info_embeddings using hnsw (embedding vector_cosine_ops);
+create index if not exists finance_info_embeddings_timestamp_idx
+    on finance_info_embeddings ("timestamp");
+
+-- Top-k summaries by cosine similarity, stored after since
+create or replace function match_finance_info(query_embedding vector(768), match_count integer, since timestamptz)
+returns table (
+    info text,
+    "timestamp" timestamptz,
+    similarity double precision
+)
+language sql
+stable
+as $$
+    select info, "timestamp", 1 - (embedding <=> query_embedding) as similarity
+    from finance_info_embeddings
+    where "timestamp" > since
+    order by embedding <=> query_embedding
+    limit match_count;
+$$;
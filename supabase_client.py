@@ -0,0 +1,48 @@
+"""
+Shared, lazily created Supabase client.
+
+The supabase SDK is only imported when a client is first needed, and every
+agent in the process gets the same client and the same auth session (see
+auth_session), so the SDK import and the sign-in are paid once per process
+however many agents run.
+"""
+
+import threading
+from auth_session import SessionManager
+
+_clients = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_client(url, key):
+    """Return the process-wide Supabase client for this project, creating it on first use"""
+    with _lock:
+        if (url, key) not in _clients:
+            from supabase import create_client, ClientOptions
+            # Tokens are refreshed by SessionManager on a daemon timer instead of the SDK's own timer
+            _clients[(url, key)] = create_client(url, key, options=ClientOptions(auto_refresh_token=False))
+        return _clients[(url, key)]
+
+
+def get_session_manager(url, key, email, password):
+    """Return the process-wide session manager for this project and user"""
+    client = get_client(url, key)
+    with _lock:
+        if (url, key, email) not in _sessions:
+            _sessions[(url, key, email)] = SessionManager(client, url, email, password)
+        return _sessions[(url, key, email)]
+
+
+def authenticate(url, key, email, password):
+    """
+    Sign the shared client in, reusing a cached session when there is one
+    Args:
+        url (str): Supabase project URL
+        key (str): Supabase anon key
+        email (str): User email
+        password (str): User password
+    Returns:
+        bool: True if the client has an authenticated session
+    """
+    return get_session_manager(url, key, email, password).authenticate()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep test runs from writing .prom files into the working tree
+os.environ.setdefault('METRICS_ENABLED', '0')
@@ -0,0 +1,108 @@
+import os
+import json
+import pytest
+from buffered_writer import BufferedWriter
+from benchmarks.fakes import FakeApiError
+
+
+class FakeClient:
+    """Supabase client whose inserts fail with error(row) for the first row that has one"""
+
+    def __init__(self, error=lambda row: None):
+        self.error = error
+        self.stored = []
+        self.inserts = 0
+
+    def table(self, name):
+        return self
+
+    def insert(self, rows):
+        self.pending = rows
+        return self
+
+    def execute(self):
+        self.inserts += 1
+        for row in self.pending:
+            if self.error(row) is not None:
+                raise self.error(row)
+        self.stored.extend(self.pending)
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path)
+
+
+def writer(client, journal_dir, max_rows=8):
+    # A long flush interval keeps the background thread out of the way; tests flush explicitly
+    return BufferedWriter(client, 'btc_price', max_rows=max_rows, max_delay=3600, journal_dir=journal_dir)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_unknown_column_is_journaled_and_stored_once_the_migration_is_applied(journal_dir):
+    migrated = False
+    client = FakeClient(lambda row: None if migrated else FakeApiError('PGRST204', "unknown column 'asset'"))
+    first = writer(client, journal_dir)
+    first.write_many([{'price': 1.0, 'asset': 'bitcoin'}, {'price': 2.0, 'asset': 'bitcoin'}])
+
+    assert first.flush() is False
+    first.close()
+    assert read_lines(first.journal_path) == [{'price': 1.0, 'asset': 'bitcoin'}, {'price': 2.0, 'asset': 'bitcoin'}]
+
+    migrated = True
+    second = writer(client, journal_dir)
+    second.close()
+
+    assert [row['price'] for row in client.stored] == [1.0, 2.0]
+    assert not any(name.endswith('.rejected.jsonl') for name in os.listdir(journal_dir))
+
+
+def test_rejected_rows_are_isolated_by_halving_the_chunk(journal_dir):
+    not_null = FakeApiError('23502', 'null value in column "price"')
+    client = FakeClient(lambda row: not_null if row['price'] is None else None)
+    rows = [{'price': float(i)} for i in range(8)]
+    rows[2]['price'] = rows[5]['price'] = None
+    batch = writer(client, journal_dir)
+    batch.write_many(rows)
+
+    assert batch.flush() is True
+    batch.close()
+
+    assert [row['price'] for row in client.stored] == [0.0, 1.0, 3.0, 4.0, 6.0, 7.0]
+    assert [entry['row'] for entry in read_lines(batch.rejected_path)] == [{'price': None}, {'price': None}]
+    assert not os.path.exists(batch.journal_path)
+    assert client.inserts < 2 * len(rows)  # Halving, not one insert per row
+
+
+def test_interrupted_replay_is_merged_with_the_journal(journal_dir):
+    replaying = os.path.join(journal_dir, 'btc_price.jsonl.replaying')
+    journal = os.path.join(journal_dir, 'btc_price.jsonl')
+    with open(replaying, 'w') as f:
+        f.write(json.dumps({'price': 1.0}) + "\n" + json.dumps({'price': 2.0}) + "\n" + '{"price": 3')  # Cut short
+    with open(journal, 'w') as f:
+        f.write(json.dumps({'price': 4.0}) + "\n")
+    client = FakeClient()
+
+    writer(client, journal_dir).close()
+
+    assert [row['price'] for row in client.stored] == [1.0, 2.0, 4.0]
+    assert not os.path.exists(replaying)
+    assert not os.path.exists(journal)
+
+
+def test_outage_during_replay_keeps_every_row(journal_dir):
+    with open(os.path.join(journal_dir, 'btc_price.jsonl.replaying'), 'w') as f:
+        f.write(json.dumps({'price': 1.0}) + "\n")
+    with open(os.path.join(journal_dir, 'btc_price.jsonl'), 'w') as f:
+        f.write(json.dumps({'price': 2.0}) + "\n")
+    client = FakeClient(lambda row: FakeApiError(503, 'Service Unavailable'))
+
+    first = writer(client, journal_dir)
+    first.close()
+
+    assert client.stored == []
+    assert read_lines(first.journal_path) == [{'price': 1.0}, {'price': 2.0}]
@@ -0,0 +1,38 @@
+import numpy as np
+from matplotlib.axes import Axes
+from chart_renderer import ChartRenderer, lttb
+
+
+def test_lttb_keeps_everything_when_under_the_threshold():
+    np.testing.assert_array_equal(lttb(np.arange(5.0), np.zeros(5), 10), np.arange(5))
+
+
+def test_lttb_keeps_endpoints_and_threshold_points_in_order():
+    x = np.arange(1000.0)
+    y = np.sin(x / 50)
+    kept = lttb(x, y, 100)
+
+    assert len(kept) == 100
+    assert kept[0] == 0 and kept[-1] == 999
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_lttb_keeps_spikes():
+    x = np.arange(500.0)
+    y = np.zeros(500)
+    y[123], y[377] = 50.0, -50.0
+    kept = lttb(x, y, 20)
+
+    assert 123 in kept and 377 in kept
+
+
+def test_price_axis_is_labelled_with_the_quote_currency(tmp_path, monkeypatch):
+    labels = []
+    monkeypatch.setattr(Axes, 'set_ylabel', lambda axes, label, **kwargs: labels.append(label))
+    renderer = ChartRenderer(cache_dir=str(tmp_path))
+    price_data = [{'timestamp': f"2024-05-01T00:{minute:02d}:00", 'price': 50000.0 + minute} for minute in range(5)]
+
+    renderer.render_price_data(price_data, 'BTC Price Over Time')
+    renderer.render_price_data(price_data, 'BTC Price Over Time', 'eur')  # Same series and title, not a cache hit
+
+    assert labels == ['Price (USD)', 'Price (EUR)']
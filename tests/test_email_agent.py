@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import pytest
+import email_agent
+from email_agent import EmailAgent
+from benchmarks.fakes import CallCounter, FakeSupabase
+
+START = datetime(2024, 5, 1)
+
+
+@pytest.fixture
+def agent():
+    agent = EmailAgent.__new__(EmailAgent)  # Skip the environment checks; only data access is tested
+    agent.supabase = FakeSupabase(CallCounter())
+    return agent
+
+
+def seed(supabase, timestamps, **columns):
+    supabase.tables['btc_price'] = [
+        supabase._with_id({'timestamp': timestamp.isoformat(), 'price': float(i), **columns})
+        for i, timestamp in enumerate(timestamps)
+    ]
+
+
+@pytest.mark.parametrize('page_size', [1, 2, 3, 4, 7, 100])
+def test_fetch_keyset_returns_every_row_once_across_tied_timestamps(agent, page_size):
+    # Four rows per timestamp, as a sampler writing two assets in two currencies does per poll
+    seed(agent.supabase, [START + timedelta(minutes=minute) for minute in range(5) for _ in range(4)])
+
+    since = (START - timedelta(minutes=1)).isoformat()
+    rows = agent._fetch_keyset('btc_price', 'timestamp,price', since, page_size=page_size)
+
+    assert sorted(row['id'] for row in rows) == list(range(1, 21))
+    assert [row['timestamp'] for row in rows] == sorted(row['timestamp'] for row in rows)
+
+
+def test_fetch_keyset_since_is_exclusive_and_until_inclusive(agent):
+    seed(agent.supabase, [START + timedelta(minutes=minute) for minute in range(10)])
+
+    rows = agent._fetch_keyset(
+        'btc_price', 'timestamp,price', (START + timedelta(minutes=2)).isoformat(), page_size=3,
+        until=(START + timedelta(minutes=6)).isoformat()
+    )
+
+    assert [row['price'] for row in rows] == [3.0, 4.0, 5.0, 6.0]
+
+
+def test_fetch_keyset_applies_filters_on_every_page(agent):
+    timestamps = [START + timedelta(minutes=minute) for minute in range(6)]
+    seed(agent.supabase, timestamps, asset='bitcoin', currency='usd')
+    agent.supabase.tables['btc_price'] += [
+        agent.supabase._with_id({'timestamp': timestamp.isoformat(), 'price': 1.0, 'asset': 'ethereum',
+                                 'currency': 'usd'})
+        for timestamp in timestamps
+    ]
+
+    rows = agent._fetch_keyset('btc_price', 'timestamp,price', START.isoformat(), page_size=2,
+                               filters={'asset': 'bitcoin', 'currency': 'usd'})
+
+    assert [row['price'] for row in rows] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_news_index_is_opened_once_across_threads(agent, monkeypatch):
+    opened = []
+
+    def open_index(supabase):
+        time.sleep(0.05)  # Widen the window in which a second thread could see no index yet
+        opened.append(object())
+        return opened[-1]
+
+    monkeypatch.setattr(email_agent, 'open_index', open_index)
+    agent._news_index = None
+    agent._index_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        indices = list(pool.map(lambda _: agent.news_index, range(3)))
+
+    assert len(opened) == 1
+    assert all(index is opened[0] for index in indices)
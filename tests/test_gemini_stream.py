@@ -0,0 +1,92 @@
+import time
+import threading
+from types import SimpleNamespace
+import pytest
+import rate_limiter
+from rate_limiter import CallCancelled, call_with_retry
+from gemini_stream import _chunk_text, stream_text
+from benchmarks.fakes import FakeApiError
+
+
+class FakeLimiter:
+    """Token bucket stand-in whose acquire runs a hook, e.g. to simulate time spent queued"""
+
+    def __init__(self, on_acquire=lambda: None):
+        self.on_acquire = on_acquire
+
+    def acquire(self, tokens=1):
+        self.on_acquire()
+
+    def pause(self, seconds):
+        pass
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = FakeLimiter()
+    monkeypatch.setattr(rate_limiter, 'get_limiter', lambda name: limiter)
+    return limiter
+
+
+def chunk(*texts):
+    parts = [SimpleNamespace(text=text) for text in texts]
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))], usage_metadata=None)
+
+
+class NoTextResponse:
+    """A response whose .text raises, as the SDK does when there is no candidate"""
+    candidates = None
+
+    @property
+    def text(self):
+        raise ValueError("response has no candidates")
+
+
+def test_chunk_text_joins_parts_and_is_empty_without_them():
+    assert _chunk_text(chunk("hello ", "world")) == "hello world"
+    assert _chunk_text(chunk()) == ""
+    assert _chunk_text(SimpleNamespace(candidates=[])) == ""
+    assert _chunk_text(NoTextResponse()) == ""
+
+
+def test_stream_keeps_text_when_the_last_chunk_has_no_parts(limiter):
+    model = SimpleNamespace(generate_content=lambda prompt, **options: iter([chunk("hello "), chunk("world"), chunk()]))
+
+    text, stats = stream_text(model, "prompt", first_token_timeout=5, total_timeout=5)
+
+    assert text == "hello world"
+    assert stats['first_token'] is not None
+
+
+def test_failed_call_is_not_retried_once_cancelled(limiter):
+    cancelled = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        cancelled.set()  # The caller gives up while this attempt is in flight
+        raise FakeApiError(503, "Service Unavailable")
+
+    with pytest.raises(FakeApiError):
+        call_with_retry('gemini', generate, cancelled=cancelled)
+    assert len(calls) == 1
+
+
+def test_call_cancelled_while_queued_is_never_sent(limiter):
+    cancelled = threading.Event()
+    limiter.on_acquire = cancelled.set
+    calls = []
+
+    with pytest.raises(CallCancelled):
+        call_with_retry('gemini', lambda: calls.append(1), cancelled=cancelled)
+    assert calls == []
+
+
+def test_time_waiting_for_a_token_does_not_count_against_the_budget(limiter):
+    limiter.on_acquire = lambda: time.sleep(0.3)
+    model = SimpleNamespace(generate_content=lambda prompt, **options: iter([chunk("hello")]))
+
+    text, stats = stream_text(model, "prompt", first_token_timeout=0.2, total_timeout=0.2)
+
+    assert text == "hello"
+    assert stats['total'] < 0.2
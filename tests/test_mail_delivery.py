@@ -0,0 +1,91 @@
+import os
+import smtplib
+from email.mime.text import MIMEText
+import pytest
+from mail_delivery import Mailer
+
+
+class FakeConnection:
+    """Stands in for a logged-in smtplib.SMTP; sendmail raises the queued errors first"""
+
+    def __init__(self, delivered, errors):
+        self.delivered = delivered
+        self.errors = errors
+
+    def sendmail(self, sender, recipients, message):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.delivered.extend(recipients)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def mailer(tmp_path, monkeypatch):
+    monkeypatch.setattr('mail_delivery.backoff_delay', lambda attempt: 0)
+    mailer = Mailer('sender@example.com', 'password', workers=1, max_retries=2, outbox_dir=str(tmp_path))
+    mailer.delivered, mailer.errors, mailer.logins = [], [], 0
+
+    def connect():
+        mailer.logins += 1
+        return FakeConnection(mailer.delivered, mailer.errors)
+
+    monkeypatch.setattr(mailer, '_connect', connect)
+    return mailer
+
+
+def messages(*addresses):
+    return [(address, MIMEText(f"Report for {address}")) for address in addresses]
+
+
+def test_new_report_replaces_outbox_message_for_the_same_recipient(mailer):
+    mailer._spill([
+        {'to': 'a@example.com', 'queued_at': 1e12, 'message': b'stale report'},
+        {'to': 'b@example.com', 'queued_at': 1e12, 'message': b'stale report'}
+    ])
+
+    sent, undelivered = mailer.send_all(messages('A@example.com', 'c@example.com'))
+
+    assert (sent, undelivered) == (3, 0)
+    assert sorted(mailer.delivered) == ['A@example.com', 'b@example.com', 'c@example.com']
+
+
+def test_failed_login_stops_the_pool_and_saves_every_message(mailer, monkeypatch):
+    def connect():
+        mailer.logins += 1
+        raise smtplib.SMTPAuthenticationError(535, b'5.7.8 Username and Password not accepted')
+
+    monkeypatch.setattr(mailer, '_connect', connect)
+    mailer.workers = 4
+
+    sent, undelivered = mailer.send_all(messages(*[f"user{i}@example.com" for i in range(20)]))
+
+    assert (sent, undelivered) == (0, 20)
+    assert mailer.logins <= mailer.workers  # At most one attempt per worker, never one per message
+    assert len(mailer._take_outbox()) == 20
+
+
+@pytest.mark.parametrize('error', [
+    smtplib.SMTPSenderRefused(553, b'5.7.1 Sender address rejected', 'sender@example.com'),
+    smtplib.SMTPDataError(554, b'5.7.0 Message rejected as spam'),
+    smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'5.1.1 No such user')})
+])
+def test_permanent_rejection_is_not_retried(mailer, error):
+    mailer.errors.append(error)
+
+    sent, undelivered = mailer.send_all(messages('a@example.com', 'b@example.com'))
+
+    assert (sent, undelivered) == (1, 0)
+    assert mailer.delivered == ['b@example.com']
+    assert not os.path.exists(mailer.outbox_path)
+
+
+def test_temporary_rejection_is_retried(mailer):
+    mailer.errors.append(smtplib.SMTPDataError(451, b'4.3.0 Temporary failure'))
+
+    assert mailer.send_all(messages('a@example.com')) == (1, 0)
+    assert mailer.delivered == ['a@example.com']
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from price_store import PriceStore, ohlc, to_iso, to_epoch
+
+START = 1714521600.0  # 2024-05-01T00:00:00Z
+
+
+class FakeTable:
+    """fetch_rows for PriceStore.sync over an in-memory list of rows"""
+
+    def __init__(self, timestamps):
+        self.rows = [{'timestamp': to_iso(t), 'price': float(t - START)} for t in timestamps]
+        self.calls = []
+
+    def __call__(self, since, until=None):
+        self.calls.append((since, until))
+        since, until = to_epoch(since), to_epoch(until) if until else None
+        rows = [row for row in self.rows if to_epoch(row['timestamp']) > since
+                and (until is None or to_epoch(row['timestamp']) <= until)]
+        return sorted(rows, key=lambda row: to_epoch(row['timestamp']))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PriceStore(str(tmp_path))
+
+
+def test_sync_then_incremental_sync_only_adds_new_rows(store):
+    table = FakeTable([START + 60 * i for i in range(10)])
+    assert store.sync(table, START + 60 * 4) == 5
+
+    table.rows.append({'timestamp': to_iso(START + 600), 'price': 600.0})
+    assert store.sync(table, START + 60 * 4) == 1
+
+    timestamps, prices = store.columns()
+    np.testing.assert_array_equal(timestamps, START + 60 * np.arange(5, 11))
+    np.testing.assert_array_equal(prices, 60 * np.arange(5, 11))
+
+
+def test_sync_backfills_when_the_window_grows_backwards(store):
+    table = FakeTable([START + 60 * i for i in range(10)])
+    store.sync(table, START + 60 * 6)
+    assert store.sync(table, START - 1) == 7
+
+    # The backfill asks only for the missing range, and the columns stay sorted and unique
+    assert table.calls[-2] == (to_iso(START - 1), to_iso(START + 60 * 6))
+    timestamps, _ = store.columns()
+    np.testing.assert_array_equal(timestamps, START + 60 * np.arange(10))
+
+    # Once synced from the earlier start, later windows need no backfill
+    calls = len(table.calls)
+    assert store.sync(table, START + 60 * 3) == 0
+    assert len(table.calls) == calls + 1
+
+
+def test_stores_for_different_pairs_are_separate(tmp_path):
+    bitcoin = PriceStore(str(tmp_path))
+    ether = PriceStore(str(tmp_path), asset='ethereum')
+    bitcoin.sync(FakeTable([START + 60]), START)
+    assert len(bitcoin.columns()[0]) == 1
+    assert len(ether.columns()[0]) == 0
+
+
+def test_resample_matches_ohlc_over_the_window(store):
+    store.sync(FakeTable([START + 60 * i for i in range(30)]), START - 1)
+    candles = store.resample(START + 60 * 9, 300)
+
+    np.testing.assert_array_equal(candles['bucket'], START + 300 * np.arange(2, 6))
+    np.testing.assert_array_equal(candles['samples'], [5, 5, 5, 5])
+    np.testing.assert_array_equal(candles['open'], [600, 900, 1200, 1500])
+    np.testing.assert_array_equal(candles['close'], [840, 1140, 1440, 1740])
+
+
+def test_ohlc_of_an_empty_series_is_empty():
+    candles = ohlc(np.empty(0), np.empty(0), 60)
+    assert all(len(column) == 0 for column in candles.values())
+
+
+def test_sync_picks_up_rows_that_arrive_late(store):
+    table = FakeTable([START + 60 * i for i in range(0, 10, 2)])
+    store.sync(table, START - 1)
+
+    # Replayed from a journal after newer rows were already synced
+    table.rows.append({'timestamp': to_iso(START + 60 * 3), 'price': 180.0})
+    assert store.sync(table, START - 1) == 1
+    assert store.sync(table, START - 1) == 0
+
+    timestamps, prices = store.columns()
+    np.testing.assert_array_equal(timestamps, START + 60 * np.array([0, 2, 3, 4, 6, 8]))
+    np.testing.assert_array_equal(prices, [0, 120, 180, 240, 360, 480])
+
+
+def test_sync_only_rereads_the_overlap(store):
+    table = FakeTable([START + 60 * i for i in range(100)])
+    store.sync(table, START - 1)
+    store.overlap = 600
+
+    table.rows.append({'timestamp': to_iso(START + 60), 'price': 1.0})  # Too late to be picked up
+    assert store.sync(table, START - 1) == 0
+    assert table.calls[-1] == (to_iso(START + 60 * 99 - 600), None)
@@ -0,0 +1,43 @@
+from price_store import to_iso, to_epoch
+from reports import rebucket
+
+START = 1714521600.0  # 2024-05-01T00:00:00Z
+
+
+def buckets(count, width=60):
+    """Report rows newest first, as EmailAgent.fetch_price_buckets returns them"""
+    rows = []
+    for i in range(count):
+        rows.append({'timestamp': to_iso(START + width * i), 'price': 100.0 + i, 'open': 99.5 + i,
+                     'high': 101.0 + i, 'low': 99.0 + i, 'close': 100.0 + i, 'samples': 2})
+    return rows[::-1]
+
+
+def test_rebucket_merges_into_coarser_buckets():
+    merged = rebucket(buckets(10), START - 1, 300)
+
+    assert [to_epoch(row['timestamp']) for row in merged] == [START + 300, START]
+    newest, oldest = merged
+    assert oldest == {'timestamp': to_iso(START), 'price': 104.0, 'open': 99.5, 'high': 105.0, 'low': 99.0,
+                      'close': 104.0, 'samples': 10}
+    assert (newest['open'], newest['high'], newest['low'], newest['close']) == (104.5, 110.0, 104.0, 109.0)
+
+
+def test_rebucket_leaves_out_buckets_at_or_before_since():
+    merged = rebucket(buckets(10), START + 60 * 4, 300)
+
+    assert [row['samples'] for row in merged] == [10]
+    assert merged[0]['open'] == 104.5
+
+
+def test_rebucket_accepts_plain_price_rows():
+    rows = [{'timestamp': to_iso(START + 60 * i), 'price': float(i)} for i in range(4)][::-1]
+    merged = rebucket(rows, START - 1, 120)
+
+    assert [(row['open'], row['high'], row['low'], row['close'], row['samples']) for row in merged] == [
+        (2.0, 3.0, 2.0, 3.0, 2), (0.0, 1.0, 0.0, 1.0, 2)
+    ]
+
+
+def test_rebucket_of_nothing_is_empty():
+    assert rebucket(buckets(3), START + 3600, 300) == []